@@ -0,0 +1,62 @@
+# audit.py
+import re
+
+# Ключи, значения которых считаются паролями или секретами
+KEY_PATTERN = re.compile('pass|key|пароль|ключ')
+MIN_PASSWORD_LENGTH = 8
+# Классы символов пароля; проверяются одним проходом по строке
+_CHAR_CLASSES = re.compile('([0-9])|([A-ZА-ЯЁ])|([a-zа-яё])|([@$!%*#?&])')
+_DIGIT, _UPPER, _LOWER, _SPECIAL = 1, 2, 3, 4
+_ALL_CLASSES = {_DIGIT, _UPPER, _LOWER, _SPECIAL}
+_CLASS_PROBLEMS = (
+    (_DIGIT, "В пароле нет цифр"),
+    (_UPPER, "В пароле нет заглавных букв"),
+    (_LOWER, "В пароле нет строчных букв"),
+    (_SPECIAL, "В пароле нет спецсимволов"),
+)
+# О ходе обхода сообщается через столько узлов
+PROGRESS_STEP = 10000
+
+
+# Все нарушения требований к паролю; пустой список - пароль надёжный
+def check_password(password):
+    problems = []
+    if len(password) < MIN_PASSWORD_LENGTH:
+        problems.append(f"Пароль короче {MIN_PASSWORD_LENGTH} символов")
+    found = set()
+    for match in _CHAR_CLASSES.finditer(password):
+        found.add(match.lastindex)
+        if len(found) == len(_ALL_CLASSES):
+            break
+    problems.extend(message for char_class, message in _CLASS_PROBLEMS if char_class not in found)
+    return problems
+
+
+# Один нерекурсивный обход документа: пары (путь, описание нарушений) для каждого
+# ненадёжного пароля. В XML паролем считается и значение атрибута, и текст элемента
+def iter_findings(data, progress=None):
+    stack = [((), data)]
+    count = 0
+    while stack:
+        path, body = stack.pop()
+        count += 1
+        if progress and count % PROGRESS_STEP == 0:
+            progress(count)
+        if isinstance(body, dict):
+            items = body.items()
+        elif isinstance(body, list):
+            items = enumerate(body)
+        else:
+            continue
+        children = []
+        for key, value in items:
+            if isinstance(key, str) and KEY_PATTERN.search(key):
+                secret = value.get('#text') if isinstance(value, dict) else value
+                if isinstance(secret, str):
+                    problems = check_password(secret)
+                    if problems:
+                        yield path + (key,), "; ".join(problems)
+            if isinstance(value, (dict, list)):
+                children.append((path + (key,), value))
+        # Дети кладутся в обратном порядке, чтобы находки шли в порядке документа
+        stack.extend(reversed(children))
@@ -0,0 +1,80 @@
+# bench_memory.py
+# Сравнение памяти и времени загрузки JSON в разных режимах модели:
+#   python bench_memory.py                     - на сгенерированном файле из 200000 записей
+#   python bench_memory.py --records 1000000
+#   python bench_memory.py data.json
+# Память считается через tracemalloc: "занято" - что остаётся после загрузки,
+# "пик" - максимум по ходу загрузки. Время - без tracemalloc
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from model import DataModel
+
+MODES = (
+    ("dict и list", {"lazy": False, "compact": False}),
+    ("потоковый (lazyjson)", {"lazy": True, "compact": False}),
+    ("компактный (nodestore)", {"compact": True}),
+)
+
+
+# Файл из записей, похожих на типичную выгрузку: массив объектов с вложенными полями
+def generate(file_path, records, seed=1):
+    rnd = random.Random(seed)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write('[')
+        for i in range(records):
+            record = {
+                "id": i,
+                "name": f"user{i}",
+                "email": f"user{i}@example.com",
+                "active": rnd.random() < 0.5,
+                "score": round(rnd.random() * 100, 2),
+                "tags": rnd.sample(["red", "green", "blue", "admin", "guest"], 2),
+                "address": {"city": rnd.choice(["Москва", "Казань", "Томск"]), "zip": f"{rnd.randrange(10 ** 6):06d}"},
+            }
+            file.write((',' if i else '') + json.dumps(record, ensure_ascii=False))
+        file.write(']')
+
+
+# Время меряется отдельной загрузкой: под tracemalloc каждое выделение памяти в разы медленнее
+def measure(file_path, options):
+    started = time.perf_counter()
+    DataModel().load_json(file_path, **options)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    model = DataModel()
+    model.load_json(file_path, **options)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+    return current, peak, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Память модели при загрузке JSON в разных режимах.")
+    parser.add_argument("file", nargs="?", help="JSON файл (по умолчанию генерируется)")
+    parser.add_argument("--records", type=int, default=200000, help="число записей в сгенерированном файле")
+    args = parser.parse_args(argv)
+
+    file_path = args.file
+    if file_path is None:
+        file_path = os.path.join(tempfile.mkdtemp(), "bench.json")
+        generate(file_path, args.records)
+    size = os.path.getsize(file_path)
+    print(f"Файл: {file_path}, {size / 2 ** 20:.1f} МБ")
+    print(f"{'режим':<24}{'занято, МБ':>12}{'x файла':>10}{'пик, МБ':>10}{'время, с':>10}")
+    for title, options in MODES:
+        current, peak, elapsed = measure(file_path, options)
+        print(f"{title:<24}{current / 2 ** 20:>12.1f}{current / size:>10.1f}{peak / 2 ** 20:>10.1f}{elapsed:>10.2f}")
+    if args.file is None:
+        os.remove(file_path)
+        os.rmdir(os.path.dirname(file_path))
+
+
+if __name__ == "__main__":
+    main()
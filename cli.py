@@ -0,0 +1,193 @@
+# cli.py
+# Пакетная обработка файлов без графического интерфейса:
+#   python cli.py validate schema.json data/ "more/*.json" -j 8 -o report.json
+#   python cli.py audit data/ -o findings.jsonl --format jsonl
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from model import DataModel
+from schemacache import schema_cache
+
+# Сколько файлов отдаётся процессу за раз: меньше накладных расходов на передачу задач
+MAX_CHUNK_SIZE = 64
+
+
+# Тип схемы по расширению: JSON Schema проверяет JSON файлы, XSD - XML
+def schema_kind(schema_path):
+    return 'xml' if schema_path.lower().endswith('.xsd') else 'json'
+
+
+# Файлы для проверки: каталоги обходятся рекурсивно (берутся файлы с расширениями
+# extensions), остальные аргументы - пути или шаблоны glob
+def collect_files(sources, extensions, exclude=()):
+    exclude = {os.path.abspath(path) for path in exclude}
+    files = []
+    seen = set()
+    for source in sources:
+        if os.path.isdir(source):
+            found = (os.path.join(root, name)
+                     for root, _, names in os.walk(source)
+                     for name in sorted(names) if name.lower().endswith(extensions))
+        else:
+            found = sorted(glob.glob(source, recursive=True)) or [source]
+        for path in found:
+            key = os.path.abspath(path)
+            if key not in seen and key not in exclude:
+                seen.add(key)
+                files.append(path)
+    return files
+
+
+def _init_worker(schema_path):
+    # Схема компилируется один раз на процесс и дальше берётся из кэша
+    if schema_kind(schema_path) == 'xml':
+        schema_cache.xml_schema(schema_path)
+    else:
+        schema_cache.json_validator(schema_path)
+
+
+# Проверка одного файла в процессе пула
+def validate_file(file_path, schema_path, max_errors=None):
+    model = DataModel()
+    try:
+        if schema_kind(schema_path) == 'xml':
+            # Дерево lxml проверяется по XSD без преобразования в словари
+            model.load_xml(file_path, native=True)
+        else:
+            model.load_json(file_path)
+        errors = [{"path": list(path), "message": message}
+                  for path, message in islice(model.iter_validation_errors(schema_path), max_errors)]
+    except Exception as e:
+        return {"file": file_path, "valid": False, "error": str(e)}
+    return {"file": file_path, "valid": not errors, "errors": errors}
+
+
+# Проверка паролей одного файла в процессе пула
+def audit_file(file_path, max_errors=None):
+    model = DataModel()
+    try:
+        if file_path.lower().endswith('.xml'):
+            model.load_xml(file_path)
+        else:
+            model.load_json(file_path)
+        findings = [{"path": list(path), "message": message}
+                    for path, message in islice(model.audit_passwords(), max_errors)]
+    except Exception as e:
+        return {"file": file_path, "valid": False, "error": str(e)}
+    return {"file": file_path, "valid": not findings, "errors": findings}
+
+
+def _run_chunk(args):
+    func, files, func_args = args
+    return [func(file_path, *func_args) for file_path in files]
+
+
+# Обработка файлов функцией func(файл, *func_args) в пуле процессов.
+# Результаты выдаются в порядке файлов
+def process_files(func, files, func_args=(), jobs=None, initializer=None, initargs=()):
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1:
+        if initializer:
+            initializer(*initargs)
+        for file_path in files:
+            yield func(file_path, *func_args)
+        return
+    chunk_size = max(1, min(MAX_CHUNK_SIZE, len(files) // (jobs * 4)))
+    chunks = [(func, files[i:i + chunk_size], func_args) for i in range(0, len(files), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as pool:
+        for results in pool.map(_run_chunk, chunks):
+            yield from results
+
+
+def validate_files(files, schema_path, jobs=None, max_errors=None):
+    return process_files(validate_file, files, (schema_path, max_errors), jobs,
+                         initializer=_init_worker, initargs=(schema_path,))
+
+
+def audit_files(files, jobs=None, max_errors=None):
+    return process_files(audit_file, files, (max_errors,), jobs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка JSON и XML файлов.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    validate = commands.add_parser("validate", help="валидация по JSON Schema или XSD")
+    validate.add_argument("schema", help="файл схемы: .json (JSON Schema) или .xsd")
+    audit = commands.add_parser("audit", help="проверка надёжности паролей и секретов")
+    for command in (validate, audit):
+        command.add_argument("sources", nargs="+", help="файлы, каталоги или шаблоны glob")
+        command.add_argument("-j", "--jobs", type=int, default=None,
+                             help="число процессов (по умолчанию - число ядер)")
+        command.add_argument("-o", "--output", default="-", help="файл отчёта (по умолчанию stdout)")
+        command.add_argument("--format", choices=("json", "jsonl"), default="json",
+                             help="json - один документ со сводкой, jsonl - строка на файл")
+        command.add_argument("--max-errors", type=int, default=None,
+                             help="сколько ошибок сообщать на файл (по умолчанию все)")
+    return parser.parse_args(argv)
+
+
+# Отчёт по результатам обработки файлов. Возвращает сводку
+def write_report(results, output, report_format, header):
+    summary = {"files": 0, "valid": 0, "invalid": 0, "failed": 0}
+    if report_format == "json":
+        # Поля заголовка, затем массив результатов в том же объекте
+        output.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "results": [\n')
+    for index, result in enumerate(results):
+        summary["files"] += 1
+        if "error" in result:
+            summary["failed"] += 1
+        elif result["valid"]:
+            summary["valid"] += 1
+        else:
+            summary["invalid"] += 1
+        line = json.dumps(result, ensure_ascii=False)
+        if report_format == "json":
+            output.write((",\n" if index else "") + line)
+        else:
+            output.write(line + "\n")
+    if report_format == "json":
+        output.write(f'\n], "summary": {json.dumps(summary)}}}\n')
+    return summary
+
+
+# Код возврата: 0 - все файлы валидны, 1 - есть невалидные, 2 - файлы не найдены или не прочитаны
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "validate":
+        try:
+            _init_worker(args.schema)
+        except Exception as e:
+            print(f"Не удалось загрузить схему: {e}", file=sys.stderr)
+            return 2
+        files = collect_files(args.sources, '.' + schema_kind(args.schema), exclude=[args.schema])
+        results = validate_files(files, args.schema, args.jobs, args.max_errors)
+        header = {"schema": args.schema}
+    else:
+        files = collect_files(args.sources, ('.json', '.xml'))
+        results = audit_files(files, args.jobs, args.max_errors)
+        header = {"audit": "passwords"}
+    if not files:
+        print("Нет файлов для проверки.", file=sys.stderr)
+        return 2
+
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        summary = write_report(results, output, args.format, header)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Файлов: {summary['files']}, валидных: {summary['valid']}, "
+          f"невалидных: {summary['invalid']}, с ошибками чтения: {summary['failed']}", file=sys.stderr)
+
+    if summary["failed"]:
+        return 2
+    return 1 if summary["invalid"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,19 @@
 # controller.py
 import json
+import time
+from functools import partial
 from tkinter import filedialog
 
+import diff
+import patch
 from model import DataModel
+from worker import BackgroundTask
+
+# Период опроса фоновой задачи из потока интерфейса, мс
+POLL_INTERVAL = 100
+MEGABYTE = 1024 * 1024
+# Сколько найденных узлов показывается в списке результатов и выделяется в дереве
+MAX_SHOWN_RESULTS = 1000
 
 
 class Controller:
@@ -10,9 +21,18 @@ class Controller:
         self.model = model
         self.view = view
         self.view.set_controller(self)
+        # Схема последней проверки текущего документа, для повторной проверки изменений
+        self.last_schema_path = None
+        # Выполняющаяся фоновая операция и обработчики её результатов
+        self.task = None
+        self._task_handlers = None
+        # Пути узлов, найденных последним поиском или запросом, и последнее выражение запроса
+        self.results = []
+        self.last_query = ""
 
     # Открытие файла
-    def open_file(self, file_type):
+    # browse=True - JSON открывается для просмотра по структурному индексу (DataModel.load_json, mapped)
+    def open_file(self, file_type, browse=False):
         filetypes = [("All Files", "*.*")]
         if file_type == "json":
             filetypes = [("JSON Files", "*.json"), ("All Files", "*.*")]
@@ -22,18 +42,306 @@ class Controller:
             filetypes=filetypes
         )
         if file_path:
+            # Файл загружается в фоне во временную модель: при ошибке или отмене
+            # открытый документ остаётся как был
+            loaded = DataModel()
+            if file_type == "json":
+                load = partial(loaded.load_json, mapped=browse)
+            else:
+                load = partial(self._load_xml, loaded)
+            self.run_task("Загрузка", "bytes", partial(self._load, load, loaded, file_path),
+                          on_done=lambda task: self._file_opened(task, file_type, loaded))
+
+    # Загрузка и проигрывание несохранённых правок прошлого сеанса из журнала
+    # (DataModel.open_journal). Возвращает (число проигранных правок, ошибка или None)
+    def _load(self, load, model, file_path, progress):
+        load(file_path, progress=progress)
+        return model.open_journal()
+
+    # XML открывается в режиме lxml. Словарное представление нужно дереву в окне,
+    # поэтому оно строится здесь же, в фоне, а не при первом обращении из интерфейса
+    def _load_xml(self, model, file_path, progress):
+        model.load_xml(file_path, progress=progress, native=True)
+        model.data
+
+    def _file_opened(self, task, file_type, loaded):
+        if task.error is not None or task.cancelled:
+            # Загрузка могла успеть открыть журнал и проиграть в модель правки из него
+            loaded.close()
+            if task.error is not None:
+                self.view.show_error("Ошибка", f"Не удалось открыть файл: {task.error}")
+            return
+        self.model.take_document(loaded)
+        self.view.current_file_type = file_type
+        self.last_schema_path = None
+        self.view.clear_validation_errors()
+        self.view.clear_differences()
+        self.results = []
+        self.view.clear_search_results()
+        self.view.populate_tree(self.model.data)
+        self.view.buttons["validate_btn"].config(state="normal")
+        # self.view.show_message("Успех", f"Файл '{file_path}' успешно открыт.")
+        replayed, error = task.result
+        if error is not None:
+            self.view.show_error("Журнал правок", f"Восстановлено несохранённых правок: {replayed}. "
+                                                  f"Остальные не применились: {error}")
+        elif replayed:
+            self.view.show_message("Журнал правок", f"Восстановлено несохранённых правок прошлого сеанса: "
+                                                    f"{replayed}. В файл они запишутся при сохранении.")
+        # Поисковый индекс строится в фоне сразу после загрузки. В потоковом и компактном
+        # режимах и при просмотре он разобрал бы весь файл и занял бы больше памяти, чем
+        # сам документ, поэтому строится только при первом поиске
+        if not self.model.lazy:
+            self.run_task("Индексация", "nodes", self.model.build_search_index,
+                          on_done=self._search_index_built)
+
+    # Поиск по ключам и значениям. Если индекс не построен (построение отменили),
+    # он строится, и поиск выполняется после этого
+    def search(self, query):
+        if self.model.data_type is None:
+            self.view.show_error("Ошибка", "Сначала откройте файл XML или JSON.")
+            return
+        if self.model.search_index is None:
+            self.run_task("Индексация", "nodes", self.model.build_search_index,
+                          on_done=lambda task: self._search_index_built(task, query))
+            return
+        start = time.perf_counter()
+        total, paths = self.model.search(query)
+        elapsed = time.perf_counter() - start
+        self.results = paths
+        self.view.show_search_results(paths, total)
+        self.view.show_status(f"Поиск: найдено {total} за {elapsed * 1000:.0f} мс")
+
+    def _search_index_built(self, task, query=None):
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось построить поисковый индекс: {task.error}")
+        elif not task.cancelled and query is not None:
+            self.search(query)
+
+    # Запрос JSONPath к JSON или XPath к XML; найденные узлы попадают в список результатов
+    def run_query(self):
+        if self.model.data_type is None:
+            self.view.show_error("Ошибка", "Сначала откройте файл XML или JSON.")
+            return
+        language = "JSONPath" if self.model.data_type == "json" else "XPath"
+        expression = self.view.prompt_user(f"Введите выражение {language}:", initialvalue=self.last_query)
+        if not expression:
+            return
+        self.last_query = expression
+        found = []
+        self.run_task("Запрос", "nodes", partial(self.model.query, expression),
+                      on_items=found.extend, on_done=lambda task: self._query_done(task, found))
+
+    def _query_done(self, task, found):
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось выполнить запрос: {task.error}")
+            return
+        self.results = found
+        self.view.show_search_results(found[:MAX_SHOWN_RESULTS], len(found), title="Результаты запроса")
+        stopped = " (запрос остановлен)" if task.cancelled else ""
+        self.view.show_status(f"Запрос: найдено {len(found)}{stopped}")
+
+    def select_results(self):
+        if not self.results:
+            self.view.show_error("Ошибка", "Нет найденных узлов: выполните поиск или запрос.")
+            return
+        self.view.select_nodes(self.results[:MAX_SHOWN_RESULTS])
+
+    # Одно значение для всех найденных узлов; тип значения каждого узла сохраняется
+    def edit_results_value(self):
+        if self.is_busy():
+            return
+        if not self.results:
+            self.view.show_error("Ошибка", "Нет найденных узлов: выполните поиск или запрос.")
+            return
+        new_val = self.view.prompt_user(f"Новое значение для найденных узлов ({len(self.results)}):")
+        if new_val is None:
+            return
+        operations = []
+        skipped = []
+        for path in self.results:
             try:
-                if file_type == "json":
-                    self.model.load_json(file_path)
-                    self.view.current_file_type = 'json'
-                elif file_type == "xml":
-                    self.model.load_xml(file_path)
-                    self.view.current_file_type = 'xml'
-                self.view.populate_tree(self.model.data)
-                self.view.buttons["validate_btn"].config(state="normal")
-                # self.view.show_message("Успех", f"Файл '{file_path}' успешно открыт.")
-            except Exception as e:
-                self.view.show_error("Ошибка", f"Не удалось открыть файл: {e}")
+                old_value = self.model.get_node(path)
+            except (KeyError, IndexError, TypeError):
+                skipped.append(f"{' > '.join(map(str, path))}: узла уже нет.")
+                continue
+            if isinstance(old_value, (dict, list)) and self.model.data_type == "json":
+                skipped.append(f"{' > '.join(map(str, path))}: значение объекта или списка изменить нельзя.")
+                continue
+            operations.append(('update_node_value', path, self._convert_like(old_value, new_val)))
+        self._apply_batch(operations, "Изменение найденных", skipped)
+
+    # Замена подстроки во всех строковых значениях документа: узлы ищутся в фоне,
+    # замена выполняется одним пакетом правок
+    def replace_all(self):
+        if self.is_busy():
+            return
+        if self.model.data_type is None:
+            self.view.show_error("Ошибка", "Нет открытого документа.")
+            return
+        old = self.view.prompt_user("Найти в значениях:")
+        if not old:
+            return
+        new = self.view.prompt_user(f"Заменить «{old}» на:")
+        if new is None:
+            return
+        self.run_task("Поиск замен", "nodes", partial(self.model.replacements, old, new),
+                      on_done=lambda task: self._replacements_found(task, old))
+
+    def _replacements_found(self, task, old):
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось выполнить замену: {task.error}")
+            return
+        if task.cancelled:
+            return
+        if not task.result:
+            self.view.show_message("Замена", f"Значений с «{old}» не найдено.")
+            return
+        self._apply_batch(task.result, "Замена")
+
+    # Пакет правок (DataModel.apply_batch): одна транзакция и один шаг отмены, дерево
+    # перерисовывается один раз. skipped - описания узлов, отброшенных до пакета.
+    # apply - метод модели, выполняющий пакет (по умолчанию apply_batch)
+    def _apply_batch(self, operations, title, skipped=(), apply=None):
+        try:
+            paths = (apply or self.model.apply_batch)(operations, title)
+        except Exception as e:
+            self.view.show_error(title, str(e))
+            return
+        # Перерисовка дерева с сохранением раскрытых узлов
+        self.view.populate_tree(self.model.data)
+        self.view.select_nodes(paths[:MAX_SHOWN_RESULTS])
+        message = f"Изменено узлов: {len(paths)}."
+        if skipped:
+            message += f"\nНе изменено: {len(skipped)}, например:\n" + "\n".join(skipped[:5])
+            self.view.show_error(title, message)
+        else:
+            self.view.show_message("Успех", message)
+        self._check_journal()
+
+    # Применение JSON Patch (RFC 6902) из файла одной транзакцией, как пакет правок
+    def apply_patch_file(self):
+        if self.is_busy():
+            return
+        if self.model.data_type != "json":
+            self.view.show_error("Ошибка", "JSON Patch применяется только к открытому JSON документу.")
+            return
+        file_path = filedialog.askopenfilename(
+            filetypes=[("JSON Patch", "*.json *.json-patch"), ("All Files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            operations = patch.load(file_path)
+        except (OSError, ValueError) as e:
+            self.view.show_error("Ошибка", f"Не удалось прочитать JSON Patch: {e}")
+            return
+        self._apply_batch(operations, "JSON Patch", apply=self.model.apply_patch)
+
+    # Выгрузка правок, которые можно отменить, в файл JSON Patch: вместо всего документа
+    # можно передать только изменения
+    def export_patch(self):
+        if self.is_busy():
+            return
+        if self.model.data_type != "json":
+            self.view.show_error("Ошибка", "Правки выгружаются в JSON Patch только для JSON документа.")
+            return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON Patch", "*.json *.json-patch"), ("All Files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            count = self.model.save_patch(file_path)
+        except (OSError, ValueError) as e:
+            self.view.show_error("Ошибка", f"Не удалось выгрузить правки: {e}")
+            return
+        self.view.show_message("Успех", f"Операций JSON Patch: {count}. Файл '{file_path}' сохранён.")
+
+    # Сравнение открытого документа с другой версией файла (diff.py). Открытый документ
+    # считается новым: различия отмечаются в его дереве и перечисляются в списке результатов
+    def compare_with_file(self):
+        if self.is_busy():
+            return
+        if self.model.data_type is None:
+            self.view.show_error("Ошибка", "Нет открытого документа.")
+            return
+        if self.model.data_type == "json":
+            filetypes = [("JSON Files", "*.json"), ("All Files", "*.*")]
+        else:
+            filetypes = [("XML Files", "*.xml"), ("All Files", "*.*")]
+        file_path = filedialog.askopenfilename(filetypes=filetypes)
+        if file_path:
+            self.run_task("Сравнение", "nodes", partial(self._compare, file_path), on_done=self._compared)
+
+    def _compare(self, file_path, progress):
+        other = DataModel()
+        if self.model.data_type == "json":
+            other.load_json(file_path, progress=progress)
+        else:
+            self._load_xml(other, file_path, progress)
+        return diff.diff(other, self.model, progress)
+
+    def _compared(self, task):
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось сравнить документы: {task.error}")
+            return
+        if task.cancelled:
+            return
+        differences = task.result
+        # Найденными считаются узлы, которые есть в открытом документе
+        self.results = [new_path for kind, _, new_path in differences if kind != 'removed']
+        self.view.show_differences(differences[:MAX_SHOWN_RESULTS], len(differences))
+        if differences:
+            self.view.show_status(f"Различий: {len(differences)}.")
+        else:
+            self.view.show_message("Сравнение", "Документы совпадают.")
+
+    # Отмена и повтор правки: дерево перерисовывается с сохранением раскрытых узлов,
+    # затронутые узлы выделяются
+    def undo(self):
+        self._history_step(self.model.undo, "Отменено")
+
+    def redo(self):
+        self._history_step(self.model.redo, "Повторено")
+
+    def _history_step(self, step, done):
+        if self.is_busy():
+            return
+        try:
+            title, paths = step()
+        except IndexError as e:
+            self.view.show_status(str(e))
+            return
+        except Exception as e:
+            self.view.show_error("Ошибка", str(e))
+            return
+        self.view.populate_tree(self.model.data)
+        self.view.select_nodes(paths[:MAX_SHOWN_RESULTS])
+        self.view.show_status(f"{done}: {title.lower()}")
+        self._check_journal()
+
+    # Если правка не записалась в журнал, журнал отключён (DataModel.take_journal_error):
+    # без сообщения пользователь считал бы, что правки восстановятся после сбоя
+    def _check_journal(self):
+        error = self.model.take_journal_error()
+        if error is not None:
+            self.view.show_error("Журнал правок", f"Не удалось записать правку в журнал: {error}\n"
+                                                  f"Журнал отключён: после сбоя несохранённые правки "
+                                                  f"не восстановятся. Сохраните документ.")
+
+    # Текст нового значения в типе прежнего значения узла
+    def _convert_like(self, old_value, text):
+        if isinstance(old_value, bool):
+            return text.lower() == "true"
+        if isinstance(old_value, int):
+            return int(text)
+        if isinstance(old_value, float):
+            return float(text)
+        if old_value is None:
+            return None
+        return text
 
     def get_available_types(self):
         if self.model.data_type == "json":
@@ -102,8 +410,8 @@ class Controller:
             change_val = False
         elif 'node' in tags:
             node_type = "Node"
-            path = self.get_path_from_tree_item(item)
-            change_val = not self.model.xml_have_child_nodes(path)
+            parent, _ = self.view.node_ref(item)
+            change_val = not self.model.xml_have_child_nodes(self.get_path(item), parent=parent)
         else:
             node_type = "Unknown"
 
@@ -113,7 +421,7 @@ class Controller:
         return {"key": key, "value": value, "type": node_type, "change_key": change_key, "change_val": change_val}
 
     # Сохранение файла
-    def save_file(self, as_new=False):
+    def save_file(self, as_new=False, compact=False):
         if not self.model.file_path or as_new:
             if self.model.data_type == 'json':
                 file_types = [("JSON Files", "*.json"), ("All Files", "*.*")]
@@ -130,61 +438,65 @@ class Controller:
             )
             if not file_path:
                 return
-            self.model.file_path = file_path
-        try:
-            if self.model.data_type == "json":
-                self.model.save_json()
-            elif self.model.data_type == "xml":
-                self.model.save_xml()
+        else:
+            file_path = self.model.file_path
+        # Путь модели меняется только после успешной записи
+        if self.model.data_type == "json":
+            self.run_task("Сохранение", "bytes", partial(self.model.save_json, file_path, compact=compact),
+                          on_done=self._file_saved)
+        elif self.model.data_type == "xml":
+            self.run_task("Сохранение", "nodes", partial(self.model.save_xml, file_path),
+                          on_done=self._file_saved)
+        else:
+            self.view.show_message("Успех", f"Файл '{file_path}' успешно сохранён.")
+
+    def _file_saved(self, task):
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось сохранить файл: {task.error}")
+        elif task.cancelled:
+            self.view.show_message("Сохранение", "Сохранение отменено, файл не изменён.")
+        else:
+            # Представление XML после сохранения строится заново (DataModel._saved)
+            if self.view.data is not self.model.data:
+                self.results = []
+                self.view.clear_search_results()
+                self.view.populate_tree(self.model.data)
+                self.run_task("Индексация", "nodes", self.model.build_search_index,
+                              on_done=self._search_index_built)
             self.view.show_message("Успех", f"Файл '{self.model.file_path}' успешно сохранён.")
-        except Exception as e:
-            self.view.show_error("Ошибка", f"Не удалось сохранить файл: {e}")
 
     # Удаление узла
     def delete_node(self):
+        if self.is_busy():
+            return
         selected_item = self.view.tree.selection()
         if not selected_item:
             self.view.show_error("Ошибка", "Выберите узел для удаления.")
             return
         path = self.get_path(selected_item[0])
-        key = self.view.tree.item(selected_item[0], 'text')
+        # Ключ узла в модели берётся из реестра строк: текст строки
+        # может отличаться от него (номер повторяющегося элемента, индекс списка)
+        parent, key = self.view.node_ref(selected_item[0])
         # Определение типа узла по тегам
         tags = self.view.tree.item(selected_item[0], 'tags')
         if 'attribute' in tags:
             node_type = 'attribute'
-            key = key  # Атрибут уже содержит '@'
         elif 'comment' in tags:
             node_type = 'comment'
-            # Для комментариев ключ — индекс в списке
-            key = self.view.tree.index(selected_item[0], parent=self.view.tree.parent(selected_item[0]))
         elif 'processing_instruction' in tags:
             node_type = 'processing_instruction'
-            # Для инструкций обработки ключ — индекс в списке
-            key = self.view.tree.index(selected_item[0], parent=self.view.tree.parent(selected_item[0]))
-        elif 'list' in tags:
-            node_type = 'list'
-            try:
-                key = int(key.strip('[]'))
-            except ValueError:
-                self.view.show_error("Ошибка", "Некорректный индекс элемента списка.")
-                return
         elif 'text' in tags:
             node_type = 'value'
-            key = '#text'
+        elif isinstance(key, int):
+            # Для узлов в списках, например, [0], [1], и т.д.
+            node_type = 'list'
         else:
             node_type = 'node'
-            # Для узлов в списках, например, [0], [1], и т.д.
-            if key.startswith('[') and key.endswith(']'):
-                node_type = 'list'
-                try:
-                    key = int(key.strip('[]'))
-                except ValueError:
-                    self.view.show_error("Ошибка", "Некорректный индекс элемента списка.")
-                    return
         try:
-            self.model.delete_node(path, key, node_type=node_type)
-            self.view.populate_tree(self.model.data)
+            self.model.delete_node(path, key, node_type=node_type, parent=parent)
+            self.view.remove_node(selected_item[0], path)
             self.view.show_message("Успех", "Узел успешно удалён.")
+            self._check_journal()
         except KeyError as e:
             self.view.show_error("Ошибка", str(e))
         except TypeError as e:
@@ -195,20 +507,24 @@ class Controller:
     def update_node(self, path, key, value, node_type='node'):
         try:
             self.model.update_node(path, key, value, node_type)
-            self.view.populate_tree(self.model.data)
+            self.view.refresh_node(self.view.tree.selection()[0], path)
             self.view.show_message("Успех", "Узел успешно обновлен.")
+            self._check_journal()
         except KeyError as e:
             self.view.show_error("Ошибка обновления узла", str(e))
         except Exception as e:
             self.view.show_error("Неизвестная ошибка", str(e))
 
     def add_node_action(self, key, value, node_type):
+        if self.is_busy():
+            return
         selected_item = self.view.tree.selection()
         if not selected_item:
             self.view.show_error("Ошибка", "Выберите родительский узел для добавления.")
             return
 
-        path = self.get_path_from_tree_item(selected_item[0])
+        path = self.get_path(selected_item[0])
+        parent, _ = self.view.node_ref(selected_item[0])
         try:
             if node_type == "number":
                 value = int(value)
@@ -217,13 +533,16 @@ class Controller:
             elif node_type == "null":
                 value = None
 
-            self.model.add_node(path, key, value, node_type)
-            self.view.populate_tree(self.model.data)
+            key = self.model.add_node(path, key, value, node_type, parent=parent)
+            self.view.insert_node(selected_item[0], path, key)
             self.view.show_message("Успех", "Узел успешно добавлен.")
+            self._check_journal()
         except Exception as e:
             self.view.show_error("Ошибка добавления узла", str(e))
 
     def edit_node_key(self):
+        if self.is_busy():
+            return
         selected_item = self.view.tree.selection()
         if not selected_item:
             self.view.show_error("Ошибка", "Выберите узел для изменения.")
@@ -252,9 +571,12 @@ class Controller:
             return
 
         try:
-            self.model.update_node_key(self.get_path(item), new_key)
-            self.view.populate_tree(self.model.data)
+            path = self.get_path(item)
+            parent, _ = self.view.node_ref(item)
+            new_key = self.model.update_node_key(path, new_key, parent=parent)
+            self.view.rename_node(item, path, new_key)
             self.view.show_message("Успех", "Узел успешно изменён.")
+            self._check_journal()
         except KeyError as e:
             self.view.show_error("Ошибка", str(e))
         except TypeError as e:
@@ -263,6 +585,8 @@ class Controller:
             self.view.show_error("Ошибка", f"Не удалось изменить узел: {e}")
 
     def edit_node_value(self):
+        if self.is_busy():
+            return
         selected_item = self.view.tree.selection()
         if not selected_item:
             self.view.show_error("Ошибка", "Выберите узел для изменения.")
@@ -285,9 +609,12 @@ class Controller:
             return
         try:
             converted_new_val = self.view.convert_by_type_tags(tags, new_val)
-            self.model.update_node_value(self.get_path(item), converted_new_val)
-            self.view.populate_tree(self.model.data)
+            path = self.get_path(item)
+            parent, _ = self.view.node_ref(item)
+            self.model.update_node_value(path, converted_new_val, parent=parent)
+            self.view.refresh_node(item, path)
             self.view.show_message("Успех", "Узел успешно изменён.")
+            self._check_journal()
         except KeyError as e:
             self.view.show_error("Ошибка", str(e))
         except TypeError as e:
@@ -358,22 +685,14 @@ class Controller:
             )
             if not schema_path:
                 return
-            try:
-                if self.model.data_type == "json":
-                    with open(schema_path, 'r', encoding='utf-8') as file:
-                        schema = json.load(file)
-                    is_valid, message = self.model.validate_json(schema)
-                elif self.model.data_type == "xml":
-                    is_valid, message = self.model.validate_xml(schema_path)
-                else:
-                    self.view.show_error("Ошибка", "Не поддерживаемый тип данных.")
-                    return
-                if is_valid:
-                    self.view.show_message("Валидация", message)
-                else:
-                    self.view.show_error("Валидация", message)
-            except Exception as e:
-                self.view.show_error("Ошибка", f"Не удалось выполнить валидацию: {e}")
+            self.last_schema_path = schema_path
+            self.run_validation(schema_path)
+        elif target == "changes":
+            # Проверка только изменённых поддеревьев по схеме последней проверки
+            if not self.last_schema_path:
+                self.view.show_error("Ошибка", "Документ ещё не проверялся по схеме.")
+                return
+            self.run_validation(self.last_schema_path, incremental=True)
         elif target == "other":
             # Приоритет типов файлов в зависимости от открытого файла
             if self.model.data_type == 'json':
@@ -388,51 +707,144 @@ class Controller:
             )
             if not file_path:
                 return
-            try:
-                if file_path.endswith('.json'):
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        data = json.load(file)
-                    # Выбор схемы JSON
-                    schema_path = filedialog.askopenfilename(
-                        title="Выберите JSON Schema",
-                        filetypes=[("JSON Schema", "*.json"), ("All Files", "*.*")]
-                    )
-                    if not schema_path:
-                        return
-                    with open(schema_path, 'r', encoding='utf-8') as file:
-                        schema = json.load(file)
-                    is_valid, message = self.model.validate_json(schema)
-                    if is_valid:
-                        self.view.show_message("Валидация", "JSON файл валиден.")
-                    else:
-                        self.view.show_error("Валидация", message)
-                elif file_path.endswith('.xml'):
-                    # Выбор схемы XML
-                    schema_path = filedialog.askopenfilename(
-                        title="Выберите XML Schema",
-                        filetypes=[("XML Schema", "*.xsd"), ("All Files", "*.*")]
-                    )
-                    if not schema_path:
-                        return
-                    temp_model = DataModel()
-                    temp_model.load_xml(file_path)
-                    is_valid, message = temp_model.validate_xml(schema_path)
-                    if is_valid:
-                        self.view.show_message("Валидация", "XML файл валиден.")
-                    else:
-                        self.view.show_error("Валидация", message)
-                else:
-                    self.view.show_error("Ошибка", "Неподдерживаемый формат файла для валидации.")
-                    return
-            except Exception as e:
-                self.view.show_error("Валидация", f"Файл не валиден: {e}")
+            if file_path.endswith('.json'):
+                # Выбор схемы JSON
+                schema_path = filedialog.askopenfilename(
+                    title="Выберите JSON Schema",
+                    filetypes=[("JSON Schema", "*.json"), ("All Files", "*.*")]
+                )
+            elif file_path.endswith('.xml'):
+                # Выбор схемы XML
+                schema_path = filedialog.askopenfilename(
+                    title="Выберите XML Schema",
+                    filetypes=[("XML Schema", "*.xsd"), ("All Files", "*.*")]
+                )
+            else:
+                self.view.show_error("Ошибка", "Неподдерживаемый формат файла для валидации.")
+                return
+            if not schema_path:
+                return
+            self.run_task("Проверка", "bytes", partial(self._validate_other, file_path, schema_path),
+                          on_done=self._other_validated)
         elif target == "pass":
-            try:
-                self.model.validate_all_pass()
-                self.view.show_message("Валидация", "Пароли в файле соответствуют требованиям безопасности.")
+            # Все ненадёжные пароли попадают в список ошибок и отмечаются в дереве
+            if self.is_busy():
                 return
-            except Exception as e:
-                self.view.show_error("Валидация", f"Файл не валиден:\n{e}")
+            self.view.clear_validation_errors()
+            self.run_task("Проверка паролей", "nodes", self.model.audit_passwords,
+                          on_items=self.view.add_validation_errors, on_done=self._passwords_validated)
+
+    # Проверка другого файла во временной модели (выполняется в фоне)
+    def _validate_other(self, file_path, schema_path, progress):
+        temp_model = DataModel()
+        if file_path.endswith('.json'):
+            temp_model.load_json(file_path, progress=progress)
+            is_valid, message = temp_model.validate_json(schema_path)
+            return is_valid, "JSON файл валиден." if is_valid else message
+        temp_model.load_xml(file_path, progress=progress, native=True)
+        is_valid, message = temp_model.validate_xml(schema_path)
+        return is_valid, "XML файл валиден." if is_valid else message
+
+    def _other_validated(self, task):
+        if task.error is not None:
+            self.view.show_error("Валидация", f"Файл не валиден: {task.error}")
+        elif not task.cancelled:
+            is_valid, message = task.result
+            if is_valid:
+                self.view.show_message("Валидация", message)
+            else:
+                self.view.show_error("Валидация", message)
+
+    def _passwords_validated(self, task):
+        count = len(self.view.validation_errors)
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось проверить пароли: {task.error}")
+        elif task.cancelled:
+            return
+        elif count:
+            self.view.show_error("Валидация", f"Файл не валиден: ненадёжных паролей - {count}.")
+        else:
+            self.view.show_message("Валидация", "Пароли в файле соответствуют требованиям безопасности.")
+
+    # Проверка текущего документа по схеме в фоновом потоке.
+    # Ошибки появляются в списке и отмечаются в дереве по мере проверки
+    def run_validation(self, schema_path, incremental=False):
+        if self.model.data_type not in ("json", "xml"):
+            self.view.show_error("Ошибка", "Не поддерживаемый тип данных.")
+            return
+        if self.is_busy():
+            return
+        self.view.clear_validation_errors()
+        self.run_task("Проверка", "nodes", partial(self.model.iter_validation_errors, schema_path, incremental),
+                      on_items=self.view.add_validation_errors, on_done=self._validation_done)
+
+    def _validation_done(self, task):
+        count = len(self.view.validation_errors)
+        if task.error is not None:
+            self.view.show_error("Ошибка", f"Не удалось выполнить валидацию: {task.error}")
+        elif task.cancelled:
+            self.view.show_message("Валидация", f"Проверка остановлена. Найдено ошибок: {count}.")
+        elif count:
+            self.view.show_error("Валидация", f"Документ не валиден. Найдено ошибок: {count}.")
+        else:
+            valid_type = "JSON" if self.model.data_type == "json" else "XML"
+            self.view.show_message("Валидация", f"{valid_type} валиден.")
+
+    # Запуск длительной операции в рабочем потоке с индикатором в строке состояния.
+    # func получает аргумент progress; unit - в чём он считает: "bytes" или "nodes".
+    # on_items получает порции значений генератора, on_done - завершённую задачу
+    def run_task(self, title, unit, func, on_items=None, on_done=None):
+        if self.is_busy():
+            return
+        self.task = BackgroundTask(func)
+        self._task_handlers = (title, unit, on_items, on_done)
+        self.view.start_progress(title)
+        self.view.after(POLL_INTERVAL, self._poll_task)
+
+    def _poll_task(self):
+        task = self.task
+        if task is None:
+            return
+        title, unit, on_items, on_done = self._task_handlers
+        items = task.poll()
+        if items and on_items and not task.cancelled:
+            on_items(items)
+        if task.progress is not None:
+            self.view.update_progress(*self._progress_text(title, unit, *task.progress))
+        if not task.done:
+            self.view.after(POLL_INTERVAL, self._poll_task)
+            return
+        self.task = None
+        self._task_handlers = None
+        self.view.stop_progress("Операция отменена." if task.cancelled else "")
+        if on_done:
+            on_done(task)
+
+    def _progress_text(self, title, unit, done, total):
+        fraction = min(done / total, 1.0) if total else None
+        if unit == "bytes":
+            text = f"{title}: {done / MEGABYTE:.1f} МБ"
+            if total:
+                text += f" из {total / MEGABYTE:.1f} МБ"
+        else:
+            text = f"{title}: обработано {done}"
+        return text, fraction
+
+    # Пока идёт фоновая операция, документ менять нельзя
+    def is_busy(self):
+        if self.task is not None:
+            self.view.show_error("Ошибка", "Дождитесь окончания операции или отмените её.")
+            return True
+        return False
+
+    # Завершение работы: фоновая операция останавливается, журнал правок дописывается на диск
+    def close(self):
+        self.cancel_task()
+        self.model.close_journal()
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
 
     def edit_xml_declaration(self):
         version = self.view.prompt_user("Введите версию XML:",
@@ -446,28 +858,9 @@ class Controller:
         self.model.xml_declaration = {"version": version, "encoding": encoding, "standalone": standalone}
         self.view.show_message("Успех", "XML декларация обновлена.")
 
-    # Получение пути к выбранному узлу
+    # Получение пути к выбранному узлу по реестру строк представления
     def get_path(self, item):
-        path = []
-        while item:
-            parent = self.view.tree.parent(item)
-            text = self.view.tree.item(item, 'text')
-            tags = self.view.tree.item(item, 'tags')
-
-            if text.startswith('[') and text.endswith(']'):
-                # Список
-                try:
-                    index = int(text.strip('[]'))
-                    path.insert(0, index)
-                except ValueError:
-                    # Некорректный индекс
-                    path.insert(0, text)
-            else:
-                true_key = tags[1]
-                path.insert(0, true_key)
-
-            item = parent
-        return path
+        return list(self.view.item_path(item))
 
     # Отображение деталей выбранного узла
     def display_details(self, item):
@@ -506,8 +899,9 @@ class Controller:
 
         try:
             self.model.update_node(path, key, value, node_type=node_type)
-            self.view.populate_tree(self.model.data)
+            self.view.refresh_node(item, path)
             self.view.show_message("Успех", "Изменения успешно сохранены.")
+            self._check_journal()
         except KeyError as e:
             self.view.show_error("Ошибка", str(e))
         except TypeError as e:
@@ -516,16 +910,4 @@ class Controller:
             self.view.show_error("Ошибка", f"Не удалось сохранить изменения: {e}")
 
     def get_path_from_tree_item(self, item):
-        path = []
-        while item:
-            parent = self.view.tree.parent(item)
-            text = self.view.tree.item(item, "text")
-
-            # Если текст узла - индекс списка ([0], [1], ...), преобразуем в число
-            if text.startswith("[") and text.endswith("]"):
-                path.insert(0, int(text[1:-1]))
-            else:
-                path.insert(0, text)
-
-            item = parent
-        return path
+        return self.get_path(item)
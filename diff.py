@@ -0,0 +1,277 @@
+# diff.py
+# Структурное сравнение двух документов (моделей DataModel одного типа).
+# У каждого объекта и массива считается хэш содержимого (blake2b от хэшей детей, как в дереве
+# Меркла), поэтому совпадающие поддеревья пропускаются целиком, а спуск идёт только туда,
+# где хэши различаются. Элементы массивов и повторяющиеся элементы XML сопоставляются по хэшу:
+# вставка в начало массива не делает изменёнными все следующие элементы.
+# Порядок ключей объекта JSON и атрибутов XML на результат не влияет, порядок элементов - влияет.
+#
+# Различие - (вид, путь в старом документе, путь в новом):
+#   'added'   - узла нет в старом документе; путь в старом - путь контейнера, куда он добавлен
+#   'removed' - узла нет в новом; путь в новом - путь контейнера, откуда он удалён
+#   'changed' - значение узла изменилось (у объектов и массивов - только если изменился тип)
+#   'moved'   - тот же узел на другом месте среди соседей
+import hashlib
+from collections import defaultdict, deque
+from bisect import bisect_left
+
+from lazyjson import LazyValue
+from model import PROGRESS_STEP, xml_tag
+
+KINDS = ('added', 'removed', 'changed', 'moved')
+_CONTAINERS = (dict, list)
+# Объекты и массивы из простых значений с repr не длиннее этого сравниваются по самому repr
+SHORT_LEAF = 64
+
+
+# Различия между документами моделей old и new. progress(число узлов) вызывается по ходу
+# подсчёта хэшей: он проходит оба документа, остальное - только по различающимся поддеревьям
+def diff(old, new, progress=None):
+    if old.data_type != new.data_type:
+        raise ValueError("Сравнивать можно только документы одного типа.")
+    return _Differ(old.data_type == "xml", progress).compare(old.data, new.data)
+
+
+# Вид контейнера: 'dict', 'list' или None для простого значения
+def _kind(value):
+    if isinstance(value, dict):
+        return 'dict'
+    if isinstance(value, list):
+        return 'list'
+    if isinstance(value, LazyValue):
+        return value.kind
+    return None
+
+
+# Наибольшая возрастающая по старым индексам подпоследовательность пар (старый, новый),
+# упорядоченных по новому: эти пары остались на своих местах, остальные переставлены
+def _stable(matches):
+    tails = []
+    tail_at = []
+    previous = [None] * len(matches)
+    for i, (old_index, _) in enumerate(matches):
+        j = bisect_left(tails, old_index)
+        if j:
+            previous[i] = tail_at[j - 1]
+        if j == len(tails):
+            tails.append(old_index)
+            tail_at.append(i)
+        else:
+            tails[j] = old_index
+            tail_at[j] = i
+    stable = []
+    i = tail_at[-1] if tail_at else None
+    while i is not None:
+        stable.append(matches[i])
+        i = previous[i]
+    stable.reverse()
+    return stable
+
+
+class _Differ:
+    def __init__(self, xml, progress=None):
+        self.xml = xml
+        self.progress = progress
+        # id контейнера -> (контейнер, хэш). Ссылка на контейнер не даёт id достаться другому объекту
+        self._tokens = {}
+        self._count = 0
+        # Типы вложенных узлов: контейнеры и ленивые поддеревья всех видов
+        self._nested = {dict, list, LazyValue}
+        subclasses = LazyValue.__subclasses__()
+        while subclasses:
+            cls = subclasses.pop()
+            self._nested.add(cls)
+            subclasses.extend(cls.__subclasses__())
+        self.differences = []
+
+    def compare(self, old, new):
+        stack = []
+        self._pair(old, new, (), (), stack)
+        while stack:
+            old, new, old_path, new_path = stack.pop()
+            pairs = []
+            old, new = self._open(old), self._open(new)
+            if isinstance(old, list):
+                self._compare_sequences(list(enumerate(old)), list(enumerate(new)), old_path, new_path, pairs)
+            elif self.xml:
+                self._compare_keyed(old, new, old_path, new_path, pairs, lambda key: key[0] == '@' or key == '#text')
+                self._compare_sequences([(key, old[key]) for key in old if key[0] != '@' and key != '#text'],
+                                        [(key, new[key]) for key in new if key[0] != '@' and key != '#text'],
+                                        old_path, new_path, pairs)
+            else:
+                self._compare_keyed(old, new, old_path, new_path, pairs)
+            stack.extend(reversed(pairs))
+        return self.differences
+
+    # Пара узлов с одним местом в обоих документах: совпадают, различаются внутри или заменены
+    def _pair(self, old, new, old_path, new_path, pairs):
+        if self._token(old) == self._token(new):
+            return
+        kind = _kind(old)
+        if kind is not None and kind == _kind(new):
+            pairs.append((old, new, old_path, new_path))
+        else:
+            self.differences.append(('changed', old_path, new_path))
+
+    # Объекты: дети сопоставляются по ключу. keyed(ключ) - какие ключи сравниваются так
+    def _compare_keyed(self, old, new, old_path, new_path, pairs, keyed=None):
+        for key in old:
+            if key not in new and (keyed is None or keyed(key)):
+                self.differences.append(('removed', old_path + (key,), new_path))
+        for key in new:
+            if keyed is not None and not keyed(key):
+                continue
+            if key in old:
+                self._pair(old[key], new[key], old_path + (key,), new_path + (key,), pairs)
+            else:
+                self.differences.append(('added', old_path, new_path + (key,)))
+
+    # Последовательности (ключ, значение): элементы массива или дети элемента XML.
+    # Общие начало и конец отбрасываются, в середине элементы с одинаковым хэшем
+    # (и тегом XML) сопоставляются друг с другом, а оставшиеся между ними - по порядку
+    def _compare_sequences(self, old, new, old_path, new_path, pairs):
+        old_ids = [self._identity(key, value) for key, value in old]
+        new_ids = [self._identity(key, value) for key, value in new]
+        start = 0
+        while start < len(old) and start < len(new) and old_ids[start] == new_ids[start]:
+            start += 1
+        old_end, new_end = len(old), len(new)
+        while old_end > start and new_end > start and old_ids[old_end - 1] == new_ids[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if start == old_end and start == new_end:
+            return
+        positions = defaultdict(deque)
+        for i in range(start, old_end):
+            positions[old_ids[i]].append(i)
+        matches = []
+        for j in range(start, new_end):
+            found = positions.get(new_ids[j])
+            if found:
+                matches.append((found.popleft(), j))
+        stable = _stable(matches)
+        matched_old = {i for i, _ in matches}
+        matched_new = {j for _, j in matches}
+        in_place = set(stable)
+        for i, j in matches:
+            if (i, j) not in in_place:
+                self.differences.append(('moved', old_path + (old[i][0],), new_path + (new[j][0],)))
+        anchors = [(start - 1, start - 1)] + stable + [(old_end, new_end)]
+        for (old_from, new_from), (old_to, new_to) in zip(anchors, anchors[1:]):
+            old_rest = [i for i in range(old_from + 1, old_to) if i not in matched_old]
+            new_rest = [j for j in range(new_from + 1, new_to) if j not in matched_new]
+            # Оставшиеся сопоставляются по порядку, у XML - только с тем же тегом
+            waiting = defaultdict(deque)
+            for i in old_rest:
+                waiting[old_ids[i][0]].append(i)
+            for j in new_rest:
+                found = waiting.get(new_ids[j][0])
+                if found:
+                    i = found.popleft()
+                    self._pair(old[i][1], new[j][1], old_path + (old[i][0],), new_path + (new[j][0],), pairs)
+                else:
+                    self.differences.append(('added', old_path, new_path + (new[j][0],)))
+            for found in waiting.values():
+                for i in found:
+                    self.differences.append(('removed', old_path + (old[i][0],), new_path))
+
+    # По чему элемент последовательности узнаётся в другом документе: тег XML (без номера
+    # повторяющегося элемента) и хэш содержимого
+    def _identity(self, key, value):
+        return xml_tag(key) if self.xml else None, self._token(value)
+
+    # Ленивое поддерево для спуска в него разбирается без изменения документа
+    def _open(self, value):
+        if isinstance(value, LazyValue):
+            loaded = value.materialize()
+            # Разобранный уровень хранится вместе с хэшем: его id не перейдёт к другому объекту
+            self._tokens[id(loaded)] = (loaded, self._token(value))
+            return loaded
+        return value
+
+    # Хэш значения в виде строки. Простые значения представлены своим repr, контейнеры -
+    # хэшем содержимого с префиксом '#'. Хэши объектов и массивов с вложенными контейнерами
+    # запоминаются; остальные дешевле посчитать заново
+    def _token(self, value, remember=True):
+        if isinstance(value, LazyValue):
+            known = self._tokens.get(id(value))
+            if known is None:
+                # Разобранное целиком поддерево временное, его хэши не запоминаются
+                known = self._tokens[id(value)] = (value, self._token(value.load(), remember=False))
+            return known[1]
+        if not isinstance(value, (dict, list)):
+            return repr(value)
+        known = self._tokens.get(id(value))
+        if known is not None:
+            return known[1]
+        if self._is_leaf(value):
+            return self._leaf_token(value)
+        # Обход без рекурсии: узел считается после всех своих детей-контейнеров,
+        # дети из одних простых значений - сразу при первом проходе по родителю
+        tokens = {}
+        stack = [(value, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                token = tokens[id(node)] = self._merkle_token(node, tokens)
+                if remember:
+                    self._tokens[id(node)] = (node, token)
+                continue
+            stack.append((node, True))
+            for child in (node.values() if type(node) is dict else node):
+                if type(child) in _CONTAINERS and id(child) not in self._tokens:
+                    if self._is_leaf(child):
+                        tokens[id(child)] = self._leaf_token(child)
+                    else:
+                        stack.append((child, False))
+        return tokens[id(value)]
+
+    # Объект или массив без вложенных контейнеров. Проверяется по типам детей без цикла в Python
+    def _is_leaf(self, node):
+        return self._nested.isdisjoint(map(type, node.values() if type(node) is dict else node))
+
+    def _counted(self):
+        self._count += 1
+        if self.progress and self._count % PROGRESS_STEP == 0:
+            self.progress(self._count)
+
+    # Контейнер из одних простых значений хэшируется по repr целиком (ключи объекта по порядку):
+    # repr простых значений однозначен и считается без обхода детей в Python
+    def _leaf_token(self, node):
+        self._counted()
+        if self.xml:
+            if node.keys() == {'#text'}:
+                # Элемент только с текстом - то же, что его текст
+                return repr(node['#text'])
+            if not all(key[0] == '@' or key == '#text' for key in node):
+                return self._merkle_token(node, {})
+        text = repr(node) if type(node) is list else '{' + repr(sorted(node.items()))
+        # Короткое содержимое само служит хэшем
+        if len(text) <= SHORT_LEAF:
+            return 'L' + text
+        return '#' + hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+    # Хэш по хэшам детей
+    def _merkle_token(self, node, tokens):
+        self._counted()
+        known = self._tokens
+
+        def token(child):
+            if type(child) in _CONTAINERS:
+                found = tokens.get(id(child))
+                return found if found is not None else known[id(child)][1]
+            if isinstance(child, LazyValue):
+                return self._token(child)
+            return repr(child)
+
+        if type(node) is list:
+            parts = ['['] + [token(child) for child in node]
+        elif self.xml:
+            # Атрибуты без учёта порядка, дети - по порядку и без номеров повторяющихся элементов
+            parts = ['<'] + sorted(f'{key!r}={token(child)}' for key, child in node.items()
+                                   if key[0] == '@' or key == '#text')
+            parts += [f'{xml_tag(key)!r}={token(child)}' for key, child in node.items()
+                      if key[0] != '@' and key != '#text']
+        else:
+            parts = ['{'] + sorted(f'{key!r}={token(child)}' for key, child in node.items())
+        return '#' + hashlib.blake2b('\x1f'.join(parts).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
@@ -0,0 +1,67 @@
+# history.py
+# Отмена и повтор правок. Шаг правки - список изменений контейнеров модели:
+#   ('insert', путь контейнера, ключ, значение, позиция, место узла lxml или None)
+#   ('remove', путь контейнера, ключ, значение, позиция, место узла lxml или None)
+#   ('set', путь контейнера, ключ, старое значение, новое значение)
+# Изменения хранят ссылки на вставленные и удалённые поддеревья, а не копии документа,
+# поэтому шаг стоит O(размер правки) по памяти и времени. У шагов JSON документа есть
+# и запись в виде операций JSON Patch (patch.from_changes) для выгрузки правок сеанса
+from collections import deque
+
+# Сколько последних шагов можно отменить
+UNDO_LIMIT = 1000
+
+
+# Изменение, отменяющее change
+def inverse(change):
+    if change[0] == 'set':
+        _, path, key, old, new = change
+        return 'set', path, key, new, old
+    return ('remove' if change[0] == 'insert' else 'insert',) + change[1:]
+
+
+class EditHistory:
+    """Стеки шагов для отмены и повтора: (название, изменения, операции JSON Patch или None)."""
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+        # Вытеснялись ли старые шаги: тогда правки с начала сеанса уже не восстановить
+        self.truncated = False
+
+    # Новый шаг; повторять отменённые после него уже нечего
+    def record(self, title, changes, patch=None):
+        if len(self._undo) == self._undo.maxlen:
+            self.truncated = True
+        self._undo.append((title, changes, patch))
+        self._redo.clear()
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self.truncated = False
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    # Шаг для отмены; переходит в стек повтора
+    def pop_undo(self):
+        step = self._undo.pop()
+        self._redo.append(step)
+        return step
+
+    # Шаг для повтора; возвращается в стек отмены
+    def pop_redo(self):
+        step = self._redo.pop()
+        self._undo.append(step)
+        return step
+
+    # Все действующие шаги (кроме отменённых) одним списком операций JSON Patch
+    def patch(self):
+        if self.truncated:
+            raise ValueError(f"В истории только последние {self._undo.maxlen} шагов правки, "
+                             f"более ранние уже не восстановить.")
+        return [op for _, _, ops in self._undo for op in ops]
@@ -0,0 +1,102 @@
+# journal.py
+# Журнал правок рядом с документом (<файл>.journal). Каждая операция модели дописывается
+# в конец строкой JSON [имя, аргументы, именованные аргументы, выполнилась ли]: после каждой операции
+# запись уходит в файл, а на диск (fsync) - пачками. Первая строка - заголовок с размером
+# и временем изменения документа, для которого журнал начат.
+# Если программа завершилась, не сохранив документ, при следующем открытии того же файла
+# журнал проигрывается заново. Сохранение документа делает журнал ненужным
+import json
+import os
+import time
+
+SUFFIX = '.journal'
+# fsync после стольких операций или, если правки продолжаются, не реже чем через столько секунд
+SYNC_EVERY = 100
+SYNC_INTERVAL = 1.0
+_VERSION = 1
+
+
+class EditJournal:
+    """Журнал правок документа file_path. Файл журнала создаётся при первой операции."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.path = file_path + SUFFIX
+        st = os.stat(file_path)
+        self._header = {"journal": _VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        self._file = None
+        # Концы строк сохранённого журнала: заголовка и каждой операции (см. pending)
+        self._ends = []
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    # Операции сохранённого журнала: (имя, аргументы, именованные аргументы, выполнилась ли).
+    # Пусто, если журнала нет или он начат для другой версии документа (файл сохраняли
+    # или меняли после). Недописанная последняя строка пропускается
+    def pending(self):
+        try:
+            with open(self.path, 'rb') as file:
+                if os.fstat(file.fileno()).st_mtime_ns < self._header["mtime_ns"]:
+                    return []
+                lines = file.read().split(b'\n')
+        except OSError:
+            return []
+        try:
+            if json.loads(lines[0]) != self._header:
+                return []
+        except ValueError:
+            return []
+        operations = []
+        self._ends = [len(lines[0]) + 1]
+        # После последнего '\n' - пустая строка или оборванная запись
+        for line in lines[1:-1]:
+            try:
+                name, args, kwargs, ok = json.loads(line)
+            except ValueError:
+                break
+            self._ends.append(self._ends[-1] + len(line) + 1)
+            operations.append((name, args, kwargs, ok))
+        return operations
+
+    # Продолжение сохранённого журнала, из которого проиграны первые count операций:
+    # остальные отбрасываются
+    def resume(self, count):
+        end = self._ends[count]
+        self._file = open(self.path, 'r+b')
+        self._file.truncate(end)
+        self._file.seek(end)
+
+    def append(self, name, args, kwargs, ok=True):
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+            self._write(self._header)
+        self._write([name, args, kwargs, ok])
+        self._unsynced += 1
+        if self._unsynced >= SYNC_EVERY or time.monotonic() - self._synced_at >= SYNC_INTERVAL:
+            self.sync()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record).encode('ascii') + b'\n')
+        self._file.flush()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    # Правки уже в сохранённом документе: журнал удаляется
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
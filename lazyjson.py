@@ -0,0 +1,403 @@
+# lazyjson.py
+import json
+import mmap
+import re
+
+# Поддеревья больше этого размера (в байтах) не разбираются, пока к ним не обратятся
+LAZY_THRESHOLD = 1024 * 1024
+# Максимальный размер пачки мелких элементов, разбираемой одним вызовом json.loads
+BATCH_SIZE = 8 * 1024 * 1024
+# О ходе разбора верхнего уровня сообщается через столько скобок (степень двойки минус 1)
+_PROGRESS_MASK = 0xFFFF
+
+_LBRACE, _LBRACKET = ord('{'), ord('[')
+_QUOTE, _BACKSLASH, _COLON, _COMMA = ord('"'), ord('\\'), ord(':'), ord(',')
+_WHITESPACE = b' \t\n\r'
+
+# Ближайшая скобка вместе со всем текстом (и строками целиком) перед ней
+_BRACKET = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*[\[\]{}]', re.DOTALL)
+
+
+class LazySource:
+    """Отображённый в память JSON файл, из которого читаются ленивые поддеревья."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            self.buf = b''
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self._file.close()
+
+
+class LazyValue:
+    """Ещё не разобранный объект или массив: ссылка на его байты в исходном файле."""
+    __slots__ = ('source', 'start', 'end', 'kind')
+
+    def __init__(self, source, start, end, kind):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.kind = kind  # 'dict' или 'list'
+
+    # Разбор одного уровня: крупные дочерние поддеревья снова остаются ленивыми
+    def materialize(self):
+        value, _ = _parse_container(self.source, self.start)
+        return value
+
+    # Полный разбор поддерева (без сохранения в документ)
+    def load(self):
+        return json.loads(self.raw())
+
+    def raw(self):
+        return self.source.buf[self.start:self.end]
+
+    def __repr__(self):
+        return '{…}' if self.kind == 'dict' else '[…]'
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class LazyEncoder(json.JSONEncoder):
+    # Ленивые поддеревья разбираются только на время записи
+    def default(self, o):
+        if isinstance(o, LazyValue):
+            return o.load()
+        return super().default(o)
+
+
+# progress(разобрано байт, размер файла) вызывается по ходу разбора верхнего уровня
+def load(file_path, progress=None):
+    source = LazySource(file_path)
+    try:
+        start = document_start(source.buf)
+        if not is_streamable(source.buf, start):
+            value = loads_from(source.buf, start)
+            source.close()
+            return value
+        value, end = _parse_container(source, start, progress)
+        check_end(source.buf, end)
+        return value
+    except BaseException:
+        source.close()
+        raise
+
+
+# Позиция начала документа: после BOM и пробелов
+def document_start(buf):
+    start = 3 if buf[:3] == b'\xef\xbb\xbf' else 0
+    while start < len(buf) and buf[start] in _WHITESPACE:
+        start += 1
+    return start
+
+
+# Стоит ли разбирать документ по частям: большой объект или массив
+def is_streamable(buf, start):
+    return start < len(buf) and len(buf) > LAZY_THRESHOLD and buf[start] in (_LBRACE, _LBRACKET)
+
+
+# Разбор документа целиком, начиная с позиции start
+def loads_from(buf, start):
+    return _loads(buf[start:], start)
+
+
+# После корня документа допускаются только пробелы
+def check_end(buf, end):
+    if buf[end:].strip(_WHITESPACE):
+        raise _error("лишние данные после документа", end)
+
+
+# Получение дочернего элемента с разбором ленивого поддерева на месте
+def resolve(container, key):
+    value = container[key]
+    if isinstance(value, LazyValue):
+        value = value.materialize()
+        container[key] = value
+    return value
+
+
+# Разбор всех ленивых поддеревьев документа
+def materialize_all(data):
+    if isinstance(data, LazyValue):
+        data = data.load()
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        keys = node.keys() if isinstance(node, dict) else range(len(node)) if isinstance(node, list) else ()
+        for key in keys:
+            value = node[key]
+            if isinstance(value, LazyValue):
+                node[key] = value.load()
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+    return data
+
+
+# id всех объектов и списков, внутри которых на любой глубине есть LazyValue
+def lazy_holders(data):
+    holders = set()
+    if not isinstance(data, (dict, list)):
+        return holders
+    path = [(data, _iter_values(data))]
+    while path:
+        for value in path[-1][1]:
+            if isinstance(value, LazyValue):
+                for ancestor, _ in reversed(path):
+                    if id(ancestor) in holders:
+                        break
+                    holders.add(id(ancestor))
+            elif isinstance(value, (dict, list)) and value:
+                path.append((value, _iter_values(value)))
+                break
+        else:
+            path.pop()
+    return holders
+
+
+def _iter_values(container):
+    return iter(container.values()) if isinstance(container, dict) else iter(container)
+
+
+def _error(message, pos):
+    return ValueError(f"Некорректный JSON: {message} (байт {pos}).")
+
+
+def _loads(chunk, pos):
+    try:
+        return json.loads(chunk)
+    except json.JSONDecodeError as e:
+        raise _error(e.msg, pos + e.pos)
+
+
+# Разбор одного уровня объекта или массива, начинающегося с позиции start.
+# Возвращает (объект или список, позиция после него)
+def _parse_container(source, start, progress=None):
+    result = {} if source.buf[start] == _LBRACE else []
+    add = result.update if isinstance(result, dict) else result.extend
+    batches = iter_batches(source, start, progress)
+    while True:
+        try:
+            add(next(batches))
+        except StopIteration as stop:
+            return result, stop.value
+
+
+# Дети объекта или массива, начинающегося с позиции start, пачками: словарями или
+# списками того же вида, что и сам контейнер. Файл просматривается один раз: мелкие
+# дочерние элементы разбираются пачками через json.loads, каждый крупный выдаётся
+# отдельной пачкой из одного LazyValue. Генератор возвращает позицию после контейнера
+def iter_batches(source, start, progress=None):
+    buf = source.buf
+    is_dict = buf[start] == _LBRACE
+    separators = Separators()
+    batch_start = start + 1
+    child_start = start
+    depth = 0
+    for count, match in enumerate(_BRACKET.finditer(buf, start)):
+        pos = match.end() - 1
+        if progress and not count & _PROGRESS_MASK:
+            progress(pos, len(buf))
+        if buf[pos] == _LBRACE or buf[pos] == _LBRACKET:
+            depth += 1
+            if depth == 2:
+                child_start = pos
+            continue
+        depth -= 1
+        if depth == 0:
+            yield from _batch(buf[batch_start:pos], batch_start, is_dict, separators)
+            separators.end()
+            return pos + 1
+        if depth != 1:
+            continue
+        if pos + 1 - child_start > LAZY_THRESHOLD:
+            value = LazyValue(source, child_start, pos + 1, 'dict' if buf[child_start] == _LBRACE else 'list')
+            if is_dict:
+                key_start, key_end = find_key(buf, child_start, batch_start)
+                yield from _batch(buf[batch_start:key_start], batch_start, is_dict, separators)
+                separators.item(key_start)
+                yield {_loads(buf[key_start:key_end], key_start): value}
+            else:
+                yield from _batch(buf[batch_start:child_start], batch_start, is_dict, separators)
+                separators.item(child_start)
+                yield [value]
+            batch_start = pos + 1
+        elif pos + 1 - batch_start > BATCH_SIZE:
+            yield from _batch(buf[batch_start:pos + 1], batch_start, is_dict, separators)
+            batch_start = pos + 1
+    raise _error("неожиданный конец файла", start)
+
+
+# Объект или массив, начинающийся с позиции start, для чтения в хранилище узлов: события
+# ('open', ключ, 'dict' или 'list'), ('items', пачка), ('close',) за один просмотр файла.
+# Пачка - словарь или список соседних элементов не больше BATCH_SIZE байт текста. Если
+# элемент не помещается в пачку, события спускаются в него: его элементы идут своими
+# пачками между 'open' и 'close'. Генератор возвращает позицию после контейнера
+def iter_stream(source, start, progress=None):
+    buf = source.buf
+    # Открытые контейнеры: [начало, позиция после последнего закрытого дочернего контейнера]
+    opened = []
+    # Контейнеры, в которые спустились события: [номер в opened, начало пачки, запятые, объект ли]
+    streamed = []
+    for count, match in enumerate(_BRACKET.finditer(buf, start)):
+        pos = match.end() - 1
+        if progress and not count & _PROGRESS_MASK:
+            progress(pos, len(buf))
+        if buf[pos] == _LBRACE or buf[pos] == _LBRACKET:
+            opened.append([pos, None])
+            if len(opened) == 1:
+                streamed.append([0, pos + 1, Separators(), buf[pos] == _LBRACE])
+                yield 'open', None, 'dict' if buf[pos] == _LBRACE else 'list'
+        else:
+            opened.pop()
+            level, batch_start, separators, is_dict = streamed[-1]
+            if level == len(opened):
+                yield from _stream_batch(buf, batch_start, pos, is_dict, separators)
+                separators.end()
+                yield 'close',
+                streamed.pop()
+                if not streamed:
+                    return pos + 1
+                streamed[-1][1] = pos + 1
+                continue
+            opened[-1][1] = pos + 1
+        # Пачка переросла BATCH_SIZE: она отдаётся по последний закрытый элемент, а если
+        # и открытый элемент больше пачки, события спускаются в него
+        while pos - streamed[-1][1] > BATCH_SIZE:
+            level, batch_start, separators, is_dict = streamed[-1]
+            last = opened[level][1]
+            if last is not None and last > batch_start:
+                yield from _stream_batch(buf, batch_start, last, is_dict, separators)
+                streamed[-1][1] = last
+            elif len(opened) > level + 1:
+                child_start = opened[level + 1][0]
+                if is_dict:
+                    key_start, key_end = find_key(buf, child_start, batch_start)
+                    yield from _stream_batch(buf, batch_start, key_start, is_dict, separators)
+                    separators.item(key_start)
+                    key = _loads(buf[key_start:key_end], key_start)
+                else:
+                    yield from _stream_batch(buf, batch_start, child_start, is_dict, separators)
+                    separators.item(child_start)
+                    key = None
+                streamed.append([level + 1, child_start + 1, Separators(), buf[child_start] == _LBRACE])
+                yield 'open', key, 'dict' if buf[child_start] == _LBRACE else 'list'
+            else:
+                break
+    raise _error("неожиданный конец файла", start)
+
+
+def _stream_batch(buf, start, end, is_dict, separators):
+    for batch in _batch(buf[start:end], start, is_dict, separators):
+        yield 'items', batch
+
+
+# Добавление в объект или список result элементов, записанных через запятую в chunk.
+# separators - запятые контейнера на стыках частей (см. Separators)
+def add_batch(result, chunk, pos, separators):
+    for batch in _batch(chunk, pos, isinstance(result, dict), separators):
+        if isinstance(result, dict):
+            result.update(batch)
+        else:
+            result.extend(batch)
+
+
+# Разбор пачки элементов, записанных через запятую; пустая пачка не выдаётся
+def _batch(chunk, pos, is_dict, separators):
+    items = separators.chunk(chunk, pos)
+    if items is None:
+        return
+    chunk, pos = items
+    if is_dict:
+        yield _loads(b'{' + chunk + b'}', pos - 1)
+    else:
+        yield _loads(b'[' + chunk + b']', pos - 1)
+
+
+class Separators:
+    """Запятые между элементами объекта или массива, который разбирается по частям.
+
+    Элементы внутри части проверяет json.loads, а здесь - запятые на стыках частей
+    и вложенных контейнеров: ровно одна между соседними элементами и ни одной
+    в начале и в конце контейнера. Части и контейнеры передаются по порядку.
+    """
+
+    def __init__(self):
+        # Последним был элемент, и запятой после него ещё не было
+        self._after_item = False
+        # Позиция запятой, после которой ещё не было элемента
+        self._comma = None
+
+    # Часть chunk, начинающаяся в файле с позиции pos. Возвращает (элементы без запятых
+    # и пробелов по краям, их позиция) или None, если элементов в части нет
+    def chunk(self, chunk, pos):
+        end = len(chunk.rstrip(_WHITESPACE))
+        if not end:
+            return None
+        start = len(chunk) - len(chunk.lstrip(_WHITESPACE))
+        if chunk[start] == _COMMA:
+            if not self._after_item:
+                raise _error("лишняя ','", pos + start)
+            self._after_item = False
+            self._comma = pos + start
+            start = end - len(chunk[start + 1:end].lstrip(_WHITESPACE))
+            if start == end:
+                return None
+            if chunk[start] == _COMMA:
+                raise _error("лишняя ','", pos + start)
+        elif self._after_item:
+            raise _error("ожидалась ','", pos + start)
+        if chunk[end - 1] == _COMMA:
+            self._comma = pos + end - 1
+            self._after_item = False
+            end = len(chunk[:end - 1].rstrip(_WHITESPACE))
+        else:
+            self._comma = None
+            self._after_item = True
+        return chunk[start:end], pos + start
+
+    # Вложенный контейнер (или ключ перед ним), начинающийся с позиции pos
+    def item(self, pos):
+        if self._after_item:
+            raise _error("ожидалась ','", pos)
+        self._after_item = True
+        self._comma = None
+
+    # Конец контейнера: запятая не может быть последней
+    def end(self):
+        if self._comma is not None:
+            raise _error("лишняя ','", self._comma)
+
+
+# Поиск ключа, значение которого начинается с позиции value_start
+def find_key(buf, value_start, lower):
+    pos = value_start - 1
+    while buf[pos] in _WHITESPACE:
+        pos -= 1
+    if buf[pos] != _COLON:
+        raise _error("ожидалось ':'", pos)
+    pos -= 1
+    while buf[pos] in _WHITESPACE:
+        pos -= 1
+    if buf[pos] != _QUOTE:
+        raise _error("ожидался ключ", pos)
+    key_end = pos + 1
+    # Открывающая кавычка - первая, перед которой чётное число '\'
+    while True:
+        pos = buf.rfind(b'"', lower, pos)
+        if pos < 0:
+            raise _error("ожидался ключ", value_start)
+        slashes = 0
+        while buf[pos - slashes - 1] == _BACKSLASH:
+            slashes += 1
+        if slashes % 2 == 0:
+            return pos, key_end
@@ -1,166 +1,818 @@
 # model.py
+import functools
+import inspect
+import itertools
 import json
-from jsonschema import validate, ValidationError
+import os
+import stat
+from contextlib import contextmanager
+from jsonschema.exceptions import best_match
 from lxml import etree
-import copy
-import re
+
+import audit
+import history
+import lazyjson
+import nodestore
+import patch
+import pathquery
+import structindex
+import subschema
+from journal import EditJournal
+from searchindex import SearchIndex
+from schemacache import schema_cache, compile_json_schema, validate_xml, with_progress
+
+# Файлы JSON больше этого размера открываются в потоковом режиме
+LAZY_JSON_SIZE = 64 * 1024 * 1024
+# А больше этого - в компактное хранилище узлов (nodestore)
+COMPACT_JSON_SIZE = 512 * 1024 * 1024
+# Размер буфера записи при сохранении по умолчанию
+SAVE_BUFFER_SIZE = 1024 * 1024
+# Компактный JSON кодируется C-кодировщиком пачками по столько элементов;
+# объекты и списки длиннее пачки пишутся по частям
+COMPACT_BATCH_SIZE = 1000
+# При большем числе изменённых поддеревьев повторная проверка идёт по всему документу
+INCREMENTAL_MAX_PATHS = 1000
+# Размер блока чтения файла при загрузке
+READ_CHUNK_SIZE = 1024 * 1024
+# О ходе обхода узлов сообщается через столько узлов
+PROGRESS_STEP = 10000
+
+
+# Запись во временный файл рядом с целевым, fsync и атомарная замена.
+# При ошибке на середине записи прежний файл остаётся нетронутым.
+@contextmanager
+def atomic_write(file_path, buffer_size=SAVE_BUFFER_SIZE):
+    tmp_path = file_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb', buffering=buffer_size) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # На POSIX открытые отображения старого файла (ленивый JSON) остаются рабочими
+    os.replace(tmp_path, file_path)
+    if os.name == 'posix':
+        dir_fd = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+# Повторяющиеся дети XML элемента хранятся под ключами вида "tag#N".
+# Символ '#' не может входить в имя элемента, поэтому такой ключ
+# не спутать с настоящим тегом вроде node_99.
+def xml_tag(key):
+    base, sep, num = key.rpartition('#')
+    if sep and base and num.isdigit():
+        return base
+    return key
+
+
+# Операции модели, которые пишутся в журнал правок и проигрываются из него
+_JOURNALED = set()
+# Операции, из которых составляется пакет правок (DataModel.apply_batch)
+BATCH_OPERATIONS = ('add_node', 'delete_node', 'update_node_key', 'update_node_value', 'update_node_type')
+
+
+# Запись операции в журнал правок модели вместе с тем, выполнилась ли она: неудачная
+# операция тоже может изменить состояние (например, израсходовать номер ключа XML),
+# и при проигрывании она повторяется. Аргумент parent в журнал не попадает:
+# при проигрывании узлы находятся по путям
+def _journaled(method):
+    _JOURNALED.add(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            self._journal_call(method.__name__, args, kwargs, False)
+            raise
+        self._journal_call(method.__name__, args, kwargs, True)
+        return result
+    return wrapper
+
+
+# Нет узла по пути (значение None в документе допустимо)
+_MISSING = object()
+
+
+# Номер ключа среди ключей словаря, по порядку
+def _position(d, key):
+    return next(i for i, k in enumerate(d) if k == key)
+
+
+# Вставка d[key] = value на место номер position, остальные ключи сдвигаются.
+# Стоит O(число ключей после position)
+def _insert_at(d, key, value, position):
+    tail = [(k, d.pop(k)) for k in list(itertools.islice(d, position, None))]
+    d[key] = value
+    d.update(tail)
+
+
+# Файл, сообщающий о прочитанных байтах при разборе
+class _ProgressReader:
+    def __init__(self, file, size, progress):
+        self.file = file
+        self.size = size
+        self.progress = progress
+
+    def read(self, n=-1):
+        chunk = self.file.read(n)
+        self.progress(self.file.tell(), self.size)
+        return chunk
 
 
 class DataModel:
     def __init__(self):
+        # Режим lxml для XML: источник истины - дерево xml_root, словари строятся по запросу
+        self.xml_root = None
         self.data = {}
         self.file_path = None
         self.data_type = None  # 'json' или 'xml'
+        # Открыт ли JSON в потоковом режиме (в data могут быть LazyValue)
+        self.lazy = False
+        # Открыт ли JSON для просмотра по структурному индексу (см. load_json)
+        self.mapped = False
         self.xml_declaration = {"version": "1.0", "encoding": "UTF-8", "standalone": None}
+        # Номера для ключей повторяющихся XML элементов, не повторяются в пределах модели
+        self._key_counter = itertools.count()
+        # Поисковый индекс по ключам и значениям; строится в фоне после загрузки
+        self.search_index = None
+        # Дерево lxml для XPath запросов и ключи модели его узлов; сбрасывается при правках
+        self._xpath_tree = None
+        # Отмена и повтор правок текущего документа
+        self.history = history.EditHistory()
+        # Журнал правок для восстановления после сбоя; ведётся после open_journal
+        self.journal = None
+        # Ошибка записи в журнал, после которой он отключён; забирается take_journal_error
+        self.journal_error = None
+        # Изменения выполняющегося пакета правок (apply_batch, apply_patch) и они же
+        # в виде операций JSON Patch, иначе None
+        self._batch = None
+        self._batch_patch = None
+        self._reset_xml_maps()
+        self._reset_validation()
+
+    # Документ в виде словарей. В режиме lxml строится по дереву при первом обращении
+    # и дальше меняется вместе с ним
+    @property
+    def data(self):
+        if self._data is None and self.xml_root is not None:
+            self._data = self._build_xml_view(self.xml_root)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    # Связь словарного представления с деревом lxml: (id тела-словаря, ключ) -> элемент
+    # или комментарий и обратно, элемент -> ключ
+    def _reset_xml_maps(self):
+        self._xml_children = {}
+        self._xml_keys = {}
+
+    # Состояние инкрементальной валидации: документ валиден по схеме (валидатору) _valid_with,
+    # кроме поддеревьев по путям _dirty, изменённых после последней успешной проверки
+    def _reset_validation(self):
+        self._valid_with = None
+        self._dirty = set()
+
+    # Отметка изменённого поддерева. Путь предка покрывает пути потомков.
+    # Вызывается при каждой правке, поэтому здесь же устаревает дерево для XPath
+    def _mark_dirty(self, path):
+        self._xpath_tree = None
+        if self._valid_with is None:
+            return
+        path = tuple(path)
+        if any(path[:i] in self._dirty for i in range(len(path) + 1)):
+            return
+        self._dirty = {p for p in self._dirty if p[:len(path)] != path}
+        self._dirty.add(path)
+        if len(self._dirty) > INCREMENTAL_MAX_PATHS:
+            self._reset_validation()
 
     # Загрузка JSON файла
-    def load_json(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            self.data = json.load(file)
+    # lazy=True - потоковый режим: сразу строятся только верхние уровни,
+    # остальные поддеревья разбираются при первом обращении к ним.
+    # compact=True - документ читается в компактное хранилище узлов: в объекты Python
+    # превращаются только просмотренные и изменённые уровни, в том числе мелкие поддеревья,
+    # которые потоковый режим разбирает сразу. Файл после загрузки не используется.
+    # mapped=True - просмотр: файл отображается в память, по нему строится структурный индекс
+    # (или берётся сохранённый с прошлого открытия), и разбирается только то, что раскрыто
+    # или нужно запросу. Чтение пропорционально просмотренному, а не размеру файла.
+    # По умолчанию режим выбирается по размеру файла.
+    # progress(прочитано байт, размер файла) вызывается по ходу чтения; исключение из него
+    # прерывает загрузку, и модель остаётся с прежним документом
+    def load_json(self, file_path, lazy=None, progress=None, compact=None, mapped=False):
+        size = os.path.getsize(file_path)
+        if compact is None:
+            compact = size > COMPACT_JSON_SIZE and not mapped
+        if lazy is None:
+            lazy = size > LAZY_JSON_SIZE
+        if mapped:
+            data = structindex.load(file_path, progress)
+            lazy = True
+        elif compact:
+            data = nodestore.load(file_path, progress).root()
+            lazy = True
+        elif lazy:
+            data = lazyjson.load(file_path, progress)
+        else:
+            buffer = bytearray()
+            with open(file_path, 'rb') as file:
+                while chunk := file.read(READ_CHUNK_SIZE):
+                    buffer += chunk
+                    if progress:
+                        progress(len(buffer), size)
+            data = json.loads(buffer.decode('utf-8'))
+        self.xml_root = None
+        self._reset_xml_maps()
+        self.data = data
         self.file_path = file_path
         self.data_type = 'json'
+        self.lazy = lazy
+        self.mapped = mapped
+        self.search_index = None
+        self._xpath_tree = None
+        self.history.clear()
+        self.close_journal()
+        self._reset_validation()
+
+    # Перенос документа из другой модели, например загруженной в фоне
+    def take_document(self, other):
+        self.xml_root = other.xml_root
+        self._xml_children = other._xml_children
+        self._xml_keys = other._xml_keys
+        self.data = other._data
+        self.file_path = other.file_path
+        self.data_type = other.data_type
+        self.lazy = other.lazy
+        self.mapped = other.mapped
+        self.xml_declaration = other.xml_declaration
+        self._key_counter = other._key_counter
+        self.search_index = other.search_index
+        self._xpath_tree = None
+        self.history = other.history
+        self.close_journal()
+        self.journal, other.journal = other.journal, None
+        self.journal_error = None
+        self._reset_validation()
+
+    # Свободный ключ для ещё одного ребёнка с именем key, за O(1)
+    def _free_key(self, d, key):
+        if key not in d:
+            return key
+        return f'{key}#{next(self._key_counter)}'
+
+    # Переход по пути от корня с разбором ленивых поддеревьев
+    def _walk(self, path):
+        d = self.data
+        for p in path:
+            d = lazyjson.resolve(d, p)
+        return d
+
+    # Узел по пути. parent - уже известный контейнер узла (например, из реестра строк
+    # представления): тогда обход от корня не нужен
+    def _node(self, path, parent=None):
+        if parent is None or not path:
+            return self._walk(path)
+        return lazyjson.resolve(parent, path[-1])
+
+    # Контейнер узла по пути: переданный parent или найденный обходом от корня
+    def _parent(self, path, parent=None):
+        return self._walk(path[:-1]) if parent is None else parent
+
+    # Значение узла по пути
+    def get_node(self, path):
+        return self._walk(path)
+
+    # Поиск
+
+    # Текст ключа для поискового индекса: у XML без номера повторяющегося элемента и '@'
+    # атрибута; текст, комментарии и индексы списков ключами не считаются
+    def _search_key_text(self, key):
+        if not isinstance(key, str):
+            return None
+        if self.data_type == "xml":
+            return None if key.startswith('#') else xml_tag(key).lstrip('@')
+        return key
+
+    # Построение индекса по всему документу. progress(число узлов)
+    def build_search_index(self, progress=None):
+        self.search_index = SearchIndex.build(self.data, self._search_key_text, progress)
+
+    # (всего найдено, пути узлов), в ключах или значениях которых есть все слова запроса
+    def search(self, query):
+        if self.search_index is None:
+            raise RuntimeError("Поисковый индекс ещё не построен.")
+        return self.search_index.search(query)
+
+    # Запрос к документу: JSONPath для JSON, XPath для XML. Пути найденных узлов
+    # выдаются по мере вычисления; progress(число найденных) вызывается по ходу
+    def query(self, expression, progress=None):
+        if self.data_type == "json":
+            paths = pathquery.iter_paths(self.data, expression)
+        elif self.data_type == "xml":
+            paths = self._iter_xpath(expression, progress)
+        else:
+            raise TypeError("Не поддерживаемый тип данных.")
+        for count, path in enumerate(paths, start=1):
+            if progress and count % PROGRESS_STEP == 0:
+                progress(count)
+            yield path
+
+    # XPath вычисляется libxml2 над деревом lxml, построенным из модели один раз
+    # до следующей правки. Найденные элементы, атрибуты и тексты переводятся в пути модели
+    def _iter_xpath(self, expression, progress=None):
+        try:
+            xpath = etree.XPath(expression)
+        except etree.XPathSyntaxError as e:
+            raise ValueError(f"Ошибка в выражении XPath: {e}")
+        if self.xml_root is not None:
+            # В режиме lxml запрос выполняется над самим деревом
+            root, keys = self.xml_root, self._xml_node_keys()
+        else:
+            if self._xpath_tree is None:
+                keys = {}
+                root = self._dict_to_etree(self.data, progress, keys)
+                self._xpath_tree = (root, keys)
+            root, keys = self._xpath_tree
+        result = xpath(root)
+        if not isinstance(result, list):
+            raise ValueError("Выражение XPath должно выбирать узлы, а не вычислять значение.")
+        for node in result:
+            if isinstance(node, etree._Element):
+                element, last = node, ()
+            elif getattr(node, 'is_attribute', False):
+                element, last = node.getparent(), (f"@{node.attrname}",)
+            elif getattr(node, 'is_text', False):
+                element, last = node.getparent(), ('#text',)
+            else:
+                # Хвостовой текст и пространства имён в модели отдельными узлами не хранятся
+                continue
+            # Инструкций обработки в модели тоже нет
+            path = self._xml_path_of(element, keys)
+            if path is not None:
+                yield path + last
+
+    # Поддержка поискового индекса при правке container[key] по путям parent_path + (k,)
+    # для k из keys: поддеревья убираются из индекса до правки и добавляются после,
+    # даже если правка не удалась. shift=True - правка сдвигает индексы следующих
+    # элементов списка, и их поддеревья переиндексируются тоже
+    @contextmanager
+    def _reindexed(self, parent_path, container, *keys, shift=False):
+        index = self.search_index
+        if index is None:
+            yield
+            return
+        parent_path = tuple(parent_path)
 
-    def _get_xml_declaration(self, file_path):
-        # Чтение первой строки файла для декларации
-        with open(file_path, 'r', encoding='utf-8') as file:
-            first_line = file.readline().strip()
-            if first_line.startswith("<?xml"):
-                declaration = {}
-                for attr in first_line[5:-2].split():
-                    key, value = attr.split('=')
-                    declaration[key] = value.strip('"')
-                return declaration
-        return {"version": "1.0", "encoding": "UTF-8", "standalone": None}
+        def present():
+            if isinstance(container, list):
+                if shift:
+                    return range(keys[0], len(container))
+                return [k for k in keys if isinstance(k, int) and 0 <= k < len(container)]
+            return [k for k in keys if k in container]
+
+        for k in present():
+            index.remove(parent_path + (k,), container[k])
+        try:
+            yield
+        finally:
+            for k in present():
+                index.add(parent_path + (k,), container[k])
+            # После многих правок номера узлов индекса в основном заняты удалёнными узлами:
+            # индекс строится заново при следующем поиске
+            if index.fragmented():
+                self.search_index = None
+
+    # Разбор всех ещё не прочитанных поддеревьев документа
+    def materialize(self):
+        if self.lazy:
+            self.data = lazyjson.materialize_all(self.data)
+            self.lazy = False
+
+    # Декларация XML из сведений парсера о документе
+    def _get_xml_declaration(self, docinfo):
+        # lxml возвращает False и для standalone="no", и при отсутствии атрибута
+        standalone = "yes" if docinfo.standalone else None
+        return {"version": docinfo.xml_version or "1.0",
+                "encoding": docinfo.encoding or "UTF-8",
+                "standalone": standalone}
 
     # Загрузка XML файла
-    def load_xml(self, file_path):
-        tree = etree.parse(file_path)
-        declaration = self._get_xml_declaration(file_path)
-        if declaration:
-            self.xml_declaration = declaration
-        self.data = self._etree_to_dict(tree.getroot())
+    # native=True - режим lxml: дерево остаётся источником истины, сохранение, XPath и проверка
+    # по XSD работают с ним без преобразований, а словари строятся только при обращении к data.
+    # Инструкции обработки и объявления пространств имён при этом сохраняются
+    def load_xml(self, file_path, progress=None, native=False):
+        with open(file_path, 'rb') as file:
+            source = _ProgressReader(file, os.path.getsize(file_path), progress) if progress else file
+            # huge_tree снимает ограничение libxml2 на глубину вложенности
+            if native:
+                parser = etree.XMLParser(remove_blank_text=True, huge_tree=True)
+                root = etree.parse(source, parser).getroot()
+                data = None
+            else:
+                data, root = self._parse_xml_dict(source)
+        self.xml_declaration = self._get_xml_declaration(root.getroottree().docinfo)
+        self.xml_root = root if native else None
+        self._reset_xml_maps()
+        self.data = data
         self.file_path = file_path
         self.data_type = 'xml'
+        self.lazy = False
+        self.mapped = False
+        self.search_index = None
+        self._xpath_tree = None
+        self.history.clear()
+        self.close_journal()
+        self._reset_validation()
 
-    # Преобразование XML в словарь
-    def _etree_to_dict(self, element):
-        etree_dict = {element.tag: {}}
-        # Обработка атрибутов
-        if element.attrib:
-            etree_dict[element.tag].update({
-                f"@{k}": v for k, v in element.attrib.items()
-            })
-
-        # Обработка комментариев и инструкций обработки
-        for child in element:
-            if isinstance(child, etree._Comment):
-                i = 0
-                while f'#comment_{i}' in etree_dict[element.tag]:
-                    i += 1
-                etree_dict[element.tag][f'#comment_{i}'] = child.text
-                # if '#comment' not in etree_dict[element.tag]:
-                #     etree_dict[element.tag]['#comment'] = []
-                # etree_dict[element.tag]['#comment'].append(child.text)
-                continue
-            if isinstance(child, etree._ProcessingInstruction):
-                # TODO: processing_instruction
-                # pi = f"{child.target} {child.text}"
-                # if '#processing_instruction' not in etree_dict[element.tag]:
-                #     etree_dict[element.tag]['#processing_instruction'] = []
-                # etree_dict[element.tag]['#processing_instruction'].append(pi)
-                continue
-            # Рекурсивная обработка дочерних элементов
-            child_dict = self._etree_to_dict(child)
-            for k, v in child_dict.items():
-                if k in etree_dict[element.tag]:
-                    i = 0
-                    while f'{k}_{i}' in etree_dict[element.tag]:
-                        i += 1
-                    etree_dict[element.tag][f'{k}_{i}'] = v
+    # Разбор XML из файла source в словарь. Возвращает (словарь, корень дерева lxml)
+    def _parse_xml_dict(self, source):
+        context = etree.iterparse(source, events=('start', 'end', 'comment'),
+                                  remove_blank_text=True, huge_tree=True)
+        return self._build_xml_dict(context), context.root
+
+    # Построение словаря из потока событий разбора XML за один проход, без рекурсии.
+    # Обработанные элементы удаляются из дерева lxml, чтобы не держать его в памяти целиком.
+    def _build_xml_dict(self, events):
+        data = {}
+        stack = []
+        for event, element in events:
+            if event == 'start':
+                stack.append({f"@{k}": v for k, v in element.attrib.items()})
+            elif event == 'comment':
+                # Комментарии вне корневого элемента не сохраняются
+                if stack:
+                    body = stack[-1]
+                    body[self._free_key(body, '#comment')] = element.text
+            else:
+                body = stack.pop()
+                text = element.text.strip() if element.text else ''
+                if text:
+                    body['#text'] = text
+                parent = stack[-1] if stack else data
+                parent[self._free_key(parent, element.tag)] = body
+                element.clear()
+                if element.getparent() is not None:
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+        return data
+
+    # Словарное представление дерева lxml в том же виде, что даёт _build_xml_dict,
+    # с заполнением связи ключей модели с узлами дерева. Инструкции обработки пропускаются
+    def _build_xml_view(self, root):
+        self._reset_xml_maps()
+        data = {}
+        key = self._free_key(data, root.tag)
+        data[key] = body = {}
+        self._xml_register(data, key, root)
+        stack = [(root, body)]
+        while stack:
+            element, body = stack.pop()
+            body.update((f"@{k}", v) for k, v in element.attrib.items())
+            for child in element:
+                if isinstance(child.tag, str):
+                    key = self._free_key(body, child.tag)
+                    body[key] = child_body = {}
+                    stack.append((child, child_body))
+                elif child.tag is etree.Comment:
+                    key = self._free_key(body, '#comment')
+                    body[key] = child.text
                 else:
-                    etree_dict[element.tag][k] = v
-        # Обработка текстового содержимого
-        text = element.text.strip() if element.text else ''
-        if text:
-            etree_dict[element.tag] = {'#text': text}
-        # if text and (len(element) == 0 and not element.attrib):
-        #     etree_dict[element.tag] = text
-        # elif text:
-        #     etree_dict[element.tag]['#text'] = text
-        return etree_dict
+                    continue
+                self._xml_register(body, key, child)
+            text = element.text.strip() if element.text else ''
+            if text:
+                body['#text'] = text
+        return data
+
+    # Ключи модели узлов дерева lxml; словарное представление строится, если его ещё нет
+    def _xml_node_keys(self):
+        if self._data is None:
+            self._data = self._build_xml_view(self.xml_root)
+        return self._xml_keys
+
+    def _xml_register(self, body, key, node):
+        self._xml_children[(id(body), key)] = node
+        self._xml_keys[node] = key
+
+    # Место узла body[key] в дереве для истории правок: (узел, предыдущий сосед в дереве
+    # или None). None для атрибутов и текста или вне режима lxml
+    def _xml_place(self, body, key):
+        if self.xml_root is None:
+            return None
+        node = self._xml_children.get((id(body), key))
+        return None if node is None else (node, node.getprevious())
+
+    # Связи для поддерева body[key], узел которого node: дети-узлы в словаре идут
+    # в том же порядке, что элементы и комментарии в дереве
+    def _xml_register_subtree(self, body, key, node):
+        stack = [(body, key, node)]
+        while stack:
+            body, key, node = stack.pop()
+            self._xml_register(body, key, node)
+            value = body[key]
+            if isinstance(value, dict):
+                keys = [k for k in value if not (k.startswith('@') or k == '#text')]
+                nodes = [c for c in node if isinstance(c.tag, str) or c.tag is etree.Comment]
+                stack.extend((value, k, n) for k, n in zip(keys, nodes))
+
+    # Удаление связей для поддерева body[key]; вызывается до удаления его из словаря
+    def _xml_forget(self, body, key):
+        stack = [(body, key)]
+        while stack:
+            body, key = stack.pop()
+            node = self._xml_children.pop((id(body), key), None)
+            self._xml_keys.pop(node, None)
+            value = body[key]
+            if isinstance(value, dict):
+                stack.extend((value, k) for k in value if not (k.startswith('@') or k == '#text'))
+
+    # Элемент дерева, телом которого в словаре служит узел по пути path
+    def _xml_element(self, path):
+        return self._xml_children[(id(self._walk(path[:-1])), path[-1])]
+
+    # Правки в режиме lxml: то же изменение, что уже сделано в словаре d (узел по пути path),
+    # выполняется над деревом
+
+    def _xml_add(self, path, d, key):
+        element = self._xml_element(path)
+        value = d[key]
+        try:
+            if key.startswith('@'):
+                element.set(key[1:], str(value))
+            elif key.startswith('#comment'):
+                node = etree.Comment(value)
+                element.append(node)
+                self._xml_register(d, key, node)
+            else:
+                node = etree.SubElement(element, xml_tag(key))
+                if not isinstance(value, dict) and value is not None:
+                    node.text = str(value)
+                self._xml_register(d, key, node)
+        except ValueError:
+            # Недопустимое имя: словарь возвращается к прежнему виду
+            del d[key]
+            raise
+
+    def _xml_delete(self, path, d, key):
+        element = self._xml_element(path[:-1])
+        if key.startswith('@'):
+            del element.attrib[key[1:]]
+        elif key == '#text':
+            element.text = None
+        else:
+            node = self._xml_children[(id(d), key)]
+            self._xml_forget(d, key)
+            element.remove(node)
+
+    def _xml_rename(self, path, d, old_key, new_key):
+        if old_key.startswith('@'):
+            attrib = self._xml_element(path[:-1]).attrib
+            attrib[new_key[1:]] = attrib[old_key[1:]]
+            del attrib[old_key[1:]]
+            return
+        node = self._xml_children[(id(d), old_key)]
+        node.tag = xml_tag(new_key)
+        del self._xml_children[(id(d), old_key)]
+        self._xml_register(d, new_key, node)
+        # Как и в словаре, переименованный узел становится последним
+        if node.getparent() is not None:
+            node.getparent().append(node)
+
+    def _xml_set_value(self, path, d, key, value):
+        text = None if value is None else str(value)
+        if key.startswith('@'):
+            self._xml_element(path[:-1]).set(key[1:], text or '')
+        elif key == '#text':
+            self._xml_element(path[:-1]).text = text
+        else:
+            self._xml_children[(id(d), key)].text = text
+
+    # Возврат в дерево того, что снова стало d[key] (d - узел по пути path): атрибута, текста
+    # или прежнего узла вместе с поддеревом. place - место узла, записанное _xml_place.
+    # История отменяется по порядку, поэтому прежний сосед узла снова на своём месте
+    def _xml_attach(self, path, d, key, place):
+        if not path:
+            # Корень документа из дерева не убирается (см. _apply_change), меняется только имя
+            place[0].tag = xml_tag(key)
+            self._xml_register_subtree(d, key, place[0])
+            return
+        element = self._xml_element(path)
+        if key.startswith('@'):
+            # Атрибуты в словаре идут в том же порядке, что и у элемента
+            element.set(key[1:], str(d[key]))
+            attributes = [(k[1:], element.get(k[1:])) for k in d if k.startswith('@')]
+            element.attrib.clear()
+            for name, value in attributes:
+                element.set(name, value)
+            return
+        if key == '#text':
+            element.text = None if d[key] is None else str(d[key])
+            return
+        node, previous = place
+        if isinstance(node.tag, str):
+            node.tag = xml_tag(key)
+        if previous is None:
+            element.insert(0, node)
+        else:
+            previous.addnext(node)
+        self._xml_register_subtree(d, key, node)
 
     # Сохранение JSON файла
-    def save_json(self, file_path=None):
-        if file_path:
-            self.file_path = file_path
-        with open(self.file_path, 'w', encoding='utf-8') as file:
-            json.dump(self.data, file, indent=4, ensure_ascii=False)
-
-    # Сохранение XML файла
-    def save_xml(self, file_path=None):
-        if file_path:
-            self.file_path = file_path
-        root = self._dict_to_etree(copy.deepcopy(self.data))
-        tree = etree.ElementTree(root)
-        tree.write(self.file_path, pretty_print=True, xml_declaration=True,
-                   encoding=self.xml_declaration.get("encoding", "UTF-8"))
-
-    # Преобразование словаря в XML
-    def _dict_to_etree(self, d):
-        # TODO: вот тут конечно недоделал (((
-        assert isinstance(d, dict) and len(d) == 1
-        tag, body = next(iter(d.items()))
-        element = etree.Element(tag)
-        self._dict_to_etree_recursive(element, body)
-        return element
+    # compact=True - без отступов: поддеревья кодируются C-кодировщиком, а не
+    # поэлементно на Python, нетронутые ленивые поддеревья копируются из исходного файла как есть
+    # progress(записано байт) вызывается после каждого блока; при исключении из него
+    # или ошибке записи прежний файл не меняется
+    def save_json(self, file_path=None, compact=False, buffer_size=SAVE_BUFFER_SIZE, progress=None):
+        file_path = file_path or self.file_path
+        if compact:
+            encoder = lazyjson.LazyEncoder(ensure_ascii=False, separators=(',', ':'))
+            holders = lazyjson.lazy_holders(self.data) if self.lazy else set()
+            chunks = self._iter_compact_json(self.data, encoder, holders)
+        else:
+            encoder = lazyjson.LazyEncoder(indent=4, ensure_ascii=False)
+            chunks = encoder.iterencode(self.data)
+        with atomic_write(file_path, buffer_size) as file:
+            pending = []
+            size = 0
+            written = 0
+            for chunk in chunks:
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:
+                    written += file.write(''.join(pending).encode('utf-8'))
+                    pending = []
+                    size = 0
+                    if progress:
+                        progress(written)
+            file.write(''.join(pending).encode('utf-8'))
+        self._saved(file_path)
 
-    def _dict_to_etree_recursive(self, parent, body):
-        if isinstance(body, dict):
-            for key, value in body.items():
+    # holders - id контейнеров, внутри которых есть ленивые поддеревья: они пишутся по частям
+    def _iter_compact_json(self, value, encoder, holders):
+        if isinstance(value, lazyjson.LazyValue):
+            yield value.raw().decode('utf-8')
+            return
+        if not isinstance(value, (dict, list)) or \
+                (len(value) <= COMPACT_BATCH_SIZE and id(value) not in holders):
+            yield encoder.encode(value)
+            return
+        is_dict = isinstance(value, dict)
+        items = value.items() if is_dict else enumerate(value)
+        yield '{' if is_dict else '['
+        separator = ''
+        batch = []
+        for key, item in items:
+            if isinstance(item, lazyjson.LazyValue) or id(item) in holders or \
+                    (isinstance(item, (dict, list)) and len(item) > COMPACT_BATCH_SIZE):
+                if batch:
+                    yield separator + self._encode_batch(batch, is_dict, encoder)
+                    separator = ','
+                    batch = []
+                yield f"{separator}{encoder.encode(key)}:" if is_dict else separator
+                yield from self._iter_compact_json(item, encoder, holders)
+                separator = ','
+                continue
+            batch.append((key, item))
+            if len(batch) >= COMPACT_BATCH_SIZE:
+                yield separator + self._encode_batch(batch, is_dict, encoder)
+                separator = ','
+                batch = []
+        if batch:
+            yield separator + self._encode_batch(batch, is_dict, encoder)
+        yield '}' if is_dict else ']'
+
+    # Пачка элементов одним вызовом кодировщика, без внешних скобок
+    def _encode_batch(self, batch, is_dict, encoder):
+        if is_dict:
+            return encoder.encode(dict(batch))[1:-1]
+        return encoder.encode([item for _, item in batch])[1:-1]
 
-                key_without_num = ''
+    # Сохранение XML файла: элементы пишутся в файл по мере обхода модели,
+    # дерево lxml целиком не строится. В режиме lxml дерево записывается само
+    # progress(записано элементов) вызывается по ходу записи
+    def save_xml(self, file_path=None, progress=None):
+        file_path = file_path or self.file_path
+        encoding = self.xml_declaration.get("encoding", "UTF-8")
+        standalone = {"yes": True, "no": False}.get(self.xml_declaration.get("standalone"))
+        with atomic_write(file_path) as file:
+            if self.xml_root is not None:
+                options = {} if standalone is None else {"standalone": standalone}
+                self.xml_root.getroottree().write(file, encoding=encoding, xml_declaration=True,
+                                                  pretty_print=True, **options)
+            else:
+                with etree.xmlfile(file, encoding=encoding) as xf:
+                    xf.write_declaration(version=self.xml_declaration.get("version", "1.0"), standalone=standalone)
+                    self._write_xml(xf, self.data, progress)
+                file.write('\n'.encode(encoding))
+        self._saved(file_path)
 
-                key_split = key.split("_")
-                if len(key_split) > 1:
-                    if key_split[-1].isdigit():
-                        key_without_num = "_".join(key_split[:-1])
+    # Потоковая запись словаря в xmlfile без рекурсии, с отступами как у pretty_print
+    def _write_xml(self, xf, data, progress=None):
+        assert isinstance(data, dict) and len(data) == 1
+        stack = []
+        count = 0
+        items = iter(data.items())
+        # Отступ детей текущего элемента; None - внутри смешанного содержимого отступы не пишутся
+        indent = ''
+        while True:
+            for key, value in items:
+                if key.startswith('@') or key == '#text':
+                    continue
+                count += 1
+                if progress and count % PROGRESS_STEP == 0:
+                    progress(count)
+                if indent:
+                    xf.write(indent)
+                if key.startswith('#comment'):
+                    xf.write(etree.Comment(value))
+                    continue
+                tag = xml_tag(key)
+                if not isinstance(value, dict):
+                    element = etree.Element(tag)
+                    element.text = str(value)
+                    xf.write(element)
+                    continue
+                attrib = {k[1:]: v for k, v in value.items() if k.startswith('@')}
+                if not self._xml_has_children(value):
+                    # Лист пишется целиком, чтобы пустой элемент получил вид <tag/>
+                    element = etree.Element(tag, attrib)
+                    element.text = value.get('#text')
+                    xf.write(element)
+                    continue
+                context = xf.element(tag, attrib)
+                context.__enter__()
+                # Элемент с текстом и детьми (смешанное содержимое) пишется без отступов
+                # до конца своего поддерева: пробелы стали бы частью его текста
+                indented = indent is not None and '#text' not in value
+                stack.append((context, items, indent, indented))
+                if indented:
+                    indent = '\n' + '  ' * len(stack)
                 else:
-                    key_without_num = key
+                    if '#text' in value:
+                        xf.write(value['#text'])
+                    indent = None
+                items = iter(value.items())
+                break
+            else:
+                if not stack:
+                    return
+                context, items, indent, indented = stack.pop()
+                if indented:
+                    xf.write('\n' + '  ' * len(stack))
+                context.__exit__(None, None, None)
+
+    # Есть ли у элемента дети, кроме атрибутов и текста
+    def _xml_has_children(self, body):
+        for child_key in body:
+            if not (child_key == "#text" or child_key.startswith("@")):
+                return True
+        return False
+
+    # Преобразование словаря в XML. keys - словарь, в который записываются
+    # ключи модели для созданных элементов и комментариев
+    def _dict_to_etree(self, d, progress=None, keys=None):
+        assert isinstance(d, dict) and len(d) == 1
+        tag, body = next(iter(d.items()))
+        root = etree.Element(tag)
+        if keys is not None:
+            keys[root] = tag
+        stack = [(root, body)]
+        count = 0
+        while stack:
+            count += 1
+            if progress and count % PROGRESS_STEP == 0:
+                progress(count)
+            parent, body = stack.pop()
+            if not isinstance(body, dict):
+                parent.text = str(body)
+                continue
+            for key, value in body.items():
                 if key.startswith('@'):
                     parent.set(key[1:], value)
                 elif key == '#text':
                     parent.text = value
-                elif '#comment' in key:
-                    comment_element = etree.Comment(value)
-                    parent.append(comment_element)
-                # elif key == '#processing_instruction':
-                #     for pi in value:
-                #         target, text = self._parse_processing_instruction(pi)
-                #         pi_element = etree.ProcessingInstruction(target, text)
-                #         parent.append(pi_element)
-                # elif isinstance(value, list):
-                #     for item in value:
-                #         if isinstance(item, dict):
-                #             child = etree.SubElement(parent, key)
-                #             self._dict_to_etree_recursive(child, item)
-                #         else:
-                #             # Примитивные типы в списках
-                #             child = etree.SubElement(parent, key)
-                #             child.text = str(item)
+                elif key.startswith('#comment'):
+                    comment = etree.Comment(value)
+                    parent.append(comment)
+                    if keys is not None:
+                        keys[comment] = key
                 else:
-                    child = etree.SubElement(parent, key_without_num)
-                    # TODO: сейчас проблема если будет узел формата abcd_0 или node_99
-                    # if key_without_num in body:
-                    #     child = etree.SubElement(parent, key_without_num)
-                    # else:
-                    #     child = etree.SubElement(parent, key)
-                    self._dict_to_etree_recursive(child, value)
-        # elif isinstance(body, list):
-        #     for item in body:
-        #         child = etree.SubElement(parent, parent.tag)
-        #         self._dict_to_etree_recursive(child, item)
-        else:
-            parent.text = str(body)
+                    child = etree.SubElement(parent, xml_tag(key))
+                    if keys is not None:
+                        keys[child] = key
+                    stack.append((child, value))
+        return root
 
     def _parse_processing_instruction(self, pi):
         parts = pi.split(' ', 1)
@@ -168,12 +820,11 @@ class DataModel:
         text = parts[1].strip('?') if len(parts) > 1 else ''
         return target, text
 
-    # Добавление узла
-    def add_node(self, path, key, value, node_type='node'):
-        d = self.data
+    # Добавление узла. Возвращает ключ (или индекс), под которым узел добавлен
+    @_journaled
+    def add_node(self, path, key, value, node_type='node', parent=None):
         try:
-            for p in path:
-                d = d[p]
+            d = self._node(path, parent)
             if self.data_type == "json":
                 if isinstance(d, dict):
                     if key in d:
@@ -189,15 +840,11 @@ class DataModel:
                         raise TypeError("Атрибуты могут быть добавлены только к объектам.")
                     if f"@{key}" in d:
                         raise KeyError(f"Атрибут {key} уже существует.")
-                    d[f"@{key}"] = value
+                    key = f"@{key}"
+                    d[key] = value
                 case "comment":
-                    if "#comment" in d:
-                        i = 0
-                        while f'#comment_{i}' in d:
-                            i += 1
-                        d[f'#comment_{i}'] = value
-                    else:
-                        d["#comment"] = value
+                    key = self._free_key(d, "#comment")
+                    d[key] = value
                 # elif node_type == "pi":
                 #     if "#processing_instruction" not in d:
                 #         d["#processing_instruction"] = []
@@ -205,14 +852,19 @@ class DataModel:
                 case "list":
                     if isinstance(d, list):
                         d.append([])
+                        key = len(d) - 1
                     else:
+                        key = self._free_key(d, key)
                         d[key] = []
                 case "dict":
                     if isinstance(d, list):
                         d.append({})
+                        key = len(d) - 1
                     else:
+                        key = self._free_key(d, key)
                         d[key] = {}
                 case "node":
+                    key = self._free_key(d, key)
                     d[key] = {}
                 # case "list_el":
                 #     if not isinstance(d, list):
@@ -223,54 +875,63 @@ class DataModel:
                         case "json":
                             if isinstance(d, list):
                                 d.append(value)
+                                key = len(d) - 1
                             else:
                                 d[key] = value
                         case "xml":
-                            if key in d:
-                                i = 0
-                                while f'{key}_{i}' in d:
-                                    i += 1
-                                d[f'{key}_{i}'] = value
-                            else:
-                                d[key] = value
+                            key = self._free_key(d, key)
+                            d[key] = value
+            if self.xml_root is not None:
+                self._xml_add(path, d, key)
+            if self.search_index is not None:
+                self.search_index.add(tuple(path) + (key,), d[key])
+            # Меняется состав детей: перепроверяется весь родитель
+            self._mark_dirty(path)
+            self._record("Добавление узла", ('insert', tuple(path), key, d[key], len(d) - 1, self._xml_place(d, key)))
+            return key
         except KeyError:
             raise KeyError(f"Путь {'->'.join(map(str, path))} не существует.")
 
     # Удаление узла
-    def delete_node(self, path, key, node_type='node'):
-        d = self.data
+    @_journaled
+    def delete_node(self, path, key, node_type='node', parent=None):
         try:
-            for p in path[:-1]:
-                d = d[p]
+            d = self._parent(path, parent)
             # d это родитель ( по-идее )
             if key != path[-1]:
                 raise KeyError(f"Элемент '{key}' отсутствует по пути {'->'.join(map(str, path))}.")
             if isinstance(d, list):
                 if len(d) <= key:
                     raise KeyError(f"В списке нет элемента '{key}'.")
-                d.pop(key)
+                with self._reindexed(path[:-1], d, key, shift=True):
+                    value = d.pop(key)
+                change = ('remove', tuple(path[:-1]), key, value, key, None)
             elif isinstance(d, dict):
                 if key not in d:
                     raise KeyError(f"Ключ '{key}' не найден.")
-                del d[key]
+                change = ('remove', tuple(path[:-1]), key, d[key], _position(d, key), self._xml_place(d, key))
+                with self._reindexed(path[:-1], d, key):
+                    if self.xml_root is not None:
+                        self._xml_delete(path, d, key)
+                    del d[key]
             else:
                 raise KeyError(f"Ключ '{key}' ни в словаре, ни в списке.")
+            self._mark_dirty(path[:-1])
+            self._record("Удаление узла", change)
 
         except (KeyError, TypeError):
             raise KeyError(f"Ключ '{key}' не найден по пути {'->'.join(map(str, path))}.")
 
-    # Обновление узла
-    def update_node_key(self, path, new_key):
-        d = self.data
+    # Обновление узла. Возвращает новый ключ, под которым хранится узел
+    @_journaled
+    def update_node_key(self, path, new_key, parent=None):
         try:
-            # Перемещаемся по пути до узла
-            for p in path[:-1]:
-                d = d[p]
+            d = self._parent(path, parent)
             # d это родитель
             old_key = path[-1]
             if old_key == new_key:
                 print("Узел не меняется.")
-                return
+                return old_key
             if old_key.startswith('@'):
                 new_key = f'@{new_key}'
                 # Обновляем значение узла
@@ -281,33 +942,34 @@ class DataModel:
                     case "json":
                         if new_key in d:
                             raise KeyError(f"Элемент {new_key} уже существует.")
-                        d[new_key] = d[old_key]
-                        del d[old_key]
                     case "xml":
-                        if new_key in d:
-                            i = 0
-                            while f'{new_key}_{i}' in d:
-                                i += 1
-                            d[f'{new_key}_{i}'] = d[old_key]
-                            del d[old_key]
-                        else:
-                            d[new_key] = d[old_key]
-                            del d[old_key]
+                        new_key = self._free_key(d, new_key)
+                # Переименование - удаление и вставка в конец того же значения (и узла lxml)
+                value = d[old_key]
+                removed = ('remove', tuple(path[:-1]), old_key, value, _position(d, old_key),
+                           self._xml_place(d, old_key))
+                if self.xml_root is not None:
+                    self._xml_rename(path, d, old_key, new_key)
+                with self._reindexed(path[:-1], d, old_key, new_key):
+                    d[new_key] = d[old_key]
+                    del d[old_key]
+                self._mark_dirty(path[:-1])
+                self._record("Переименование узла", removed,
+                             ('insert', tuple(path[:-1]), new_key, value, len(d) - 1, self._xml_place(d, new_key)))
+                return new_key
             else:
                 raise KeyError(f"Родитель элемента '{old_key}' - не dict.")
         except (KeyError, IndexError):
             raise KeyError(f"Путь {'->'.join(map(str, path))} не существует.")
 
     # Обновление узла
-    def update_node_value(self, path, new_value):
-        d = self.data
+    @_journaled
+    def update_node_value(self, path, new_value, parent=None):
         try:
-            # Перемещаемся по пути до родителя узла
-            for p in path[:-1]:
-                d = d[p]
+            d = self._parent(path, parent)
             # d это родитель
             key = path[-1]
-            old_value = d[key]
+            old_value = lazyjson.resolve(d, key)
             if old_value == new_value:
                 print("Узел не меняется.")
                 return
@@ -316,99 +978,609 @@ class DataModel:
                     for child_key in old_value.keys():
                         if not (child_key == "#text" or child_key.startswith("@")):
                             raise TypeError(f"Нельзя добавлять текст к узлам, внутри которых есть другие узлы.")
-                    old_value["#text"] = new_value
-                    d[key] = old_value
+                if self.xml_root is not None:
+                    self._xml_set_value(path, d, key, new_value)
+                if isinstance(old_value, dict):
+                    if "#text" in old_value:
+                        change = ('set', tuple(path), "#text", old_value["#text"], new_value)
+                    else:
+                        change = ('insert', tuple(path), "#text", new_value, len(old_value), None)
+                    with self._reindexed(path[:-1], d, key):
+                        old_value["#text"] = new_value
+                        d[key] = old_value
+                    self._mark_dirty(path)
+                    self._record("Изменение значения", change)
                     return
-            if key in d:
-                d[key] = new_value
+            if isinstance(d, list) or key in d:
+                with self._reindexed(path[:-1], d, key):
+                    d[key] = new_value
+                self._mark_dirty(path)
+                self._record("Изменение значения", ('set', tuple(path[:-1]), key, old_value, new_value))
             else:
                 raise KeyError(f"Ключ '{key}' не найден.")
         except (KeyError, IndexError):
             raise KeyError(f"Путь {'->'.join(map(str, path))} не существует.")
 
     # Обновление узла
-    def update_node_type(self, path, new_type='node'):
-        d = self.data
+    @_journaled
+    def update_node_type(self, path, new_type='node', parent=None):
         try:
-            # Перемещаемся по пути до родителя узла
-            for p in path[-1]:
-                d = d[p]
+            d = self._parent(path, parent)
             # d это родитель
 
             key = path[-1]
 
             if key not in d:
                 raise KeyError(f"Ключ '{key}' не найден.")
-            match new_type:
-                case "attribute":
-                    if not isinstance(d, dict):
-                        raise TypeError("Атрибуты могут быть добавлены только к объектам.")
-                    if f"@{key}" in d:
-                        raise KeyError(f"Атрибут {key} уже существует.")
-                    d[f"@{key}"] = ""
-                case "comment":
-                    if "#comment" in d:
-                        i = 0
-                        while f'#comment_{i}' in d:
-                            i += 1
-                        d[f'#comment_{i}'] = ""
-                    else:
-                        d["#comment"] = ""
-                # elif node_type == "pi":
-                #     if "#processing_instruction" not in d:
-                #         d["#processing_instruction"] = []
-                #     d["#processing_instruction"].append(value)
-                case "list":
-                    d[key] = []
-                case "dict":
-                    d[key] = {}
-                case "string":
-                    d[key] = ""
-                case "boolean":
-                    d[key] = False
-                case "null":
-                    d[key] = None
-                case "number":
-                    d[key] = 0
-                case "unknown":
-                    d[key] = None
-                case _:
-                    raise TypeError(f"Неизвестный тип данных.")
+            # В режиме lxml тип узла дерева задаёт сам libxml2: добавляются только атрибут и комментарий
+            if self.xml_root is not None and new_type not in ("attribute", "comment"):
+                raise TypeError("Для XML доступны только типы атрибут и комментарий.")
+            old_value = d[key]
+            # Новый комментарий без текста в индекс не попадает, новый атрибут - по ключу
+            with self._reindexed(path[:-1], d, key, f"@{key}"):
+                match new_type:
+                    case "attribute":
+                        if not isinstance(d, dict):
+                            raise TypeError("Атрибуты могут быть добавлены только к объектам.")
+                        if f"@{key}" in d:
+                            raise KeyError(f"Атрибут {key} уже существует.")
+                        added = f"@{key}"
+                        d[added] = ""
+                        if self.xml_root is not None:
+                            self._xml_add(path[:-1], d, added)
+                    case "comment":
+                        added = self._free_key(d, "#comment")
+                        d[added] = ""
+                        if self.xml_root is not None:
+                            self._xml_add(path[:-1], d, added)
+                    # elif node_type == "pi":
+                    #     if "#processing_instruction" not in d:
+                    #         d["#processing_instruction"] = []
+                    #     d["#processing_instruction"].append(value)
+                    case "list":
+                        d[key] = []
+                    case "dict":
+                        d[key] = {}
+                    case "string":
+                        d[key] = ""
+                    case "boolean":
+                        d[key] = False
+                    case "null":
+                        d[key] = None
+                    case "number":
+                        d[key] = 0
+                    case "unknown":
+                        d[key] = None
+                    case _:
+                        raise TypeError(f"Неизвестный тип данных.")
+            self._mark_dirty(path[:-1])
+            if new_type in ("attribute", "comment"):
+                change = ('insert', tuple(path[:-1]), added, "", len(d) - 1, self._xml_place(d, added))
+            else:
+                change = ('set', tuple(path[:-1]), key, old_value, d[key])
+            self._record("Изменение типа", change)
         except (KeyError, IndexError):
             raise KeyError(f"Путь {'->'.join(map(str, path))} не существует.")
 
-    # Валидация JSON
-    def validate_json(self, schema):
+    # Отмена и повтор
+
+    # Новый шаг истории; внутри пакета правок изменения копятся в один шаг.
+    # Правки JSON сразу записываются и операциями JSON Patch (см. export_patch)
+    def _record(self, title, *changes):
+        ops = patch.from_changes(changes) if self.data_type == "json" else None
+        if self._batch is not None:
+            self._batch.extend(changes)
+            if ops is not None:
+                self._batch_patch.extend(ops)
+        else:
+            self.history.record(title, list(changes), ops)
+
+    # Отмена последнего шага правки. Возвращает его название и пути затронутых узлов
+    @_journaled
+    def undo(self):
+        if not self.history.can_undo():
+            raise IndexError("Нечего отменять.")
+        title, changes, _ = self.history.pop_undo()
+        changes = [history.inverse(change) for change in reversed(changes)]
+        return title, [self._apply_change(change) for change in changes]
+
+    # Повтор последнего отменённого шага
+    @_journaled
+    def redo(self):
+        if not self.history.can_redo():
+            raise IndexError("Нечего повторять.")
+        title, changes, _ = self.history.pop_redo()
+        return title, [self._apply_change(change) for change in changes]
+
+    # Выполнение изменения из истории вместе с поиском, деревом lxml и валидацией.
+    # container - уже найденный контейнер по пути из изменения.
+    # Возвращает путь узла, если он есть после изменения, иначе путь его контейнера
+    def _apply_change(self, change, container=None):
+        op, parent_path, key = change[:3]
+        if container is None:
+            container = self._walk(parent_path)
+        path = parent_path + (key,)
+        if op == 'set':
+            value = change[4]
+            with self._reindexed(parent_path, container, key):
+                if self.xml_root is not None:
+                    self._xml_set_value(path, container, key, value)
+                container[key] = value
+            self._mark_dirty(path)
+            return path
+        _, _, _, value, position, node = change
+        is_list = isinstance(container, list)
+        with self._reindexed(parent_path, container, key, shift=is_list):
+            if op == 'remove':
+                if self.xml_root is not None and parent_path:
+                    self._xml_delete(path, container, key)
+                elif self.xml_root is not None:
+                    self._xml_forget(container, key)
+                del container[key]
+            elif is_list:
+                container.insert(position, value)
+            else:
+                _insert_at(container, key, value, position)
+                if self.xml_root is not None:
+                    self._xml_attach(parent_path, container, key, node)
+        self._mark_dirty(parent_path)
+        return parent_path if op == 'remove' else path
+
+    # Пакет правок
+
+    # Правки одним шагом истории: изменения копятся в списке, который получает with.
+    # При исключении сделанные изменения отменяются в обратном порядке
+    @contextmanager
+    def _transaction(self, title):
+        if self._batch is not None:
+            raise RuntimeError("Пакет правок уже выполняется.")
+        self._batch = changes = []
+        self._batch_patch = ops = [] if self.data_type == "json" else None
         try:
-            validate(instance=self.data, schema=schema)
-            return True, "JSON валиден."
-        except ValidationError as e:
-            return False, f"Ошибка валидации: {e.message}"
+            yield changes
+        except BaseException:
+            for change in reversed(changes):
+                self._apply_change(history.inverse(change))
+            raise
+        finally:
+            self._batch = self._batch_patch = None
+        if changes:
+            self.history.record(title, changes, ops)
 
-    def validate_new_json(self, schema):
+    # Пути изменённых узлов (удалённых - их контейнеров) без повторов, по порядку
+    def _changed_paths(self, changes):
+        paths = (change[1] if change[0] == 'remove' else change[1] + (change[2],) for change in changes)
+        return list(dict.fromkeys(paths))
+
+    # Пакет правок одной транзакцией. operations - последовательность (имя операции, аргументы...)
+    # из BATCH_OPERATIONS, например ('update_node_value', path, value). Операции проверяются
+    # до выполнения; если какая-то всё же не выполнилась, сделанные отменяются, и документ
+    # остаётся прежним. В истории отмены пакет - один шаг, в журнале - одна операция.
+    # Возвращает пути изменённых узлов (удалённых - их контейнеров), чтобы представление
+    # обновилось один раз
+    @_journaled
+    def apply_batch(self, operations, title="Пакет правок"):
+        if self._batch is not None:
+            raise RuntimeError("Пакет правок уже выполняется.")
+        problems = self._check_batch(operations)
+        if problems:
+            raise ValueError("Пакет правок не выполнен:\n" + "\n".join(problems[:10]))
+        with self._transaction(title) as changes:
+            for number, (name, *args) in enumerate(operations, start=1):
+                try:
+                    getattr(self, name)(*args)
+                except Exception as e:
+                    raise ValueError(f"Операция {number} ({name}) не выполнилась: {e} Пакет правок отменён.") from e
+        return self._changed_paths(changes)
+
+    # Ошибки пакета, видные до выполнения: неизвестная операция, неверные аргументы, нет узла.
+    # Путь под контейнером, который меняет одна из предыдущих операций пакета, проверяется
+    # только при выполнении: узел может появиться или сдвинуться
+    def _check_batch(self, operations):
+        problems = []
+        touched = set()
+        for number, (name, *args) in enumerate(operations, start=1):
+            if name not in BATCH_OPERATIONS:
+                problems.append(f"{number}: неизвестная операция {name}.")
+                continue
+            try:
+                inspect.signature(getattr(self, name)).bind(*args)
+            except TypeError as e:
+                problems.append(f"{number}: {name}: {e}.")
+                continue
+            path = tuple(args[0])
+            container = path if name == 'add_node' else path[:-1]
+            if not any(container[:i] in touched for i in range(len(container) + 1)):
+                node = self._find(path)
+                if node is _MISSING or name == 'add_node' and not isinstance(node, (dict, list)):
+                    problems.append(f"{number}: путь {'->'.join(map(str, path))} не существует.")
+            touched.add(container)
+            touched.add(path)
+        return problems
+
+    # Узел по пути или _MISSING, если пути нет
+    def _find(self, path):
+        d = self.data
+        for p in path:
+            if isinstance(d, dict) and p in d or \
+                    isinstance(d, list) and isinstance(p, int) and 0 <= p < len(d):
+                d = lazyjson.resolve(d, p)
+            else:
+                return _MISSING
+        return d
+
+    # Операции пакета для замены подстроки old на new во всех строковых значениях документа.
+    # Документ не меняется: ленивые поддеревья читаются только на время обхода, поэтому
+    # обход можно вести в фоне. progress(число узлов)
+    def replacements(self, old, new, progress=None):
+        operations = []
+        stack = [((), self.data)]
+        count = 0
+        while stack:
+            path, value = stack.pop()
+            count += 1
+            if progress and count % PROGRESS_STEP == 0:
+                progress(count)
+            if isinstance(value, lazyjson.LazyValue):
+                value = value.load()
+            if isinstance(value, str):
+                if path and old in value:
+                    operations.append(('update_node_value', path, value.replace(old, new)))
+            elif isinstance(value, dict):
+                stack.extend((path + (key,), child) for key, child in reversed(value.items()))
+            elif isinstance(value, list):
+                stack.extend((path + (i,), value[i]) for i in range(len(value) - 1, -1, -1))
+        return operations
+
+    # JSON Patch
+
+    # Патч JSON Patch (RFC 6902) одной транзакцией, как пакет правок: при ошибке документ
+    # остаётся прежним, в истории отмены и в журнале патч - один шаг. Указатели разбираются
+    # один раз до выполнения, а контейнер для идущих подряд операций с общим родителем
+    # находится один раз. Возвращает пути изменённых узлов, как apply_batch
+    @_journaled
+    def apply_patch(self, operations, title="JSON Patch"):
+        if self.data_type != "json":
+            raise TypeError("JSON Patch применяется только к JSON документам.")
+        parsed = patch.parse(operations)
+        # Родитель предыдущей операции: (токены указателя, путь, контейнер)
+        parent = None
+        with self._transaction(title) as changes:
+            for number, (op, tokens, source, value) in enumerate(parsed, start=1):
+                try:
+                    parent = self._patch_operation(op, tokens, source, value, parent)
+                except Exception as e:
+                    raise ValueError(f"Операция {number} ({op} {operations[number - 1]['path']}) "
+                                     f"не выполнилась: {e} JSON Patch отменён.") from e
+        return self._changed_paths(changes)
+
+    # Одна операция патча внутри транзакции apply_patch. Возвращает родителя её узла
+    # для следующей операции
+    def _patch_operation(self, op, tokens, source, value, parent):
+        if not tokens:
+            if op != 'test':
+                raise ValueError("Весь документ патчем заменить нельзя.")
+            if not patch.equal(self.data, value):
+                raise ValueError("Документ не совпадает с проверяемым значением.")
+            return parent
+        changes = []
+        if op in ('move', 'copy'):
+            if source == tokens:
+                return parent
+            source_path, container = self._patch_parent(source[:-1])
+            key = self._patch_key(container, source[-1])
+            value = container[key]
+            if op == 'move':
+                changes.append(self._patch_remove(source_path, container, key))
+                # Удаление могло сдвинуть элементы массивов на пути к родителю
+                if parent is not None and parent[0] != source[:-1]:
+                    parent = None
+            else:
+                value = patch.snapshot(value)
+            op = 'add'
+        elif op in ('add', 'replace'):
+            value = patch.snapshot(value)
+        if parent is None or parent[0] != tokens[:-1]:
+            parent = (tokens[:-1],) + self._patch_parent(tokens[:-1])
+        _, path, container = parent
+        key = self._patch_key(container, tokens[-1], append=op == 'add')
+        if op == 'test':
+            if not patch.equal(lazyjson.resolve(container, key), value):
+                raise ValueError("Значение не совпадает с проверяемым.")
+        elif op == 'remove':
+            changes.append(self._patch_remove(path, container, key))
+        elif isinstance(container, list) and op == 'add':
+            changes.append(('insert', path, key, value, key, None))
+        elif op == 'add' and key not in container:
+            changes.append(('insert', path, key, value, len(container), None))
+        else:
+            changes.append(('set', path, key, container[key], value))
+        if changes and changes[-1][0] != 'remove':
+            self._patch_apply(changes[-1], container)
+        # Перенос записывается вместе: удаление и вставка того же узла дают одну операцию move
+        self._batch_patch.extend(patch.from_changes(changes))
+        return parent
+
+    # Изменение сразу попадает в транзакцию, чтобы при ошибке дальше по патчу его отменили
+    def _patch_apply(self, change, container):
+        self._apply_change(change, container)
+        self._batch.append(change)
+        return change
+
+    # Удаление выполняется сразу: контейнер следующего узла ищется уже после него
+    def _patch_remove(self, path, container, key):
+        position = key if isinstance(container, list) else _position(container, key)
+        return self._patch_apply(('remove', path, key, container[key], position, None), container)
+
+    # Путь модели и контейнер по токенам указателя: объект или массив
+    def _patch_parent(self, tokens):
+        path = []
+        d = self.data
+        for token in tokens:
+            key = self._patch_key(d, token)
+            d = lazyjson.resolve(d, key)
+            path.append(key)
+        if not isinstance(d, (dict, list)):
+            raise ValueError(f"{patch.format_pointer(path)} - не объект и не массив.")
+        return tuple(path), d
+
+    # Ключ или индекс узла в контейнере по токену указателя. append=True - для добавления:
+    # ключа объекта может не быть, индекс массива может быть равен длине или '-'
+    def _patch_key(self, container, token, append=False):
+        if isinstance(container, list):
+            return patch.list_index(token, len(container), append)
+        if not isinstance(container, dict):
+            raise ValueError(f"Узел для '{token}' - не объект и не массив.")
+        if not append and token not in container:
+            raise ValueError(f"Ключа '{token}' нет.")
+        return token
+
+    # Правки, которые сейчас можно отменить (с открытия документа, а если ведётся журнал -
+    # с последнего сохранения), в виде JSON Patch: применённый к исходному файлу,
+    # он даёт текущий документ
+    def export_patch(self):
+        if self.data_type != "json":
+            raise TypeError("Правки выгружаются в JSON Patch только для JSON документов.")
+        return self.history.patch()
+
+    def save_patch(self, file_path):
+        ops = self.export_patch()
+        with atomic_write(file_path) as file:
+            file.write(patch.dumps(ops).encode('utf-8'))
+        return len(ops)
+
+    # Журнал правок
+
+    # Начало журнала правок открытого документа. Если остался журнал прошлого сеанса,
+    # начатый для этой же версии файла, его правки проигрываются заново, вместе с историей
+    # отмены. На первой операции, которая не выполняется, проигрывание останавливается,
+    # и она с последующими отбрасывается. Возвращает (число проигранных операций, ошибка или None).
+    # progress(проиграно операций, всего)
+    def open_journal(self, progress=None):
+        self.close_journal()
+        journal = EditJournal(self.file_path)
+        operations = journal.pending()
+        done, error = 0, None
+        for name, args, kwargs, ok in operations:
+            if name not in _JOURNALED:
+                error = ValueError(f"Неизвестная операция журнала: {name}.")
+                break
+            try:
+                getattr(self, name)(*args, **kwargs)
+            except Exception as e:
+                if ok:
+                    error = e
+                    break
+            else:
+                if not ok:
+                    error = ValueError(f"Операция журнала {name} выполнилась, а в прошлом сеансе - нет.")
+                    break
+            done += 1
+            if progress:
+                progress(done, len(operations))
+        if operations:
+            journal.resume(done)
+        self.journal = journal
+        return done, error
+
+    def _journal_call(self, name, args, kwargs, ok):
+        # Операции пакета в журнал не пишутся: пакет записывается одной операцией
+        if self.journal is None or self._batch is not None:
+            return
+        kwargs.pop('parent', None)
         try:
-            validate(instance=self.data, schema=schema)
+            self.journal.append(name, args, kwargs, ok)
+        except OSError as e:
+            # Правка уже сделана; без журнала она сохранится только вместе с документом
+            self.journal_error = e
+            self.journal = None
+
+    # Ошибка записи в журнал правок, если она была с прошлого вызова (журнал после неё отключён)
+    def take_journal_error(self):
+        error, self.journal_error = self.journal_error, None
+        return error
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # Документ больше не нужен (загрузку отменили или она не удалась): журнал закрывается,
+    # а его файл остаётся для следующего открытия. Ссылки на документ сбрасываются, и вместе
+    # с последним ленивым поддеревом освобождается отображённый в память файл
+    def close(self):
+        self.close_journal()
+        self.xml_root = None
+        self._reset_xml_maps()
+        self.data = None
+        self.data_type = None
+        self.search_index = None
+        self._xpath_tree = None
+        self.history.clear()
+        self._reset_validation()
+
+    # Документ записан в file_path: правки из журнала теперь в файле, журнал больше не нужен.
+    # Следующие правки пишутся в журнал того файла, куда документ сохранён. Журнал проигрывается
+    # от сохранённого файла, поэтому отменить правки до сохранения уже нельзя
+    def _saved(self, file_path):
+        self.file_path = file_path
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = EditJournal(file_path)
+            self.history.clear()
+            if self.data_type == "xml":
+                # Ключи повторяющихся элементов за сеанс могли разойтись с теми, что даст загрузка
+                # сохранённого файла, а журнал проигрывается после неё: ключи назначаются заново.
+                # Без дерева lxml словарь читается из сохранённого файла, как при открытии
+                self._key_counter = itertools.count()
+                if self.xml_root is not None:
+                    self._data = self._build_xml_view(self.xml_root)
+                else:
+                    with open(file_path, 'rb') as file:
+                        self._data, _ = self._parse_xml_dict(file)
+                self.search_index = None
+                self._xpath_tree = None
+                self._reset_validation()
+
+    # Валидация JSON. schema - путь к файлу схемы (компилируется через кэш) или уже загруженная схема.
+    # incremental=True - проверяются только поддеревья, изменённые после последней
+    # успешной проверки по той же схеме; если это невозможно, проверяется весь документ
+    def validate_json(self, schema, incremental=False):
+        error = best_match(error for _, error in self._iter_json_errors(schema, incremental))
+        if error is None:
             return True, "JSON валиден."
-        except ValidationError as e:
-            return False, f"Ошибка валидации: {e.message}"
+        return False, f"Ошибка валидации: {error.message}"
+
+    # Все ошибки проверки по схеме: пары (путь к узлу, сообщение).
+    # Ошибки выдаются по мере проверки, её можно выполнять в фоновом потоке
+    # progress(число проверенных правил или построенных элементов) вызывается по ходу проверки
+    def iter_validation_errors(self, schema, incremental=False, progress=None):
+        if self.data_type == "json":
+            for path, error in self._iter_json_errors(schema, incremental, progress):
+                yield path, error.message
+        elif self.data_type == "xml":
+            yield from self.iter_xml_errors(schema, incremental, progress)
+        else:
+            raise TypeError("Не поддерживаемый тип данных.")
+
+    # Пары (путь от корня документа, ValidationError)
+    def _iter_json_errors(self, schema, incremental=False, progress=None):
+        self.materialize()
+        if isinstance(schema, dict):
+            cached = compile_json_schema(schema)
+        else:
+            cached = schema_cache.json_validator(schema)
+        # Состояние инкрементальной проверки привязано к валидатору из кэша
+        validator = with_progress(cached, progress, PROGRESS_STEP) if progress else cached
+        data = self.data
+        subtrees = self._dirty_subtrees(cached) if incremental else None
+        if subtrees is None:
+            self._reset_validation()
+            subtrees = [((), data, None)]
+        found = False
+        for path, node, sub in subtrees:
+            node_validator = validator if sub is None else validator.evolve(schema=sub)
+            for error in node_validator.iter_errors(node):
+                found = True
+                yield path + tuple(error.absolute_path), error
+        # Пока шла проверка в фоне, мог быть открыт другой документ
+        if not found and self.data is data:
+            self._valid_with = cached
+            self._dirty = set()
+
+    # Изменённые поддеревья вместе с подсхемами, которым они должны соответствовать.
+    # None - нужна полная проверка
+    def _dirty_subtrees(self, validator):
+        if self._valid_with is not validator:
+            return None
+        subtrees = []
+        for path in self._dirty:
+            schemas = subschema.for_path(validator.schema, self.data, path)
+            if schemas is None:
+                return None
+            node = self._walk(path)
+            subtrees.extend((path, node, sub) for sub in schemas)
+        return subtrees
+
+    def validate_new_json(self, schema):
+        return self.validate_json(schema)
 
     # Валидация XML
-    def validate_xml(self, schema_path):
-        xmlschema_doc = etree.parse(schema_path)
-        xmlschema = etree.XMLSchema(xmlschema_doc)
-        root = self._dict_to_etree(copy.deepcopy(self.data))
-        try:
-            xmlschema.assertValid(root)
+    # incremental=True - документ без изменений после успешной проверки по той же схеме
+    # повторно не проверяется. XSD проверяет только документ целиком, поэтому при любых
+    # изменениях выполняется полная проверка
+    def validate_xml(self, schema_path, incremental=False):
+        messages = [message for _, message in self.iter_xml_errors(schema_path, incremental)]
+        if not messages:
             return True, "XML валиден."
-        except etree.DocumentInvalid as e:
-            return False, f"Ошибка валидации: {e.error_log}"
+        return False, "Ошибка валидации: " + "\n".join(messages)
 
-    def xml_have_child_nodes(self, path):
-        d = self.data
+    # Ошибки проверки по XSD: пары (путь к элементу в словаре, сообщение)
+    def iter_xml_errors(self, schema_path, incremental=False, progress=None):
+        xmlschema = schema_cache.xml_schema(schema_path)
+        if incremental and self._valid_with is xmlschema and not self._dirty:
+            return
+        self._reset_validation()
+        # В режиме lxml проверяется само дерево. Вместо assertValid журнал ошибок
+        # читается после validate, чтобы сообщить обо всех ошибках, а не только о первой
+        native = self.xml_root is not None
+        document = self.xml_root if native else self.data
+        root = document if native else self._dict_to_etree(document, progress)
+        errors = validate_xml(xmlschema, root.getroottree())
+        if not errors:
+            if (self.xml_root if native else self.data) is document:
+                self._valid_with = xmlschema
+            return
+        error_path = self._xml_native_path if native else self._xml_error_path
+        for xpath, message in errors:
+            yield error_path(root, xpath), message
+
+    # Путь в словаре к элементу дерева lxml по XPath из журнала ошибок.
+    # Нужно словарное представление: оно строится здесь, если его ещё нет
+    def _xml_native_path(self, root, xpath):
+        found = root.getroottree().xpath(xpath) if xpath else []
+        if not found or not isinstance(found[0], etree._Element):
+            return ()
+        return self._xml_path_of(found[0], self._xml_node_keys()) or ()
+
+    # Путь модели к элементу или комментарию по ключам keys; None - узла в модели нет
+    def _xml_path_of(self, element, keys):
+        path = []
+        while element is not None:
+            key = keys.get(element)
+            if key is None:
+                return None
+            path.append(key)
+            element = element.getparent()
+        path.reverse()
+        return tuple(path)
+
+    # Путь в словаре к элементу, на который указывает XPath из журнала ошибок.
+    # Дети элемента в _dict_to_etree добавляются в порядке ключей словаря,
+    # поэтому номер элемента среди детей - номер ключа среди ключей-узлов
+    def _xml_error_path(self, root, xpath):
+        found = root.getroottree().xpath(xpath) if xpath else []
+        if not found or not isinstance(found[0], etree._Element):
+            return ()
+        element = found[0]
+        indexes = []
+        while element.getparent() is not None:
+            parent = element.getparent()
+            indexes.append(parent.index(element))
+            element = parent
+        key = next(iter(self.data))
+        path = [key]
+        body = self.data[key]
+        for index in reversed(indexes):
+            children = (k for k in body if not (k.startswith('@') or k == '#text'))
+            key = next(itertools.islice(children, index, None))
+            path.append(key)
+            body = body[key]
+        return tuple(path)
+
+    def xml_have_child_nodes(self, path, parent=None):
         try:
-            # Перемещаемся по пути до родителя узла
-            for p in path:
-                d = d[p]
+            d = self._node(path, parent)
             if self.data_type == "xml":
                 if isinstance(d, dict):
                     for child_key in d.keys():
@@ -419,50 +1591,21 @@ class DataModel:
             raise Exception("Ошибка!")
 
     def validate_new_xml(self, schema_path):
-        xmlschema_doc = etree.parse(schema_path)
-        xmlschema = etree.XMLSchema(xmlschema_doc)
-        root = self._dict_to_etree(copy.deepcopy(self.data))
-        try:
-            xmlschema.assertValid(root)
-            return True, "XML валиден."
-        except etree.DocumentInvalid as e:
-            return False, f"Ошибка валидации: {e.error_log}"
+        return self.validate_xml(schema_path)
+
+    # Проверка надёжности всех паролей документа: пары (путь, описание нарушений)
+    def audit_passwords(self, progress=None):
+        self.materialize()
+        return audit.iter_findings(self.data, progress)
 
     def validate_all_pass(self):
-        if isinstance(self.data, dict):
-            try:
-                self.validate_all_pass_recursive(self.data,"")
-                return
-            except Exception as e:
-                raise Exception(f"{e}")
+        findings = [f"Ошибка проверки пароля по пути {' > '.join(map(str, path))}:\n{message}"
+                    for path, message in self.audit_passwords()]
+        if findings:
+            raise Exception("\n".join(findings))
 
-    def validate_all_pass_recursive(self, body, path):
-        if isinstance(body, dict):
-            for key, value in body.items():
-                if re.search('pass|key|пароль|ключ', key) is not None:
-                    if isinstance(value, str):
-                        try:
-                            validate_pass(value)
-                        except Exception as e:
-                            raise Exception(f"Ошибка проверки пароля по пути {path} > {key}:\n"
-                                            f"{e}")
-                if isinstance(value, dict) or isinstance(value, list):
-                    self.validate_all_pass_recursive(value, f"{path} > {key}")
-        elif isinstance(body, list):
-            for key, value in enumerate(body):
-                if isinstance(value, dict) or isinstance(value, list):
-                    self.validate_all_pass_recursive(value, f"{path} > {key}")
 
 def validate_pass(password):
-    if len(password) < 8:
-        raise Exception("Пароль короче 8 символов")
-    elif re.search('[0-9]', password) is None:
-        raise Exception("В пароле нет цифр")
-    elif re.search('[A-Z]|[А-Я]', password) is None:
-        raise Exception("В пароле нет заглавных букв")
-    elif re.search('[a-z]|[А-Я]', password) is None:
-        raise Exception("В пароле нет строчных букв")
-    elif re.search('[@$!%*#?&]', password) is None:
-        raise Exception("В пароле нет спецсимволов")
-    else:
-        return
+    problems = audit.check_password(password)
+    if problems:
+        raise Exception(problems[0])
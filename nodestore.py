@@ -0,0 +1,308 @@
+# nodestore.py
+# Компактное хранение JSON документа для очень больших файлов. Вместо объекта Python
+# на каждый узел - строка в нескольких типизированных массивах (17 байт на узел,
+# у строк ещё 8 байт и текст в UTF-8; всего узлов и строк - до 2**31). Узлы лежат в порядке обхода в глубину: первый ребёнок
+# узла i - узел i + 1, следующий брат - через spans[i] узлов.
+# В модель документ попадает через StoredValue: объекты и списки разворачиваются
+# в обычные dict и list по одному уровню, когда к ним обращаются, так же как LazyValue
+import itertools
+import json
+from array import array
+
+import lazyjson
+from lazyjson import LazyValue
+
+# Типы узлов
+NULL, FALSE, TRUE, INT, FLOAT, STRING, BIGINT, DICT, LIST = range(9)
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+# Ключи объектов повторяются: одинаковые хранятся один раз, пока различных не больше стольких
+MAX_SHARED_KEYS = 100000
+_NO_KEY = -1
+_LBRACE = ord('{')
+
+
+class NodeStore:
+    """Документ JSON в массивах array, узел - номер строки.
+
+    kinds[i]  - тип узла;
+    keys[i]   - номер строки с ключом узла в объекте, -1 у элементов списков и корня;
+    values[i] - INT: само число, FLOAT: номер в floats, STRING и BIGINT: номер строки,
+                DICT и LIST: число детей;
+    spans[i]  - число узлов поддерева вместе с самим узлом.
+    Строки (и ключи) хранятся подряд в text, строка n - text[offsets[n]:offsets[n + 1]].
+    """
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.keys = array('i')
+        self.values = array('q')
+        self.spans = array('i')
+        self.floats = array('d')
+        self.text = bytearray()
+        self.offsets = array('q', [0])
+        # Ключ -> номер строки; нужен только при построении
+        self._shared_keys = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # Объём памяти под узлы и строки, в байтах
+    def nbytes(self):
+        columns = (self.kinds, self.keys, self.values, self.spans, self.floats, self.offsets)
+        return sum(column.itemsize * len(column) for column in columns) + len(self.text)
+
+    # Построение
+
+    def _add_string(self, text):
+        self.text += text.encode('utf-8', 'surrogatepass')
+        self.offsets.append(len(self.text))
+        return len(self.offsets) - 2
+
+    def _add_key(self, key):
+        if key is None:
+            return _NO_KEY
+        number = self._shared_keys.get(key)
+        if number is None:
+            number = self._add_string(key)
+            if len(self._shared_keys) < MAX_SHARED_KEYS:
+                self._shared_keys[key] = number
+        return number
+
+    # Объект или список, число детей и размер поддерева которого уточняются потом
+    def _add_container(self, key, kind):
+        self.kinds.append(kind)
+        self.keys.append(self._add_key(key))
+        self.values.append(0)
+        self.spans.append(1)
+        return len(self.kinds) - 1
+
+    # Добавление разобранного значения вместе с поддеревом
+    def add_value(self, key, value):
+        self._add_items(iter(((key, value),)))
+
+    # Добавление пар (ключ, значение) подряд, без рекурсии. Самый частый путь
+    # при загрузке, поэтому методы массивов взяты в локальные переменные
+    def _add_items(self, items):
+        kinds, spans, text, offsets = self.kinds, self.spans, self.text, self.offsets
+        add_kind, add_key, add_value, add_span = kinds.append, self.keys.append, self.values.append, spans.append
+        add_offset, add_float = offsets.append, self.floats.append
+        shared = self._shared_keys
+        stack = []
+        while True:
+            for key, value in items:
+                if key is None:
+                    add_key(_NO_KEY)
+                else:
+                    number = shared.get(key)
+                    add_key(self._add_key(key) if number is None else number)
+                add_span(1)
+                value_type = type(value)
+                if value_type is str:
+                    text += value.encode('utf-8', 'surrogatepass')
+                    add_offset(len(text))
+                    add_kind(STRING)
+                    add_value(len(offsets) - 2)
+                elif value_type is int:
+                    if _INT_MIN <= value <= _INT_MAX:
+                        add_kind(INT)
+                        add_value(value)
+                    else:
+                        add_kind(BIGINT)
+                        add_value(self._add_string(str(value)))
+                elif value_type is dict or value_type is list:
+                    add_kind(DICT if value_type is dict else LIST)
+                    add_value(len(value))
+                    if value:
+                        stack.append((len(kinds) - 1, items))
+                        items = _items(value)
+                        break
+                elif value_type is float:
+                    add_kind(FLOAT)
+                    add_value(len(self.floats))
+                    add_float(value)
+                elif value is None:
+                    add_kind(NULL)
+                    add_value(0)
+                elif value_type is bool:
+                    add_kind(TRUE if value else FALSE)
+                    add_value(0)
+                else:
+                    raise TypeError(f"Значение типа {value_type.__name__} не является JSON.")
+            else:
+                if not stack:
+                    return
+                index, items = stack.pop()
+                spans[index] = len(kinds) - index
+
+    # Добавление объекта или массива, который читается из файла пачками за один просмотр
+    # (см. lazyjson.iter_stream): в памяти одновременно только одна пачка.
+    # Возвращает позицию после контейнера в файле
+    def add_stream(self, key, source, start, progress=None):
+        stack = []
+        events = lazyjson.iter_stream(source, start, progress)
+        try:
+            while True:
+                try:
+                    event = next(events)
+                except StopIteration as stop:
+                    return stop.value
+                if event[0] == 'items':
+                    self.values[stack[-1]] += len(event[1])
+                    self._add_items(_items(event[1]))
+                elif event[0] == 'open':
+                    if stack:
+                        self.values[stack[-1]] += 1
+                        key = event[1]
+                    stack.append(self._add_container(key, DICT if event[2] == 'dict' else LIST))
+                else:
+                    index = stack.pop()
+                    self.spans[index] = len(self.kinds) - index
+        finally:
+            # Незаконченный просмотр файла держит его буфер: без этого файл не закрыть
+            events.close()
+
+    # Ключи для общих строк больше не нужны
+    def finish(self):
+        self._shared_keys = {}
+        return self
+
+    # Чтение
+
+    def key(self, index):
+        number = self.keys[index]
+        return None if number == _NO_KEY else self._string(number)
+
+    def _string(self, number):
+        return self.text[self.offsets[number]:self.offsets[number + 1]].decode('utf-8', 'surrogatepass')
+
+    # Номера детей узла по порядку
+    def children(self, index):
+        child = index + 1
+        for _ in range(self.values[index] if self.kinds[index] >= DICT else 0):
+            yield child
+            child += self.spans[child]
+
+    def _scalar(self, index):
+        kind = self.kinds[index]
+        if kind == INT:
+            return self.values[index]
+        if kind == STRING:
+            return self._string(self.values[index])
+        if kind == FLOAT:
+            return self.floats[self.values[index]]
+        if kind == BIGINT:
+            return int(self._string(self.values[index]))
+        return (None, False, True)[kind]
+
+    # Номер узла по пути от корня
+    def find(self, path):
+        index = 0
+        for step in path:
+            kind = self.kinds[index]
+            if kind == DICT:
+                # В JSON при повторе ключа действует последнее значение
+                found = [child for child in self.children(index) if self.key(child) == step]
+                if not found:
+                    raise KeyError(step)
+                index = found[-1]
+            elif kind == LIST and isinstance(step, int):
+                count = self.values[index]
+                if not -count <= step < count:
+                    raise IndexError(step)
+                index = next(itertools.islice(self.children(index), step % count, None))
+            else:
+                raise KeyError(step)
+        return index
+
+    # Значение узла по пути
+    def get(self, path):
+        return self.load(self.find(path))
+
+    # Один уровень узла: скаляры и пустые контейнеры - значениями, остальные объекты
+    # и списки - StoredValue
+    def materialize(self, index):
+        kind = self.kinds[index]
+        if kind < DICT:
+            return self._scalar(index)
+        values = []
+        for child in self.children(index):
+            child_kind = self.kinds[child]
+            if child_kind < DICT:
+                value = self._scalar(child)
+            elif self.values[child]:
+                value = StoredValue(self, child, 'dict' if child_kind == DICT else 'list')
+            else:
+                value = {} if child_kind == DICT else []
+            values.append((self.key(child), value) if kind == DICT else value)
+        return dict(values) if kind == DICT else values
+
+    # Всё поддерево узла обычными значениями Python, без рекурсии
+    def load(self, index):
+        if self.kinds[index] < DICT:
+            return self._scalar(index)
+        root = {} if self.kinds[index] == DICT else []
+        stack = [(root, self.children(index))]
+        while stack:
+            container, children = stack[-1]
+            for child in children:
+                kind = self.kinds[child]
+                value = self._scalar(child) if kind < DICT else {} if kind == DICT else []
+                if isinstance(container, dict):
+                    container[self.key(child)] = value
+                else:
+                    container.append(value)
+                if kind >= DICT and self.values[child]:
+                    stack.append((value, self.children(child)))
+                    break
+            else:
+                stack.pop()
+        return root
+
+    # Корень документа для модели: один уровень, остальное - StoredValue
+    def root(self):
+        return self.materialize(0)
+
+
+class StoredValue(LazyValue):
+    """Ещё не развёрнутый объект или массив из NodeStore.
+
+    source - хранилище, start - номер узла. Для модели и представления ведёт себя
+    как LazyValue: materialize() разворачивает один уровень, load() - всё поддерево.
+    """
+    __slots__ = ()
+
+    def __init__(self, store, index, kind):
+        super().__init__(store, index, None, kind)
+
+    def materialize(self):
+        return self.source.materialize(self.start)
+
+    def load(self):
+        return self.source.load(self.start)
+
+    def raw(self):
+        return json.dumps(self.load(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# Загрузка JSON файла в NodeStore. Файл после загрузки не нужен: хранилище на него не ссылается.
+# progress(разобрано байт, размер файла) вызывается по ходу разбора верхнего уровня
+def load(file_path, progress=None):
+    store = NodeStore()
+    source = lazyjson.LazySource(file_path)
+    try:
+        start = lazyjson.document_start(source.buf)
+        if lazyjson.is_streamable(source.buf, start):
+            end = store.add_stream(None, source, start, progress)
+            lazyjson.check_end(source.buf, end)
+        else:
+            store.add_value(None, lazyjson.loads_from(source.buf, start))
+    finally:
+        source.close()
+    return store.finish()
+
+
+# Пары (ключ, значение) детей; у элементов списка ключ None
+def _items(container):
+    if isinstance(container, dict):
+        return iter(container.items())
+    return zip(itertools.repeat(None), container)
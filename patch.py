@@ -0,0 +1,138 @@
+# patch.py
+# JSON Patch (RFC 6902): разбор и проверка операций, указатели JSON Pointer (RFC 6901)
+# и перевод изменений из истории правок в операции патча.
+# Сам патч к документу применяет DataModel.apply_patch, а правки сеанса в виде патча
+# отдаёт DataModel.export_patch
+import copy
+import json
+
+import lazyjson
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+# Обязательные члены операции кроме "op" и "path"
+_MEMBERS = {'add': ('value',), 'replace': ('value',), 'test': ('value',), 'move': ('from',), 'copy': ('from',)}
+
+
+# Указатель "/a/b~1c/0" -> ('a', 'b/c', '0'). Индексы массивов остаются строками:
+# число это или ключ объекта, решает контейнер, в котором идёт поиск
+def parse_pointer(pointer):
+    if not isinstance(pointer, str):
+        raise ValueError(f"Указатель должен быть строкой: {pointer!r}.")
+    if not pointer:
+        return ()
+    if not pointer.startswith('/'):
+        raise ValueError(f"Указатель должен начинаться с '/': {pointer!r}.")
+    tokens = pointer[1:].split('/')
+    if '~' in pointer:
+        return tuple(token.replace('~1', '/').replace('~0', '~') for token in tokens)
+    return tuple(tokens)
+
+
+# Путь модели -> указатель
+def format_pointer(path):
+    return ''.join('/' + str(p).replace('~', '~0').replace('/', '~1') for p in path)
+
+
+# Индекс массива из токена указателя. '-' - позиция после последнего элемента (только для add)
+def list_index(token, size, append=False):
+    if append and token == '-':
+        return size
+    if not (token.isascii() and token.isdigit()) or token != '0' and token.startswith('0'):
+        raise ValueError(f"'{token}' - не индекс массива.")
+    index = int(token)
+    if index > size or index == size and not append:
+        raise ValueError(f"Индекс {index} вне массива из {size} элементов.")
+    return index
+
+
+# Копия значения JSON: строки и числа неизменяемы, копируются только объекты и массивы
+def snapshot(value):
+    return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+# Чтение патча из файла
+def load(file_path):
+    with open(file_path, 'rb') as file:
+        return json.loads(file.read().decode('utf-8'))
+
+
+# Операции патча в виде (op, токены path, токены from или None, value или None).
+# Указатели разбираются здесь один раз. Ошибки формата собираются все сразу: ValueError
+def parse(operations):
+    if not isinstance(operations, list):
+        raise ValueError("JSON Patch должен быть массивом операций.")
+    parsed = []
+    problems = []
+    for number, operation in enumerate(operations, start=1):
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError("операция должна быть объектом.")
+            op = operation.get('op')
+            if op not in OPERATIONS:
+                raise ValueError(f"неизвестная операция {op!r}.")
+            for member in ('path',) + _MEMBERS.get(op, ()):
+                if member not in operation:
+                    raise ValueError(f"у операции {op} нет члена \"{member}\".")
+            path = parse_pointer(operation['path'])
+            source = parse_pointer(operation['from']) if op in ('move', 'copy') else None
+            if op == 'move' and path[:len(source)] == source and path != source:
+                raise ValueError("узел нельзя переместить внутрь самого себя.")
+            parsed.append((op, path, source, operation.get('value')))
+        except ValueError as e:
+            problems.append(f"{number}: {e}")
+    if problems:
+        raise ValueError("JSON Patch не применён:\n" + "\n".join(problems[:10]))
+    return parsed
+
+
+# Равенство значений JSON для операции test: числа сравниваются по значению,
+# но true не равно 1; ленивые поддеревья читаются целиком. Без рекурсии
+def equal(a, b):
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if isinstance(a, lazyjson.LazyValue):
+            a = a.load()
+        if isinstance(b, lazyjson.LazyValue):
+            b = b.load()
+        if isinstance(a, dict) and isinstance(b, dict):
+            if a.keys() != b.keys():
+                return False
+            stack.extend((a[key], b[key]) for key in a)
+        elif isinstance(a, list) and isinstance(b, list):
+            if len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+        elif isinstance(a, bool) or isinstance(b, bool) or \
+                isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+            if a is not b:
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+# Изменения одного шага истории (см. history.py) в виде операций патча. Значения копируются:
+# изменения хранят ссылки на узлы документа, которые следующие правки могут дополнить.
+# Удаление и следующая за ним вставка того же узла (переименование, перенос) - одна операция move
+def from_changes(changes):
+    ops = []
+    removed = None
+    for change in changes:
+        op, parent_path, key = change[:3]
+        pointer = format_pointer(parent_path + (key,))
+        if op == 'set':
+            ops.append({"op": "replace", "path": pointer, "value": snapshot(change[4])})
+        elif op == 'remove':
+            ops.append({"op": "remove", "path": pointer})
+        elif removed is not None and removed[3] is change[3]:
+            ops[-1] = {"op": "move", "from": ops[-1]["path"], "path": pointer}
+        else:
+            ops.append({"op": "add", "path": pointer, "value": snapshot(change[3])})
+        removed = change if op == 'remove' else None
+    return ops
+
+
+# Текст патча для записи в файл: ленивые поддеревья выписываются из исходного файла
+def dumps(ops, indent=2):
+    return json.dumps(ops, cls=lazyjson.LazyEncoder, ensure_ascii=False, indent=indent)
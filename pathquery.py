@@ -0,0 +1,346 @@
+# pathquery.py
+# Вычисление JSONPath над документом модели. Поддерживается:
+#   $ (корень; можно не писать), .key, ['key'], ["key"], .*, [*], ..key, ..*, ..[...]
+#   [0], [-1], [0,2], ['a','b'], срезы [1:10:2]
+#   фильтры [?(@.price < 10 && @.tags)], [?(@.name =~ '^a')], [?(!@.hidden)]
+# Найденные узлы выдаются путями по мере обхода, ленивые поддеревья при этом
+# разбираются только на время запроса
+import re
+
+from lazyjson import LazyValue
+
+
+class JSONPathError(ValueError):
+    """Ошибка в выражении JSONPath."""
+
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<op>\.\.|==|!=|<=|>=|&&|\|\||=~|[$@.\[\]()*,:?!<>])
+  | (?P<name>[^\s.\[\]()*,:?!<>=&|'"$@]+)
+)''', re.VERBOSE)
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+_LITERALS = {'true': True, 'false': False, 'null': None}
+_COMPARISONS = ('==', '!=', '<', '<=', '>', '>=', '=~')
+
+
+# Пути узлов документа data, выбранных выражением
+def iter_paths(data, expression):
+    steps = compile_jsonpath(expression)
+    nodes = iter([((), data)])
+    for descendant, selectors in steps:
+        nodes = _apply_step(nodes, descendant, selectors, data)
+    for path, _ in nodes:
+        yield path
+
+
+# Разбор выражения в список шагов (потомки на любой глубине?, селекторы)
+def compile_jsonpath(expression):
+    return _Parser(expression).parse()
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise JSONPathError(f"Непонятный символ в позиции {pos}: {expression[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', lambda m: _ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+        elif kind == 'number':
+            value = float(text) if any(c in text for c in '.eE') else int(text)
+        else:
+            value = text
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def accept(self, op):
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, op):
+        if not self.accept(op):
+            kind, value = self.peek()
+            found = "конец выражения" if kind is None else repr(value)
+            raise JSONPathError(f"Ожидалось '{op}', найдено {found}.")
+
+    def parse(self):
+        # Без '$' выражение считается путём от корня: items[*].price
+        if not self.accept('$') and self.peek()[0] in ('name', 'number'):
+            self.tokens.insert(self.pos, ('op', '.'))
+        steps = self.parse_steps(allow_descendant=True, allow_filters=True)
+        if self.peek()[0] is not None:
+            raise JSONPathError(f"Лишнее в конце выражения: {self.peek()[1]!r}")
+        return steps
+
+    # Шаги пути; в фильтрах допускаются только ключи и индексы
+    def parse_steps(self, allow_descendant, allow_filters):
+        steps = []
+        while True:
+            if allow_descendant and self.accept('..'):
+                if self.peek() == ('op', '['):
+                    self.take()
+                    steps.append((True, self.parse_bracket(allow_filters)))
+                else:
+                    steps.append((True, [self.parse_member()]))
+            elif self.accept('.'):
+                steps.append((False, [self.parse_member()]))
+            elif self.peek() == ('op', '['):
+                self.take()
+                steps.append((False, self.parse_bracket(allow_filters)))
+            else:
+                return steps
+            selectors = steps[-1][1]
+            if not allow_descendant and (len(selectors) != 1 or selectors[0][0] not in ('name', 'index')):
+                raise JSONPathError("В фильтре путь может содержать только ключи и индексы.")
+
+    def parse_member(self):
+        if self.accept('*'):
+            return ('wildcard',)
+        kind, value = self.take()
+        if kind in ('name', 'number'):
+            return ('name', str(value))
+        raise JSONPathError("После '.' ожидался ключ или '*'.")
+
+    def parse_bracket(self, allow_filters):
+        if self.accept('?'):
+            if not allow_filters:
+                raise JSONPathError("Вложенные фильтры не поддерживаются.")
+            selector = ('filter', self.parse_or())
+            self.expect(']')
+            return [selector]
+        selectors = []
+        while True:
+            selectors.append(self.parse_selector())
+            if self.accept(']'):
+                return selectors
+            self.expect(',')
+
+    def parse_selector(self):
+        if self.accept('*'):
+            return ('wildcard',)
+        kind, value = self.peek()
+        if kind == 'string':
+            self.take()
+            return ('name', value)
+        start = None
+        if kind == 'number':
+            self.take()
+            start = self._index(value)
+            if self.peek() != ('op', ':'):
+                return ('index', start)
+        elif self.peek() != ('op', ':'):
+            found = "конец выражения" if kind is None else repr(value)
+            raise JSONPathError(f"Ожидался селектор, найдено {found}.")
+        bounds = [start]
+        while self.accept(':'):
+            kind, value = self.peek()
+            if kind == 'number':
+                self.take()
+                bounds.append(self._index(value))
+            else:
+                bounds.append(None)
+        if len(bounds) > 3:
+            raise JSONPathError("В срезе больше двух ':'.")
+        bounds += [None] * (3 - len(bounds))
+        if bounds[2] == 0:
+            raise JSONPathError("Шаг среза не может быть нулевым.")
+        return ('slice', *bounds)
+
+    @staticmethod
+    def _index(value):
+        if not isinstance(value, int):
+            raise JSONPathError(f"Индекс должен быть целым числом: {value}.")
+        return value
+
+    # Выражение фильтра: || и && с обычным приоритетом, !, скобки, сравнения
+    def parse_or(self):
+        left = self.parse_and()
+        while self.accept('||'):
+            left = ('or', left, self.parse_and())
+        return left
+
+    def parse_and(self):
+        left = self.parse_unary()
+        while self.accept('&&'):
+            left = ('and', left, self.parse_unary())
+        return left
+
+    def parse_unary(self):
+        if self.accept('!'):
+            return ('not', self.parse_unary())
+        if self.accept('('):
+            inner = self.parse_or()
+            self.expect(')')
+            return inner
+        left = self.parse_operand()
+        kind, op = self.peek()
+        if kind == 'op' and op in _COMPARISONS:
+            self.take()
+            right = self.parse_operand()
+            if op == '=~':
+                if right[0] != 'literal' or not isinstance(right[1], str):
+                    raise JSONPathError("Справа от '=~' ожидалось регулярное выражение в кавычках.")
+                try:
+                    right = ('literal', re.compile(right[1]))
+                except re.error as e:
+                    raise JSONPathError(f"Неверное регулярное выражение: {e}")
+            return ('compare', op, left, right)
+        return ('exists', left)
+
+    def parse_operand(self):
+        kind, value = self.take()
+        if kind == 'op' and value in ('@', '$'):
+            return ('path', value, self.parse_steps(allow_descendant=False, allow_filters=False))
+        if kind in ('string', 'number'):
+            return ('literal', value)
+        if kind == 'name' and value in _LITERALS:
+            return ('literal', _LITERALS[value])
+        found = "конец выражения" if kind is None else repr(value)
+        raise JSONPathError(f"Ожидалось значение или путь, найдено {found}.")
+
+
+# Значение ребёнка без изменения документа: ленивое поддерево разбирается на один уровень
+def _child(container, key):
+    value = container[key]
+    if isinstance(value, LazyValue):
+        value = value.materialize()
+    return value
+
+
+def _apply_step(nodes, descendant, selectors, root):
+    for path, value in nodes:
+        targets = _descendants(path, value) if descendant else ((path, value),)
+        for target_path, target in targets:
+            for selector in selectors:
+                yield from _select(target_path, target, selector, root)
+
+
+# Узел и все его потомки в порядке документа, без рекурсии
+def _descendants(path, value):
+    stack = [(path, value)]
+    while stack:
+        path, value = stack.pop()
+        yield path, value
+        if isinstance(value, dict):
+            stack.extend((path + (key,), _child(value, key)) for key in reversed(list(value)))
+        elif isinstance(value, list):
+            stack.extend((path + (i,), _child(value, i)) for i in range(len(value) - 1, -1, -1))
+
+
+def _select(path, value, selector, root):
+    kind = selector[0]
+    if kind == 'name':
+        key = selector[1]
+        if isinstance(value, dict) and key in value:
+            yield path + (key,), _child(value, key)
+    elif kind == 'index':
+        if isinstance(value, list):
+            index = selector[1]
+            if index < 0:
+                index += len(value)
+            if 0 <= index < len(value):
+                yield path + (index,), _child(value, index)
+    elif kind == 'slice':
+        if isinstance(value, list):
+            for index in range(*slice(*selector[1:]).indices(len(value))):
+                yield path + (index,), _child(value, index)
+    elif kind == 'wildcard':
+        yield from _children(path, value)
+    else:
+        expression = selector[1]
+        for child_path, child in _children(path, value):
+            if _evaluate(expression, child, root):
+                yield child_path, child
+
+
+def _children(path, value):
+    if isinstance(value, dict):
+        for key in value:
+            yield path + (key,), _child(value, key)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            yield path + (index,), _child(value, index)
+
+
+_MISSING = object()
+
+
+def _evaluate(expression, current, root):
+    kind = expression[0]
+    if kind == 'or':
+        return _evaluate(expression[1], current, root) or _evaluate(expression[2], current, root)
+    if kind == 'and':
+        return _evaluate(expression[1], current, root) and _evaluate(expression[2], current, root)
+    if kind == 'not':
+        return not _evaluate(expression[1], current, root)
+    if kind == 'exists':
+        operand = expression[1]
+        if operand[0] == 'path':
+            return _operand(operand, current, root) is not _MISSING
+        return bool(operand[1])
+    _, op, left, right = expression
+    left = _operand(left, current, root)
+    right = _operand(right, current, root)
+    if left is _MISSING or right is _MISSING:
+        return op == '!=' and left is not right
+    if op == '=~':
+        return isinstance(left, str) and right.search(left) is not None
+    # true не равно 1: сравниваются значения одного типа JSON
+    if isinstance(left, bool) != isinstance(right, bool):
+        return op == '!='
+    if op == '==':
+        return left == right
+    if op == '!=':
+        return left != right
+    try:
+        match op:
+            case '<':
+                return left < right
+            case '<=':
+                return left <= right
+            case '>':
+                return left > right
+            case _:
+                return left >= right
+    except TypeError:
+        return False
+
+
+def _operand(operand, current, root):
+    if operand[0] == 'literal':
+        return operand[1]
+    _, origin, steps = operand
+    value = current if origin == '@' else root
+    for _, (selector,) in steps:
+        kind, key = selector
+        if kind == 'name' and isinstance(value, dict) and key in value:
+            value = _child(value, key)
+        elif kind == 'index' and isinstance(value, list) and -len(value) <= key < len(value):
+            value = _child(value, key)
+        else:
+            return _MISSING
+    return value
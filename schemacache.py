@@ -0,0 +1,161 @@
+# schemacache.py
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from jsonschema.validators import extend, validator_for
+from lxml import etree
+
+# Сколько скомпилированных схем хранится одновременно
+SCHEMA_CACHE_SIZE = 16
+
+
+class SchemaCache:
+    """LRU-кэш скомпилированных схем (JSON Schema и XSD) по пути и времени изменения файла."""
+
+    def __init__(self, maxsize=SCHEMA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Валидатор JSON Schema; метасхема проверяется один раз при компиляции
+    def json_validator(self, schema_path):
+        return self._get('json', schema_path, _compile_json_schema)
+
+    # Скомпилированная XSD схема
+    def xml_schema(self, schema_path):
+        return self._get('xml', schema_path, _compile_xml_schema)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def _get(self, kind, schema_path, compile_schema):
+        key = (kind, os.path.abspath(schema_path))
+        st = os.stat(schema_path)
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Компиляция вне блокировки: другие схемы в это время доступны
+        compiled = compile_schema(schema_path)
+        with self._lock:
+            self._entries[key] = (version, compiled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+
+def _compile_json_schema(schema_path):
+    with open(schema_path, 'r', encoding='utf-8') as file:
+        schema = json.load(file)
+    return compile_json_schema(schema)
+
+
+def compile_json_schema(schema):
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+# Классы валидаторов со счётчиком проверок: строятся один раз на класс валидатора из кэша
+_counting_classes = {}
+_counting_lock = threading.Lock()
+# Текущая проверка с прогрессом в этом потоке; её счётчик увеличивают обёрнутые ключевые слова
+_current = threading.local()
+
+
+def _counting_class(cls):
+    with _counting_lock:
+        counting = _counting_classes.get(cls)
+        if counting is None:
+            def wrap(check):
+                def counted(v, value, instance, schema):
+                    run = getattr(_current, 'run', None)
+                    if run is not None:
+                        run.tick()
+                    return check(v, value, instance, schema)
+                return counted
+
+            counting = _counting_classes[cls] = extend(
+                cls, {keyword: wrap(check) for keyword, check in cls.VALIDATORS.items()})
+        return counting
+
+
+class _ProgressRun:
+    def __init__(self, progress, step):
+        self.progress = progress
+        self.step = step
+        self.count = 0
+
+    def tick(self):
+        self.count += 1
+        if self.count % self.step == 0:
+            self.progress(self.count)
+
+
+class _ProgressValidator:
+    """Валидатор, который через каждые step проверок ключевых слов вызывает progress(число проверок)."""
+
+    def __init__(self, validator, run):
+        self.validator = validator
+        self.run = run
+
+    def evolve(self, **changes):
+        return _ProgressValidator(self.validator.evolve(**changes), self.run)
+
+    # Счётчик включается только на время шагов проверки: общий класс со счётчиком
+    # не считает чужие проверки, в том числе в других потоках
+    def iter_errors(self, instance):
+        errors = self.validator.iter_errors(instance)
+        while True:
+            previous = getattr(_current, 'run', None)
+            _current.run = self.run
+            try:
+                error = next(errors)
+            except StopIteration:
+                return
+            finally:
+                _current.run = previous
+            yield error
+
+
+def with_progress(validator, progress, step):
+    counting = _counting_class(type(validator))
+    # Валидаторы создаются только из схемы (compile_json_schema), поэтому валидатор со счётчиком
+    # создаётся так же: публичным конструктором из схемы и проверки форматов
+    counted = counting(validator.schema, format_checker=validator.format_checker)
+    return _ProgressValidator(counted, _ProgressRun(progress, step))
+
+
+def _compile_xml_schema(schema_path):
+    return etree.XMLSchema(etree.parse(schema_path))
+
+
+# validate() перезаписывает журнал ошибок самой схемы, а схема из кэша общая для всех потоков
+_xml_validation_lock = threading.Lock()
+
+
+# Проверка дерева по XSD схеме: список (XPath элемента, сообщение), пустой - документ валиден.
+# Проверка и чтение журнала идут под одной блокировкой, чтобы не получить ошибки чужой проверки
+def validate_xml(xmlschema, tree):
+    with _xml_validation_lock:
+        if xmlschema.validate(tree):
+            return []
+        return [(entry.path, entry.message) for entry in xmlschema.error_log]
+
+
+# Общий кэш приложения
+schema_cache = SchemaCache()
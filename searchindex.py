@@ -0,0 +1,220 @@
+# searchindex.py
+import bisect
+import heapq
+import re
+from array import array
+
+from lazyjson import LazyValue
+
+# Слова для поиска: последовательности букв, цифр и подчёркиваний
+_WORD = re.compile(r'\w+')
+# О ходе построения индекса сообщается через столько узлов
+PROGRESS_STEP = 10000
+# Сколько путей возвращает поиск
+MAX_RESULTS = 1000
+# Родитель удалённого узла
+_REMOVED = -2
+
+
+def words(text):
+    return _WORD.findall(text.lower())
+
+
+# Порядок путей, в которых на одном месте встречаются и индексы списков, и ключи объектов
+def _path_order(path):
+    return tuple((isinstance(key, str), key) for key in path)
+
+
+class SearchIndex:
+    """Инвертированный индекс по ключам и строковым значениям документа.
+
+    Слово -> номера узлов, в ключе или значении которых оно встречается, по возрастанию
+    в массиве array('q'): 8 байт на вхождение. Путь узла не хранится: у узла есть номер
+    родителя и ключ, путь собирается только для найденных узлов. Дети контейнера получают
+    номера подряд, поэтому ребёнок находится по номеру первого из них и месту ключа.
+    Модель поддерживает индекс при правках: поддерево убирается из индекса до изменения
+    и добавляется после, добавленные узлы получают новые номера. Слова хранятся ещё
+    и отсортированным списком, по которому за O(log n) находятся слова с заданным началом.
+    """
+
+    def __init__(self, key_text):
+        # key_text(ключ) -> текст ключа для поиска или None, если ключ не ищется
+        self.key_text = key_text
+        self._postings = {}
+        self._words = []
+        # Узлы по номерам: родитель (у корня -1, у удалённых узлов _REMOVED), ключ,
+        # номер первого ребёнка и число детей. Узел 0 - корень
+        self._parents = array('q', [-1])
+        self._keys = [None]
+        self._first = array('q', [0])
+        self._counts = array('q', [0])
+        # Узлы, добавленные правками вне блока детей родителя: (родитель, ключ) -> номер
+        self._added = {}
+        self._removed = 0
+
+    # Индекс всего документа. progress(число узлов) вызывается по ходу обхода
+    @classmethod
+    def build(cls, data, key_text, progress=None):
+        index = cls(key_text)
+        postings = index._postings
+        for node, tokens in index._nodes(0, data, progress):
+            for token in tokens:
+                nodes = postings.get(token)
+                if nodes is None:
+                    postings[token] = nodes = array('q')
+                nodes.append(node)
+        # Узлы обходятся не по порядку номеров
+        for token, nodes in postings.items():
+            postings[token] = array('q', sorted(nodes))
+        index._words = sorted(postings)
+        return index
+
+    # Добавление узла value по пути path вместе со всеми потомками
+    def add(self, path, value):
+        postings = self._postings
+        *parent_path, key = path
+        parent = self._node(parent_path)
+        if parent is None or self._child(parent, key) is not None:
+            return
+        node = self._added[(parent, key)] = self._allocate(parent, [key])
+        for node, tokens in self._nodes(node, value):
+            for token in tokens:
+                nodes = postings.get(token)
+                if nodes is None:
+                    postings[token] = nodes = array('q')
+                    bisect.insort(self._words, token)
+                bisect.insort(nodes, node)
+
+    # Удаление узла value по пути path вместе со всеми потомками
+    def remove(self, path, value):
+        node = self._node(path)
+        if node is None:
+            return
+        self._added.pop((self._parents[node], self._keys[node]), None)
+        postings = self._postings
+        for node, tokens in self._nodes(node, value, existing=True):
+            self._parents[node] = _REMOVED
+            self._removed += 1
+            for token in tokens:
+                nodes = postings.get(token)
+                if nodes is None:
+                    continue
+                i = bisect.bisect_left(nodes, node)
+                if i < len(nodes) and nodes[i] == node:
+                    del nodes[i]
+                if not nodes:
+                    del postings[token]
+                    del self._words[bisect.bisect_left(self._words, token)]
+
+    # Больше половины номеров у удалённых узлов: индекс дешевле построить заново
+    def fragmented(self):
+        return self._removed > len(self._keys) // 2
+
+    # Пути узлов, в которых есть все слова запроса; последнее слово может быть недописанным,
+    # поэтому каждое слово запроса ищется как начало слова. Возвращает (всего найдено, пути)
+    def search(self, query, limit=MAX_RESULTS):
+        found = None
+        # Длинные слова реже совпадают: пересечение быстрее сужается
+        for word in sorted(set(words(query)), key=len, reverse=True):
+            matches = set()
+            for token in self._prefixed(word):
+                matches.update(self._postings[token])
+            found = matches if found is None else found & matches
+            if not found:
+                return 0, []
+        if found is None:
+            return 0, []
+        # Результаты по порядку путей: предок перед потомками, элементы списка по индексу
+        try:
+            return len(found), heapq.nsmallest(limit, map(self._path, found))
+        except TypeError:
+            return len(found), heapq.nsmallest(limit, map(self._path, found), key=_path_order)
+
+    def _prefixed(self, prefix):
+        vocabulary = self._words
+        i = bisect.bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            yield vocabulary[i]
+            i += 1
+
+    # Путь узла по цепочке родителей
+    def _path(self, node):
+        path = []
+        parents, keys = self._parents, self._keys
+        while node:
+            path.append(keys[node])
+            node = parents[node]
+        path.reverse()
+        return tuple(path)
+
+    # Номер узла по пути или None, если его нет в индексе
+    def _node(self, path):
+        node = 0
+        for key in path:
+            node = self._child(node, key)
+            if node is None:
+                return None
+        return node
+
+    def _child(self, parent, key):
+        node = self._added.get((parent, key))
+        if node is not None:
+            return node
+        first, count = self._first[parent], self._counts[parent]
+        keys = self._keys
+        # Индекс элемента списка - его место в блоке, ключ объекта ищется в блоке
+        if isinstance(key, int) and 0 <= key < count and keys[first + key] == key:
+            node = first + key
+        else:
+            try:
+                node = keys.index(key, first, first + count)
+            except ValueError:
+                return None
+        return node if self._parents[node] == parent else None
+
+    # Номера подряд для детей parent с ключами keys; возвращает номер первого
+    def _allocate(self, parent, keys):
+        first = len(self._keys)
+        self._keys.extend(keys)
+        self._parents.extend([parent] * len(keys))
+        self._first.extend([0] * len(keys))
+        self._counts.extend([0] * len(keys))
+        return first
+
+    # Нерекурсивный обход поддерева с корнем в узле node: пары (номер, слова узла).
+    # Детям контейнера выделяется блок номеров; existing=True - поддерево уже в индексе,
+    # номера берутся оттуда. Ленивые поддеревья разбираются только на время обхода,
+    # документ не меняется
+    def _nodes(self, node, value, progress=None, existing=False):
+        stack = [(node, value)]
+        count = 0
+        while stack:
+            node, value = stack.pop()
+            count += 1
+            if progress and count % PROGRESS_STEP == 0:
+                progress(count)
+            if isinstance(value, LazyValue):
+                value = value.load()
+            tokens = set()
+            if node:
+                text = self.key_text(self._keys[node])
+                if text:
+                    tokens.update(words(text))
+            if isinstance(value, str):
+                tokens.update(words(value))
+            elif isinstance(value, (dict, list)):
+                if existing:
+                    first, size = self._first[node], self._counts[node]
+                    stack.extend((child, value[self._keys[child]]) for child in range(first, first + size)
+                                 if self._parents[child] == node)
+                    # И дети, добавленные правками после построения блока
+                    added = self._added
+                    if added:
+                        keys = value.keys() if isinstance(value, dict) else range(len(value))
+                        stack.extend((added[(node, key)], value[key]) for key in keys if (node, key) in added)
+                else:
+                    keys = list(value) if isinstance(value, dict) else range(len(value))
+                    first = self._first[node] = self._allocate(node, keys)
+                    self._counts[node] = len(keys)
+                    stack.extend(zip(range(first, first + len(keys)), value.values() if isinstance(value, dict) else value))
+            yield node, tokens
@@ -0,0 +1,274 @@
+# structindex.py
+# Просмотр очень больших JSON файлов без чтения их целиком. Файл отображается в память,
+# один проход по нему строит структурный индекс: для каждого объекта и массива - начало
+# и конец в файле, вид, число элементов и число вложенных контейнеров. Индекс сохраняется
+# в кэше и при повторном открытии того же файла тоже отображается в память.
+# Содержимое контейнера разбирается из отображённых байтов, только когда к нему обращаются:
+# читаются лишь его собственные элементы, вложенные контейнеры пропускаются по индексу
+import hashlib
+import json
+import mmap
+import os
+import re
+from array import array
+
+import lazyjson
+from lazyjson import LazySource, LazyValue
+
+# Каталог сохранённых индексов
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fileEditor', 'structindex')
+# Заголовок файла индекса: метка формата, размер и время изменения исходного файла, число контейнеров
+_MAGIC = b'JSIDX\x00\x00\x02'
+_HEADER_SIZE = len(_MAGIC) + 3 * 8
+# О ходе построения сообщается через столько найденных символов структуры (степень двойки минус 1)
+_PROGRESS_MASK = 0xFFFF
+
+_LBRACE, _LBRACKET, _RBRACE, _COMMA = ord('{'), ord('['), ord('}'), ord(',')
+# Ближайшая скобка или запятая вместе со всем текстом (и строками целиком) перед ней
+_STRUCTURE = re.compile(rb'[^"\[\]{},]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{},]*)*[\[\]{},]', re.DOTALL)
+_NON_SPACE = re.compile(rb'[^ \t\n\r]')
+_WHITESPACE = b' \t\n\r'
+
+
+class StructuralIndex:
+    """Объекты и массивы документа в порядке их начала в файле (обход в глубину).
+
+    starts[i], ends[i] - границы контейнера i в файле (ends - позиция после скобки);
+    counts[i] - число элементов; spans[i] - число контейнеров поддерева вместе с i;
+    kinds[i] - открывающая скобка, '{' или '['.
+    Первый вложенный контейнер i - это i + 1, следующий за ним на том же уровне -
+    через spans его поддерева.
+    """
+
+    def __init__(self, starts, ends, counts, spans, kinds):
+        self.starts = starts
+        self.ends = ends
+        self.counts = counts
+        self.spans = spans
+        self.kinds = kinds
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Вложенные контейнеры первого уровня
+    def children(self, node):
+        last = node + self.spans[node]
+        child = node + 1
+        while child < last:
+            yield child
+            child += self.spans[child]
+
+    # Один проход по файлу. progress(позиция, размер файла)
+    @classmethod
+    def build(cls, buf, start, progress=None):
+        starts, ends, counts, spans, kinds = array('q'), array('q'), array('q'), array('q'), array('B')
+        # Самый частый случай - запятая, поэтому всё нужное в цикле взято в локальные переменные
+        add_start, add_end, add_count, add_span, add_kind = \
+            starts.append, ends.append, counts.append, spans.append, kinds.append
+        # Открытые контейнеры: (номер, число запятых у родителя на момент открытия)
+        stack = []
+        commas = 0
+        for count, match in enumerate(_STRUCTURE.finditer(buf, start)):
+            pos = match.end() - 1
+            char = buf[pos]
+            if char == _COMMA:
+                commas += 1
+                continue
+            if progress and not count & _PROGRESS_MASK:
+                progress(pos, len(buf))
+            if char == _LBRACE or char == _LBRACKET:
+                stack.append((len(starts), commas))
+                add_start(pos)
+                add_end(0)
+                add_count(0)
+                add_span(0)
+                add_kind(char)
+                commas = 0
+                continue
+            if not stack:
+                raise _error("лишняя закрывающая скобка", pos)
+            node, parent_commas = stack.pop()
+            if (kinds[node] == _LBRACE) != (char == _RBRACE):
+                raise _error("скобки не соответствуют друг другу", pos)
+            ends[node] = pos + 1
+            spans[node] = len(starts) - node
+            if commas or node + 1 < len(starts) or _NON_SPACE.search(buf, starts[node] + 1, pos):
+                counts[node] = commas + 1
+            commas = parent_commas
+            if not stack:
+                lazyjson.check_end(buf, pos + 1)
+                return cls(starts, ends, counts, spans, kinds)
+        raise _error("неожиданный конец файла", start)
+
+    def write(self, file, size, mtime_ns):
+        file.write(_MAGIC)
+        array('q', [size, mtime_ns, len(self)]).tofile(file)
+        for column in (self.starts, self.ends, self.counts, self.spans, self.kinds):
+            column.tofile(file)
+
+    # Индекс из отображённого в память файла кэша, без копирования.
+    # None - индекс построен для другой версии файла или повреждён
+    @classmethod
+    def from_buffer(cls, buf, size, mtime_ns):
+        if len(buf) < _HEADER_SIZE or buf[:len(_MAGIC)] != _MAGIC:
+            return None
+        header = memoryview(buf)[len(_MAGIC):_HEADER_SIZE].cast('q')
+        if header[0] != size or header[1] != mtime_ns:
+            return None
+        length = header[2]
+        column_size = length * header.itemsize
+        if len(buf) != _HEADER_SIZE + 4 * column_size + length:
+            return None
+        view = memoryview(buf)
+        columns = [view[_HEADER_SIZE + i * column_size:_HEADER_SIZE + (i + 1) * column_size].cast('q')
+                   for i in range(4)]
+        kinds = view[_HEADER_SIZE + 4 * column_size:]
+        return cls(*columns, kinds)
+
+
+class MappedSource(LazySource):
+    """Отображённый в память JSON файл вместе со структурным индексом."""
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self.index = None
+        self._index_file = None
+        self._index_buf = None
+
+    def close(self):
+        self.index = None
+        if self._index_buf is not None:
+            self._index_buf.close()
+            self._index_file.close()
+        super().close()
+
+    # Индекс из кэша или, если его нет или файл изменился, построенный заново
+    def open_index(self, start, progress=None):
+        st = os.fstat(self._file.fileno())
+        cache_path = _cache_path(self.file_path)
+        self.index = self._read_cached(cache_path, st)
+        if self.index is None:
+            self.index = StructuralIndex.build(self.buf, start, progress)
+            _write_cache(cache_path, self.index, st)
+
+    def _read_cached(self, cache_path, st):
+        try:
+            file = open(cache_path, 'rb')
+        except OSError:
+            return None
+        try:
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            file.close()
+            return None
+        index = StructuralIndex.from_buffer(buf, st.st_size, st.st_mtime_ns)
+        if index is None:
+            buf.close()
+            file.close()
+            return None
+        self._index_file, self._index_buf = file, buf
+        return index
+
+    # Один уровень контейнера node: элементы разбираются из байтов между вложенными
+    # контейнерами, а сами вложенные контейнеры становятся IndexedValue
+    def materialize(self, node):
+        buf, index = self.buf, self.index
+        is_dict = index.kinds[node] == _LBRACE
+        children = list(index.children(node))
+        start, end = index.starts[node], index.ends[node]
+        if children and not is_dict and len(children) == index.counts[node]:
+            # Все элементы списка - контейнеры: между ними только запятые, и файл читается
+            # лишь в промежутках между ними. Если промежутки не такие, ошибку найдёт разбор ниже
+            starts, ends = index.starts, index.ends
+            gaps = [buf[ends[a]:starts[b]] for a, b in zip(children, children[1:])]
+            if (not buf[start + 1:starts[children[0]]].strip(_WHITESPACE)
+                    and not buf[ends[children[-1]]:end - 1].strip(_WHITESPACE)
+                    and all(gap.strip(_WHITESPACE) == b',' for gap in gaps)):
+                return [self.value(child) for child in children]
+        result = {} if is_dict else []
+        separators = lazyjson.Separators()
+        pos = start + 1
+        for child in children:
+            child_start = index.starts[child]
+            value = self.value(child)
+            if is_dict:
+                key_start, key_end = lazyjson.find_key(buf, child_start, pos)
+                lazyjson.add_batch(result, buf[pos:key_start], pos, separators)
+                separators.item(key_start)
+                result[json.loads(buf[key_start:key_end])] = value
+            else:
+                lazyjson.add_batch(result, buf[pos:child_start], pos, separators)
+                separators.item(child_start)
+                result.append(value)
+            pos = index.ends[child]
+        lazyjson.add_batch(result, buf[pos:end - 1], pos, separators)
+        separators.end()
+        return result
+
+    # Значение для модели: пустой контейнер сразу, непустой - IndexedValue
+    def value(self, node):
+        is_dict = self.index.kinds[node] == _LBRACE
+        if not self.index.counts[node]:
+            return {} if is_dict else []
+        return IndexedValue(self, node, 'dict' if is_dict else 'list')
+
+
+class IndexedValue(LazyValue):
+    """Ещё не разобранный объект или массив, границы которого известны из структурного индекса."""
+    __slots__ = ('node',)
+
+    def __init__(self, source, node, kind):
+        index = source.index
+        super().__init__(source, index.starts[node], index.ends[node], kind)
+        self.node = node
+
+    def materialize(self):
+        return self.source.materialize(self.node)
+
+    def __repr__(self):
+        count = self.source.index.counts[self.node]
+        return f'{{… {count}}}' if self.kind == 'dict' else f'[… {count}]'
+
+
+# Загрузка документа для просмотра: корень разбирается на один уровень, остальное -
+# по обращению. progress(разобрано байт, размер файла) вызывается при построении индекса
+def load(file_path, progress=None):
+    source = MappedSource(file_path)
+    try:
+        buf = source.buf
+        start = lazyjson.document_start(buf)
+        if start == len(buf) or buf[start] not in (_LBRACE, _LBRACKET):
+            value = lazyjson.loads_from(buf, start)
+            source.close()
+            return value
+        source.open_index(start, progress)
+        return source.materialize(0)
+    except BaseException:
+        source.close()
+        raise
+
+
+# Файл индекса в кэше: по абсолютному пути исходного файла
+def _cache_path(file_path):
+    name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8', 'surrogatepass')).hexdigest()
+    return os.path.join(CACHE_DIR, name + '.idx')
+
+
+# Сохранение индекса через временный файл. Без кэша всё работает, только повторное
+# открытие снова строит индекс, поэтому ошибки записи не прерывают загрузку
+def _write_cache(cache_path, index, st):
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            index.write(file, st.st_size, st.st_mtime_ns)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def _error(message, pos):
+    return ValueError(f"Некорректный JSON: {message} (байт {pos}).")
@@ -0,0 +1,93 @@
+# subschema.py
+import re
+from urllib.parse import unquote
+
+# Ключевые слова, при которых результат проверки предка зависит от значений
+# потомков не только через их собственные подсхемы: правку внутри такого предка
+# нельзя проверить отдельно от него
+_CONTEXT_KEYWORDS = frozenset((
+    "anyOf", "oneOf", "not", "if", "then", "else",
+    "enum", "const", "contains", "minContains", "maxContains", "uniqueItems",
+    "dependentSchemas", "dependencies", "unevaluatedProperties", "unevaluatedItems",
+    "$dynamicRef", "$recursiveRef",
+))
+
+
+# Подсхемы, которым должен соответствовать узел по пути path в документе data.
+# None - подсхемы однозначно не определить, нужна полная проверка.
+def for_path(root_schema, data, path):
+    schemas = [root_schema]
+    node = data
+    for key in path:
+        children = []
+        for schema in _expand(root_schema, schemas):
+            if schema is None or schema is False:
+                return None
+            if schema is True:
+                continue
+            # Вложенный $id меняет базу для $ref внутри подсхемы
+            if not _CONTEXT_KEYWORDS.isdisjoint(schema) or \
+                    ("$id" in schema and schema is not root_schema):
+                return None
+            children.extend(_child_schemas(schema, node, key))
+        schemas = children
+        node = node[key]
+    return schemas
+
+
+# Раскрытие $ref (только локальных) и allOf в плоский список схем
+def _expand(root_schema, schemas):
+    result = []
+    stack = list(reversed(schemas))
+    seen = set()
+    while stack:
+        schema = stack.pop()
+        if not isinstance(schema, dict):
+            result.append(schema)
+            continue
+        if id(schema) in seen:
+            continue
+        seen.add(id(schema))
+        result.append(schema)
+        if "$ref" in schema:
+            stack.append(_resolve_ref(root_schema, schema["$ref"]))
+        stack.extend(reversed(schema.get("allOf", ())))
+    return result
+
+
+def _resolve_ref(root_schema, ref):
+    if ref != '#' and not ref.startswith('#/'):
+        return None
+    target = root_schema
+    for part in ref[1:].split('/')[1:]:
+        part = unquote(part).replace('~1', '/').replace('~0', '~')
+        try:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None
+    return target
+
+
+def _child_schemas(schema, node, key):
+    if isinstance(node, dict):
+        result = []
+        properties = schema.get("properties", {})
+        if key in properties:
+            result.append(properties[key])
+        for pattern, sub in schema.get("patternProperties", {}).items():
+            if re.search(pattern, key):
+                result.append(sub)
+        if not result and "additionalProperties" in schema:
+            result.append(schema["additionalProperties"])
+        return result
+    items = schema.get("items")
+    if "prefixItems" in schema:
+        prefix = schema["prefixItems"]
+        if key < len(prefix):
+            return [prefix[key]]
+        return [items] if items is not None else []
+    if isinstance(items, list):
+        if key < len(items):
+            return [items[key]]
+        return [schema["additionalItems"]] if "additionalItems" in schema else []
+    return [items] if items is not None else []
@@ -0,0 +1,336 @@
+# test_model.py
+# Проверки DataModel: python -m unittest test_model
+import copy
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lxml import etree
+
+import lazyjson
+from model import DataModel
+
+
+class XmlRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _round_trip(self, source):
+        path = os.path.join(self.directory.name, 'source.xml')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(source)
+        model = DataModel()
+        model.load_xml(path)
+        saved_path = os.path.join(self.directory.name, 'saved.xml')
+        model.save_xml(saved_path)
+        saved = DataModel()
+        saved.load_xml(saved_path)
+        self.assertEqual(saved.data, model.data)
+        return etree.parse(saved_path).getroot()
+
+    # Смешанное содержимое пишется без отступов: пробелы не попадают в текст элементов
+    def test_mixed_content_is_not_indented(self):
+        root = self._round_trip('<root><p>hello <b>x</b> world</p><q><r>2</r></q></root>')
+        p = root.find('p')
+        self.assertEqual(p.text, 'hello')
+        self.assertIsNone(p.find('b').tail)
+        self.assertEqual(root.find('q/r').tail, '\n  ')
+
+    def test_nested_elements_inside_mixed_content(self):
+        root = self._round_trip('<root><p>hi<b><c>1</c><d/></b></p></root>')
+        b = root.find('p/b')
+        self.assertIsNone(b.text)
+        self.assertIsNone(b.find('c').tail)
+        self.assertIsNone(b.find('d').tail)
+
+
+def _write(directory, name, text):
+    path = os.path.join(directory.name, name)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    return path
+
+
+# Примеры из приложения A RFC 6902: (документ, патч, результат или None, если патч не применяется).
+# A.13 (повторный ключ "op") в виде списка словарей не записать
+RFC6902_EXAMPLES = {
+    'A.1': ({"foo": "bar"},
+            [{"op": "add", "path": "/baz", "value": "qux"}],
+            {"baz": "qux", "foo": "bar"}),
+    'A.2': ({"foo": ["bar", "baz"]},
+            [{"op": "add", "path": "/foo/1", "value": "qux"}],
+            {"foo": ["bar", "qux", "baz"]}),
+    'A.3': ({"baz": "qux", "foo": "bar"},
+            [{"op": "remove", "path": "/baz"}],
+            {"foo": "bar"}),
+    'A.4': ({"foo": ["bar", "qux", "baz"]},
+            [{"op": "remove", "path": "/foo/1"}],
+            {"foo": ["bar", "baz"]}),
+    'A.5': ({"baz": "qux", "foo": "bar"},
+            [{"op": "replace", "path": "/baz", "value": "boo"}],
+            {"baz": "boo", "foo": "bar"}),
+    'A.6': ({"foo": {"bar": "baz", "waldo": "fred"}, "qux": {"corge": "grault"}},
+            [{"op": "move", "from": "/foo/waldo", "path": "/qux/thud"}],
+            {"foo": {"bar": "baz"}, "qux": {"corge": "grault", "thud": "fred"}}),
+    'A.7': ({"foo": ["all", "grass", "cows", "eat"]},
+            [{"op": "move", "from": "/foo/1", "path": "/foo/3"}],
+            {"foo": ["all", "cows", "eat", "grass"]}),
+    'A.8': ({"baz": "qux", "foo": ["a", 2, "c"]},
+            [{"op": "test", "path": "/baz", "value": "qux"},
+             {"op": "test", "path": "/foo/1", "value": 2}],
+            {"baz": "qux", "foo": ["a", 2, "c"]}),
+    'A.9': ({"baz": "qux"},
+            [{"op": "test", "path": "/baz", "value": "bar"}],
+            None),
+    'A.10': ({"foo": "bar"},
+             [{"op": "add", "path": "/child", "value": {"grandchild": {}}}],
+             {"foo": "bar", "child": {"grandchild": {}}}),
+    'A.11': ({"foo": "bar"},
+             [{"op": "add", "path": "/baz", "value": "qux", "xyz": 123}],
+             {"foo": "bar", "baz": "qux"}),
+    'A.12': ({"foo": "bar"},
+             [{"op": "add", "path": "/baz/bat", "value": "qux"}],
+             None),
+    'A.14': ({"/": 9, "~1": 10},
+             [{"op": "test", "path": "/~01", "value": 10}],
+             {"/": 9, "~1": 10}),
+    'A.15': ({"/": 9, "~1": 10},
+             [{"op": "test", "path": "/~01", "value": "10"}],
+             None),
+    'A.16': ({"foo": ["bar"]},
+             [{"op": "add", "path": "/foo/-", "value": ["abc", "def"]}],
+             {"foo": ["bar", ["abc", "def"]]}),
+}
+
+
+class JsonPatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _load(self, document, name='source.json'):
+        model = DataModel()
+        model.load_json(_write(self.directory, name, json.dumps(document)), lazy=False)
+        return model
+
+    def test_rfc6902_examples(self):
+        for name, (document, operations, expected) in RFC6902_EXAMPLES.items():
+            with self.subTest(name):
+                model = self._load(document)
+                if expected is None:
+                    with self.assertRaises(ValueError):
+                        model.apply_patch(operations)
+                    self.assertEqual(model.data, document)
+                else:
+                    model.apply_patch(operations)
+                    self.assertEqual(model.data, expected)
+
+    # Выгруженный патч, применённый к исходному документу, даёт текущий
+    def test_export_patch_reproduces_edits(self):
+        for name, (document, operations, expected) in RFC6902_EXAMPLES.items():
+            if expected is None:
+                continue
+            with self.subTest(name):
+                model = self._load(document)
+                model.apply_patch(operations)
+                replay = self._load(document, 'replay.json')
+                replay.apply_patch(model.export_patch())
+                self.assertEqual(replay.data, expected)
+
+    # Ошибка в середине патча отменяет уже выполненные операции, а история отмены не меняется
+    def test_failed_patch_is_rolled_back(self):
+        document = {"foo": ["a", "b"], "bar": {"x": 1}}
+        model = self._load(document)
+        with self.assertRaises(ValueError):
+            model.apply_patch([
+                {"op": "add", "path": "/foo/0", "value": "z"},
+                {"op": "move", "from": "/bar/x", "path": "/foo/-"},
+                {"op": "remove", "path": "/missing"},
+            ])
+        self.assertEqual(model.data, document)
+        self.assertFalse(model.history.can_undo())
+        self.assertEqual(model.export_patch(), [])
+
+    def test_patch_is_one_undo_step(self):
+        model = self._load({"foo": ["a", "b"]})
+        model.apply_patch([
+            {"op": "add", "path": "/foo/-", "value": "c"},
+            {"op": "replace", "path": "/foo/0", "value": "z"},
+        ])
+        model.undo()
+        self.assertEqual(model.data, {"foo": ["a", "b"]})
+        model.redo()
+        self.assertEqual(model.data, {"foo": ["z", "b", "c"]})
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.document = {"a": {"b": 1, "c": [1, 2]}, "d": "text"}
+        self.model = DataModel()
+        self.model.load_json(_write(self.directory, 'source.json', json.dumps(self.document)), lazy=False)
+
+    # Операция, которая не выполнилась, отменяет весь пакет
+    def test_failed_operation_rolls_back_batch(self):
+        with self.assertRaises(ValueError):
+            self.model.apply_batch([
+                ('update_node_value', ('a', 'b'), 5),
+                ('add_node', ('a',), 'e', 'new'),
+                ('delete_node', ('a', 'c', 0), 0),
+                ('add_node', ('a',), 'e', 'again'),
+            ])
+        self.assertEqual(self.model.data, self.document)
+        self.assertFalse(self.model.history.can_undo())
+
+    # Ошибки, видные до выполнения, не меняют документ
+    def test_invalid_batch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.model.apply_batch([
+                ('update_node_value', ('a', 'b'), 5),
+                ('delete_node', ('missing',), 'missing'),
+            ])
+        self.assertEqual(self.model.data, self.document)
+
+    def test_batch_is_one_undo_step(self):
+        self.model.apply_batch([
+            ('update_node_value', ('a', 'b'), 5),
+            ('update_node_key', ('d',), 'text'),
+            ('delete_node', ('a', 'c', 0), 0),
+        ])
+        edited = copy.deepcopy(self.model.data)
+        self.assertEqual(edited, {"a": {"b": 5, "c": [2]}, "text": "text"})
+        self.model.undo()
+        self.assertEqual(self.model.data, self.document)
+        self.assertFalse(self.model.history.can_undo())
+        self.model.redo()
+        self.assertEqual(self.model.data, edited)
+
+
+class XmlEditTest(unittest.TestCase):
+    SOURCE = '<root a="1"><item>a</item><item>b</item><item>c</item><x><y>2</y></x></root>'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = _write(self.directory, 'source.xml', self.SOURCE)
+
+    def _load(self, native):
+        model = DataModel()
+        model.load_xml(self.path, native=native)
+        return model
+
+    # Повторные теги получают ключи с номером из общего счётчика, поэтому берутся из данных
+    @staticmethod
+    def _items(model):
+        return [key for key in model.data['root'] if key.startswith('item')]
+
+    def _edit(self, model):
+        second = self._items(model)[1]
+        model.update_node_value(('root', 'x', 'y', '#text'), '3')
+        model.add_node(('root', 'x'), 'z', None)
+        model.delete_node(('root', second), second)
+        model.update_node_key(('root', 'x'), 'w')
+        model.update_node_value(('root', '@a'), '9')
+        return 5
+
+    def test_undo_redo_round_trip(self):
+        for native in (False, True):
+            with self.subTest(native=native):
+                model = self._load(native)
+                original = copy.deepcopy(model.data)
+                steps = self._edit(model)
+                edited = copy.deepcopy(model.data)
+                for _ in range(steps):
+                    model.undo()
+                self.assertEqual(model.data, original)
+                self.assertFalse(model.history.can_undo())
+                for _ in range(steps):
+                    model.redo()
+                self.assertEqual(model.data, edited)
+                # Сохранённый после повтора файл совпадает с документом в памяти
+                saved_path = os.path.join(self.directory.name, 'saved.xml')
+                model.save_xml(saved_path)
+                saved = DataModel()
+                saved.load_xml(saved_path, native=native)
+                expected = DataModel()
+                expected.load_xml(_write(self.directory, 'expected.xml',
+                                         '<root a="9"><item>a</item><item>c</item>'
+                                         '<w><y>3</y><z/></w></root>'), native=native)
+                self.assertEqual(saved.data, expected.data)
+
+    # Правки после сохранения записаны в журнал с ключами, пронумерованными заново,
+    # и при следующем открытии проигрываются на сохранённом файле
+    def test_journal_replay_after_save(self):
+        for native in (False, True):
+            with self.subTest(native=native):
+                _write(self.directory, 'source.xml', self.SOURCE)
+                model = self._load(native)
+                self.assertEqual(model.open_journal(), (0, None))
+                first = self._items(model)[0]
+                model.delete_node(('root', first), first)
+                model.save_xml()
+                second = self._items(model)[1]
+                model.delete_node(('root', second), second)
+                expected = copy.deepcopy(model.data)
+                model.close_journal()
+
+                reopened = self._load(native)
+                self.assertEqual(reopened.open_journal(), (1, None))
+                self.assertEqual(reopened.data, expected)
+                reopened.undo()
+                self.assertEqual(len(self._items(reopened)), 2)
+                reopened.save_xml()
+                reopened.close_journal()
+
+
+class LazyJsonSeparatorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        # Маленькие порог и пакет: границы пакетов и большие дочерние узлы
+        # попадают рядом с запятыми
+        for name, value in (('LAZY_THRESHOLD', 20), ('BATCH_SIZE', 30)):
+            patcher = mock.patch.object(lazyjson, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _load(self, text, **options):
+        model = DataModel()
+        model.load_json(_write(self.directory, 'source.json', text), **options)
+        model.materialize()
+        return model.data
+
+    def test_valid_document_loads(self):
+        big = json.dumps({"k": "v" * 40, "n": list(range(12))})
+        text = '{"pad": "%s", "data": [%s, %s, 1, 2, 3]}' % ("p" * 30, big, big)
+        for options in ({'lazy': True}, {'compact': True}, {'mapped': True}):
+            with self.subTest(**options):
+                self.assertEqual(self._load(text, **options), json.loads(text))
+
+    def test_malformed_separators(self):
+        big = json.dumps({"k": "v" * 40})
+        small = ', '.join(['1'] * 20)
+        cases = [
+            '[%s,]' % big,
+            '[,%s]' % big,
+            '[%s,,%s]' % (big, big),
+            '[%s %s]' % (big, big),
+            '[%s, %s,]' % (small, small),
+            '[%s, %s %s]' % (small, big, small),
+            '{"a": %s, "b": %s,}' % (big, big),
+            '{"a": %s "b": %s}' % (big, big),
+        ]
+        for text in cases:
+            text = '{"pad": "%s", "data": %s}' % ("p" * 30, text)
+            for options in ({'lazy': True}, {'compact': True}, {'mapped': True}):
+                with self.subTest(text=text, **options):
+                    with self.assertRaises(ValueError):
+                        self._load(text, **options)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,18 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 
+import lazyjson
+from model import xml_tag
+
+# Длина сокращённого представления объектов и списков в колонке значений
+PREVIEW_LENGTH = 80
+# Теги строк с ошибками валидации: сам узел и его предки
+ERROR_TAGS = ('validation_error', 'validation_error_inside')
+# Теги строк, отличающихся от сравниваемого документа (diff.py), и их предков
+DIFF_TAGS = {'added': 'diff_added', 'changed': 'diff_changed', 'moved': 'diff_moved', 'inside': 'diff_inside'}
+# Как различие показывается в списке результатов
+DIFF_SIGNS = {'added': '+', 'removed': '-', 'changed': '~', 'moved': '↕'}
+
 
 class View(tk.Tk):
     def __init__(self):
@@ -9,16 +21,33 @@ class View(tk.Tk):
         self.details_entries = None
         self.details_labels = None
         self.tree = None
+        # Корень отображаемого документа
+        self.data = None
+        # Реестр строк дерева: id строки -> (id родительской строки, контейнер в модели, ключ).
+        # Узел модели для строки - container[key], без обхода дерева и пути от корня
+        self.nodes = {}
+        # Строки, дети которых ещё не вставлены в дерево
+        self.lazy_children = set()
+        # Ошибки валидации: список (путь, сообщение) и отметки строк дерева: путь -> тег
+        self.validation_errors = []
+        self.error_marks = {}
+        # Отметки различий с другим документом: путь -> тег
+        self.diff_marks = {}
+        # Пути узлов, найденных последним поиском, в порядке списка результатов
+        self.search_results = []
         self.controller = None
         self.title("XML и JSON Редактор")
         self.geometry("1200x700")
         self.current_file_type = None  # 'json' или 'xml'
         self.buttons = None
         self.create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self.on_quit)
 
     def create_widgets(self):
         self.create_menu()
         self.create_toolbar()
+        # Строка состояния упаковывается до панелей, чтобы они не вытеснили её
+        self.create_statusbar()
         self.create_paned_window()
         self.create_context_menu()
         self.bind_shortcuts()
@@ -30,27 +59,47 @@ class View(tk.Tk):
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Открыть JSON", command=lambda: self.on_open("json"))
         file_menu.add_command(label="Открыть XML", command=lambda: self.on_open("xml"))
+        file_menu.add_command(label="Открыть JSON для просмотра...", command=lambda: self.on_open("json", browse=True))
         file_menu.add_command(label="Сохранить", command=self.on_save)
         file_menu.add_command(label="Сохранить как...", command=lambda: self.on_save(as_new=True))
+        file_menu.add_command(label="Сохранить JSON компактно...",
+                              command=lambda: self.on_save(as_new=True, compact=True))
+        file_menu.add_separator()
+        file_menu.add_command(label="Применить JSON Patch...", command=self.on_apply_patch)
+        file_menu.add_command(label="Выгрузить правки в JSON Patch...", command=self.on_export_patch)
+        file_menu.add_command(label="Сравнить с файлом...", command=self.on_compare)
         file_menu.add_separator()
-        file_menu.add_command(label="Выйти", command=self.quit)
+        file_menu.add_command(label="Выйти", command=self.on_quit)
         menubar.add_cascade(label="Файл", menu=file_menu)
 
         # Меню "Правка"
         edit_menu = tk.Menu(menubar, tearoff=0)
+        edit_menu.add_command(label="Отменить", command=self.on_undo, accelerator="Ctrl+Z")
+        edit_menu.add_command(label="Повторить", command=self.on_redo, accelerator="Ctrl+Y")
+        edit_menu.add_separator()
         edit_menu.add_command(label="Добавить ...", command=self.on_add_node)
         edit_menu.add_separator()
         edit_menu.add_command(label="Изменить ключ", command=self.on_edit_node_key)
         edit_menu.add_command(label="Изменить значение", command=self.on_edit_node_value)
         edit_menu.add_separator()
         edit_menu.add_command(label="Удалить", command=self.on_delete_node)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Найти...", command=self.on_focus_search)
+        edit_menu.add_command(label="Запрос JSONPath / XPath...", command=self.on_query)
+        edit_menu.add_command(label="Выделить найденные", command=self.on_select_results)
+        edit_menu.add_command(label="Изменить значение найденных...", command=self.on_edit_results_value)
+        edit_menu.add_command(label="Заменить во всех значениях...", command=self.on_replace_all,
+                              accelerator="Ctrl+R")
         menubar.add_cascade(label="Правка", menu=edit_menu)
 
         # Меню "Валидация"
         validate_menu = tk.Menu(menubar, tearoff=0)
         validate_menu.add_command(label="Валидировать текущий документ", command=lambda: self.on_validate("current"))
+        validate_menu.add_command(label="Перепроверить изменения", command=lambda: self.on_validate("changes"))
         validate_menu.add_command(label="Валидировать другой документ", command=lambda: self.on_validate("other"))
         validate_menu.add_command(label="Валидировать пароли", command=lambda: self.on_validate("pass"))
+        validate_menu.add_separator()
+        validate_menu.add_command(label="Остановить проверку", command=self.on_cancel_task)
 
         menubar.add_cascade(label="Валидация", menu=validate_menu)
 
@@ -74,6 +123,13 @@ class View(tk.Tk):
 
         validate_btn = tk.Button(toolbar, text="Валидировать", command=lambda: self.on_validate("current"),state="disabled")
         validate_btn.pack(side=tk.LEFT, padx=2, pady=2)
+
+        # Поиск по ключам и значениям: слова запроса ищутся как начала слов
+        search_btn = tk.Button(toolbar, text="Найти", command=self.on_search)
+        search_btn.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.search_entry = ttk.Entry(toolbar, width=30)
+        self.search_entry.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.search_entry.bind("<Return>", lambda event: self.on_search())
         self.buttons = {
             "edit_key_btn": edit_key_btn,
             "edit_val_btn": edit_val_btn,
@@ -81,6 +137,16 @@ class View(tk.Tk):
         }
         toolbar.pack(side=tk.TOP, fill=tk.X)
 
+    def create_statusbar(self):
+        statusbar = tk.Frame(self, bd=1, relief=tk.SUNKEN)
+        self.status_label = ttk.Label(statusbar, text="")
+        self.status_label.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = ttk.Button(statusbar, text="Отмена", command=self.on_cancel_task, state="disabled")
+        self.cancel_btn.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.progressbar = ttk.Progressbar(statusbar, length=200, mode='determinate')
+        self.progressbar.pack(side=tk.RIGHT, padx=5)
+        statusbar.pack(side=tk.BOTTOM, fill=tk.X)
+
     def create_paned_window(self):
         paned_window = ttk.PanedWindow(self, orient=tk.HORIZONTAL)
         paned_window.pack(fill=tk.BOTH, expand=True)
@@ -104,6 +170,7 @@ class View(tk.Tk):
 
         self.tree.bind("<Double-1>", self.on_double_click)
         self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
         self.tree.bind("<Button-3>", self.show_context_menu)
 
     def create_details_panel(self, paned_window):
@@ -128,6 +195,33 @@ class View(tk.Tk):
         # save_btn = ttk.Button(details_frame, text="Сохранить изменения", command=self.on_save_details)
         # save_btn.grid(row=len(fields), column=1, sticky=tk.E, padx=5, pady=10)
 
+        # Ошибки валидации: выбор строки переходит к узлу в дереве
+        errors_label = ttk.Label(details_frame, text="Ошибки валидации:")
+        errors_label.grid(row=len(fields), column=0, sticky=tk.NW, padx=5, pady=5)
+        errors_frame = ttk.Frame(details_frame)
+        errors_frame.grid(row=len(fields), column=1, sticky=tk.NSEW, padx=5, pady=5)
+        details_frame.rowconfigure(len(fields), weight=1)
+        details_frame.columnconfigure(1, weight=1)
+        self.errors_list = tk.Listbox(errors_frame, activestyle='none')
+        errors_scroll = ttk.Scrollbar(errors_frame, orient=tk.VERTICAL, command=self.errors_list.yview)
+        self.errors_list.configure(yscrollcommand=errors_scroll.set)
+        errors_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.errors_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.errors_list.bind("<<ListboxSelect>>", self.on_error_select)
+
+        # Результаты поиска: выбор строки раскрывает и выделяет узел в дереве
+        self.search_label = ttk.Label(details_frame, text="Результаты поиска:")
+        self.search_label.grid(row=len(fields) + 1, column=0, sticky=tk.NW, padx=5, pady=5)
+        search_frame = ttk.Frame(details_frame)
+        search_frame.grid(row=len(fields) + 1, column=1, sticky=tk.NSEW, padx=5, pady=5)
+        details_frame.rowconfigure(len(fields) + 1, weight=1)
+        self.search_list = tk.Listbox(search_frame, activestyle='none')
+        search_scroll = ttk.Scrollbar(search_frame, orient=tk.VERTICAL, command=self.search_list.yview)
+        self.search_list.configure(yscrollcommand=search_scroll.set)
+        search_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.search_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.search_list.bind("<<ListboxSelect>>", self.on_search_select)
+
     def create_context_menu(self):
         self.context_menu = tk.Menu(self, tearoff=0)
         self.context_menu.add_command(label="Добавить ...", command=self.on_add_node)
@@ -145,16 +239,33 @@ class View(tk.Tk):
         self.bind_all("<Control-a>", lambda event: self.on_add_node())
         self.bind_all("<Control-A>", lambda event: self.on_add_node())
         self.bind_all("<Delete>", lambda event: self.on_delete_node())
+        self.bind_all("<Control-f>", lambda event: self.on_focus_search())
+        self.bind_all("<Control-F>", lambda event: self.on_focus_search())
+        self.bind_all("<Control-r>", lambda event: self.on_replace_all())
+        self.bind_all("<Control-R>", lambda event: self.on_replace_all())
+        self.bind_all("<Control-z>", lambda event: self.on_undo())
+        self.bind_all("<Control-Z>", lambda event: self.on_undo())
+        self.bind_all("<Control-y>", lambda event: self.on_redo())
+        self.bind_all("<Control-Y>", lambda event: self.on_redo())
 
     # Методы для привязки контроллера
     def set_controller(self, controller):
         self.controller = controller
 
-    def on_open(self, file_type):
-        self.controller.open_file(file_type)
+    def on_open(self, file_type, browse=False):
+        self.controller.open_file(file_type, browse)
+
+    def on_save(self, as_new=False, compact=False):
+        self.controller.save_file(as_new, compact)
+
+    def on_apply_patch(self):
+        self.controller.apply_patch_file()
 
-    def on_save(self, as_new=False):
-        self.controller.save_file(as_new)
+    def on_export_patch(self):
+        self.controller.export_patch()
+
+    def on_compare(self):
+        self.controller.compare_with_file()
 
     def on_add_node(self):
         self.on_add_node_dialog()
@@ -162,6 +273,12 @@ class View(tk.Tk):
     def on_delete_node(self):
         self.controller.delete_node()
 
+    def on_undo(self):
+        self.controller.undo()
+
+    def on_redo(self):
+        self.controller.redo()
+
     def on_edit_node_key(self):
         self.controller.edit_node_key()
 
@@ -171,15 +288,22 @@ class View(tk.Tk):
     def on_help(self):
         help_text = (
             f"Инструкция по использованию редактора:\n\n"
-            f"- Открытие файла: используйте меню 'Файл' > 'Открыть JSON/XML'.\n"
+            f"- Открытие файла: используйте меню 'Файл' > 'Открыть JSON/XML'. Очень большие JSON файлы удобнее "
+            f"открывать через 'Открыть JSON для просмотра...': читается только то, что раскрыто.\n"
             f"- Редактирование файла: после открытия файла используйте древовидный интерфейс для выбора узлов. "
             f"Щелкните на узел, чтобы выбрать его, затем выберите желаемое действие на верхней панели "
-            f"или в контекстном меню (ПКМ).\n"
+            f"или в контекстном меню (ПКМ). 'Правка' > 'Отменить' (Ctrl+Z) и 'Повторить' (Ctrl+Y) "
+            f"отменяют и возвращают правки по одной. 'Правка' > 'Заменить во всех значениях...' (Ctrl+R) "
+            f"заменяет текст во всех строковых значениях документа, и одна отмена возвращает всё.\n"
             f"- Валидация: в меню 'Валидация' выберите тип проверки. Для 'Валидировать текущий документ' "
             f"выберите схему, соответствующую документу. Для 'Валидировать другой документ' выберите сначала "
             f"файл для валидации, затем файл со схемой. Кнопка 'Валидировать' запускает проверку текущего документа.\n"
             f"- Сохранение: выберите 'Файл' > 'Сохранить' для сохранения изменений или 'Сохранить как...' "
-            f"для сохранения с новым именем.\n"
+            f"для сохранения с новым именем. 'Файл' > 'Выгрузить правки в JSON Patch...' сохраняет только "
+            f"изменения JSON документа, а 'Применить JSON Patch...' применяет такой файл к открытому документу.\n"
+            f"- Сравнение: 'Файл' > 'Сравнить с файлом...' сравнивает открытый документ с другой версией. "
+            f"Добавленные узлы выделяются зелёным, изменённые - жёлтым, переставленные - синим, а список "
+            f"различий появляется на месте результатов поиска.\n"
             f"- О программе: нажмите на кнопку 'О программе', чтобы узнать информацию об авторе и версии.\n"
             f"- Подсказки: нажмите на кнопку 'Помощь' для просмотра этой инструкции."
             f"\n"
@@ -208,6 +332,43 @@ class View(tk.Tk):
     def on_validate(self, target):
         self.controller.validate(target)
 
+    def on_cancel_task(self):
+        self.controller.cancel_task()
+
+    def on_quit(self):
+        self.controller.close()
+        self.quit()
+
+    def on_error_select(self, event):
+        selection = self.errors_list.curselection()
+        if selection:
+            path, _ = self.validation_errors[selection[0]]
+            self.show_node(path)
+
+    def on_search(self):
+        self.controller.search(self.search_entry.get())
+
+    def on_query(self):
+        self.controller.run_query()
+
+    def on_select_results(self):
+        self.controller.select_results()
+
+    def on_edit_results_value(self):
+        self.controller.edit_results_value()
+
+    def on_replace_all(self):
+        self.controller.replace_all()
+
+    def on_focus_search(self):
+        self.search_entry.focus_set()
+        self.search_entry.select_range(0, tk.END)
+
+    def on_search_select(self, event):
+        selection = self.search_list.curselection()
+        if selection:
+            self.show_node(self.search_results[selection[0]])
+
     def on_double_click(self, event):
         self.controller.edit_node_value()
 
@@ -335,113 +496,367 @@ class View(tk.Tk):
         self.controller.update_node(path, key, value, type_)
 
     # Методы для обновления интерфейса
+    # В дерево вставляется только верхний уровень, дети узла добавляются при его раскрытии
     def populate_tree(self, data):
         expansion_state = self.save_expansion_state()
 
         self.tree.delete(*self.tree.get_children())
+        self.nodes.clear()
+        self.lazy_children.clear()
+        self.data = data
 
-        self._populate_tree_recursive("", data)
+        self._populate_tree_level("", data)
+        self.apply_tags_colors()
 
         self.restore_expansion_state(expansion_state)
 
-    def _populate_tree_recursive(self, parent, data):
+    # Заглушка вместо ещё не вставленных детей: благодаря ей у узла есть значок раскрытия
+    def _add_lazy_children(self, node):
+        self.lazy_children.add(node)
+        self.tree.insert(node, 'end', text="", values=("",), tags=('placeholder', ''))
+
+    def on_tree_open(self, event):
+        self.expand_item(self.tree.focus())
+
+    # Вставка детей узла, если они ещё не вставлены
+    def expand_item(self, item):
+        if item not in self.lazy_children:
+            return
+        self.lazy_children.discard(item)
+        self.tree.delete(*self.tree.get_children(item))
+        self._populate_tree_level(item, self.node_value(item))
+
+    def _populate_tree_level(self, parent, data):
+        parent_path = self.item_path(parent) if self.error_marks or self.diff_marks else None
+        if isinstance(data, dict):
+            keys = data
+        elif isinstance(data, list) and self.current_file_type == "json":
+            keys = range(len(data))
+        else:
+            self.tree.insert(parent, 'end', text="Value", values=(data,), tags=('value',))
+            return
+        for key in keys:
+            node = self._insert_node(parent, data, key)
+            if parent_path is not None and parent_path + (key,) in self.error_marks:
+                self._add_tag(node, self.error_marks[parent_path + (key,)])
+            if parent_path is not None and parent_path + (key,) in self.diff_marks:
+                self._add_diff_tag(node, self.diff_marks[parent_path + (key,)])
+
+    # Вставка строки для элемента container[key]
+    def _insert_node(self, parent, container, key):
+        text, values, tags, has_children = self._node_row(container, key)
+        if self.current_file_type == "xml" and key == '#text':
+            # TODO: тут можно родителю текст давать
+            self.tree.item(parent, values=values)
+        node = self.tree.insert(parent, 'end', text=text, values=values, tags=tags)
+        self.nodes[node] = (parent, container, key)
+        if has_children:
+            self._add_lazy_children(node)
+        return node
+
+    # Текст, значения и теги строки дерева для элемента container[key]
+    def _node_row(self, container, key):
+        value = container[key]
         match self.current_file_type:
             case "xml":
-                if isinstance(data, dict):
-                    for key, value in data.items():
-                        key_without_num = ''
-
-                        key_split = key.split("_")
-                        if len(key_split) > 1:
-                            if key_split[-1].isdigit():
-                                key_without_num = "_".join(key_split[:-1])
-
-                        if key.startswith('@'):
-                            # Атрибуты
-                            display_key = key
-                            display_value = value
-                            self.tree.insert(parent, 'end', text=display_key, values=(display_value,),
-                                             tags=('attribute', key))
-                        elif '#comment' in key:
-                            display_value = value
-                            self.tree.insert(parent, 'end', text="#comment", values=(display_value,),
-                                             tags=('comment', key))
-                        # elif key == '#processing_instruction':
-                        #     for pi in value:
-                        #         self.tree.insert(parent, 'end', text="#processing_instruction", values=(pi,),
-                        #                          tags=('processing_instruction',))
-                        elif key == '#text':
-                            # TODO: тут можно родителю текст давать
-                            self.tree.item(parent, values=(value,))
-                            self.tree.insert(parent, 'end', text="#text", values=(value,), tags=('text', key))
-                        elif isinstance(value, dict):
-                            # TODO: кринж если он сделает abcd_1234
-                            if key_without_num != '':
-                                node = self.tree.insert(parent, 'end', text=key_without_num, values=("",),
-                                                        tags=('node', key))
-                                self._populate_tree_recursive(node, value)
-                            else:
-                                node = self.tree.insert(parent, 'end', text=key, values=("",),
-                                                        tags=('node', key))
-                                self._populate_tree_recursive(node, value)
-                        else:
-                            if key_without_num != '':
-                                self.tree.insert(parent, 'end', text=key_without_num, values=(value,),
-                                                 tags=('node', key))
-                            else:
-                                self.tree.insert(parent, 'end', text=key, values=(value,), tags=('node', key))
+                if key.startswith('@'):
+                    # Атрибуты
+                    return key, (value,), ('attribute', key), False
+                elif key.startswith('#comment'):
+                    return "#comment", (value,), ('comment', key), False
+                # elif key == '#processing_instruction':
+                #     for pi in value:
+                #         self.tree.insert(parent, 'end', text="#processing_instruction", values=(pi,),
+                #                          tags=('processing_instruction',))
+                elif key == '#text':
+                    return "#text", (value,), ('text', key), False
+                elif isinstance(value, dict):
+                    return xml_tag(key), (value.get('#text', ""),), ('node', key), bool(value)
                 else:
-                    self.tree.insert(parent, 'end', text="Value", values=(data,), tags=('value',))
+                    return xml_tag(key), (value,), ('node', key), False
             case "json":
-                if isinstance(data, dict):
-                    for key, value in data.items():
-                        tag = self.get_json_type_tag(value)
-                        node = self.tree.insert(parent, 'end', text=key, values=(str(value),), tags=(tag, key,))
-                        if isinstance(value, list) or isinstance(value, dict):
-                            self._populate_tree_recursive(node, value)
-                elif isinstance(data, list):
-                    for index, item in enumerate(data):
-                        tag = self.get_json_type_tag(item)
-                        node = self.tree.insert(parent, 'end', text=f"[{index}]", values=(item, index,),
-                                                tags=(tag, 'list_el',))
-                        if isinstance(item, list) or isinstance(item, dict):
-                            self._populate_tree_recursive(node, item)
+                tag = self.get_json_type_tag(value)
+                has_children = tag in ('dict', 'list') and bool(value)
+                if isinstance(container, list):
+                    return f"[{key}]", (self.format_preview(value), key,), (tag, 'list_el',), has_children
+                return key, (self.format_preview(value),), (tag, key,), has_children
+
+    # Доступ к узлам модели через реестр строк: O(1) на строку
+
+    # Контейнер и ключ узла строки
+    def node_ref(self, item):
+        _, container, key = self.nodes[item]
+        return container, key
+
+    # Значение узла строки (ленивое поддерево разбирается на месте)
+    def node_value(self, item):
+        _, container, key = self.nodes[item]
+        return lazyjson.resolve(container, key)
+
+    # Путь в модели от корня до узла строки: переходы по реестру, без обращений к Tk
+    def item_path(self, item):
+        path = []
+        while item:
+            item, _, key = self.nodes[item]
+            path.append(key)
+        return tuple(reversed(path))
+
+    # Точечное обновление дерева после изменений модели.
+    # path - путь к узлу в модели, как его возвращает Controller.get_path
+
+    # Добавление строки для нового ребёнка узла item
+    def insert_node(self, item, path, key):
+        if item not in self.lazy_children:
+            self._insert_node(item, self.node_value(item), key)
+        self._refresh_ancestors(item)
+
+    # Удаление строки узла и перенумерация следующих элементов списка
+    def remove_node(self, item, path):
+        parent, container, _ = self.nodes[item]
+        index = self.tree.index(item)
+        self._forget_subtree(item)
+        self.tree.delete(item)
+        if isinstance(container, list) and self.current_file_type == "json":
+            for i, sibling in enumerate(self.tree.get_children(parent)[index:], start=index):
+                self._render_node(sibling, container, i)
+        self._refresh_ancestors(parent)
+
+    # Переименование узла: в модели он переносится в конец родителя, в дереве тоже
+    def rename_node(self, item, path, new_key):
+        parent, container, key = self.nodes[item]
+        self._render_node(item, container, new_key)
+        if new_key != key:
+            self.tree.move(item, parent, 'end')
+        self._refresh_ancestors(parent)
+
+    # Перерисовка строки узла после изменения его значения
+    def refresh_node(self, item, path):
+        parent, container, key = self.nodes[item]
+        self._render_node(item, container, key)
+        if self.current_file_type == "xml":
+            if key == '#text':
+                # Текст показывается и в строке родителя
+                self.tree.item(parent, values=(container[key],))
+            elif isinstance(container[key], dict) and '#text' in container[key] \
+                    and item not in self.lazy_children:
+                text_item = self._find_child(item, '#text')
+                if text_item is not None:
+                    self._render_node(text_item, container[key], '#text')
                 else:
-                    self.get_json_type_tag(data)
-                    self.tree.insert(parent, 'end', text="Value", values=(data,), tags=('value',))
-        self.apply_tags_colors()
+                    self._insert_node(item, container[key], '#text')
+        self._refresh_ancestors(parent)
+
+    def _render_node(self, item, container, key):
+        text, values, tags, has_children = self._node_row(container, key)
+        # Отметки ошибок валидации и различий остаются до следующей проверки или сравнения
+        marks = tuple(tag for tag in self.tree.item(item, 'tags')
+                      if tag in ERROR_TAGS or tag in DIFF_TAGS.values())
+        self.tree.item(item, text=text, values=values, tags=tags + marks)
+        self.nodes[item] = (self.nodes[item][0], container, key)
+        if has_children and item not in self.lazy_children and not self.tree.get_children(item):
+            self._add_lazy_children(item)
+
+    # Обновление сокращённых значений у предков: O(глубина)
+    def _refresh_ancestors(self, item):
+        if self.current_file_type != "json":
+            return
+        while item:
+            parent, container, key = self.nodes[item]
+            self.tree.item(item, values=self._node_row(container, key)[1])
+            item = parent
+
+    # Удаление из реестра строк удаляемого поддерева
+    def _forget_subtree(self, item):
+        stack = [item]
+        while stack:
+            node = stack.pop()
+            self.lazy_children.discard(node)
+            if self.nodes.pop(node, None) is not None:
+                stack.extend(self.tree.get_children(node))
+
+    # Строка ребёнка узла item с ключом key среди уже вставленных
+    def _find_child(self, item, key):
+        children = self.tree.get_children(item)
+        if isinstance(key, int) and self.current_file_type == "json":
+            return children[key] if 0 <= key < len(children) else None
+        for child in children:
+            if child in self.nodes and self.nodes[child][2] == key:
+                return child
+        return None
+
+    # Раскрытие предков узла по пути path. Возвращает строку узла или ближайшего
+    # найденного предка, если узла уже нет
+    def reveal_node(self, path):
+        item = ''
+        for key in path:
+            if item:
+                self.expand_item(item)
+                self.tree.item(item, open=True)
+            child = self._find_child(item, key)
+            if child is None:
+                break
+            item = child
+        return item
+
+    # Раскрытие предков узла, выделение и прокрутка к нему
+    def show_node(self, path):
+        self.select_nodes([path])
+
+    def select_nodes(self, paths):
+        items = [item for item in map(self.reveal_node, paths) if item]
+        if items:
+            self.tree.selection_set(items)
+            self.tree.focus(items[0])
+            self.tree.see(items[0])
+
+    # Добавление ошибок валидации в список и отметка узлов: сам узел с ошибкой
+    # и его предки, чтобы было видно, какую ветку раскрывать
+    def add_validation_errors(self, errors):
+        for path, message in errors:
+            self.validation_errors.append((path, message))
+            self.errors_list.insert(tk.END, f"{' > '.join(map(str, path)) or '/'}: {message}")
+            self.error_marks[path] = 'validation_error'
+            for i in range(1, len(path)):
+                self.error_marks.setdefault(path[:i], 'validation_error_inside')
+            # Отметка уже вставленных строк вдоль пути
+            item = ''
+            for i, key in enumerate(path, start=1):
+                if item in self.lazy_children:
+                    break
+                item = self._find_child(item, key)
+                if item is None:
+                    break
+                self._add_tag(item, self.error_marks[path[:i]])
+
+    # Результаты поиска или запроса: total - сколько всего найдено, paths - показываемые пути
+    def show_search_results(self, paths, total, title="Результаты поиска"):
+        self.search_results = list(paths)
+        self.search_list.delete(0, tk.END)
+        for path in self.search_results:
+            value = self.data
+            for key in path:
+                value = lazyjson.resolve(value, key)
+            preview = self.format_preview(value)
+            if len(preview) > PREVIEW_LENGTH:
+                preview = preview[:PREVIEW_LENGTH] + '...'
+            self.search_list.insert(tk.END, f"{' > '.join(map(str, path)) or '/'}: {preview}")
+        shown = f", показаны первые {len(paths)}" if total > len(paths) else ""
+        self.search_label.config(text=f"{title} ({total}{shown}):")
+
+    # Различия с другим документом (diff.py) в списке результатов и отметки строк дерева.
+    # Пути отмечаются в открытом документе: удалённый узел - у контейнера, откуда он удалён.
+    # total - сколько всего различий
+    def show_differences(self, differences, total):
+        self.clear_differences()
+        self.search_results = []
+        self.search_list.delete(0, tk.END)
+        for kind, old_path, new_path in differences:
+            if kind == 'removed':
+                self.diff_marks.setdefault(new_path, DIFF_TAGS['inside'])
+                shown = old_path
+            else:
+                self.diff_marks[new_path] = DIFF_TAGS[kind]
+                shown = new_path
+            for i in range(len(new_path)):
+                self.diff_marks.setdefault(new_path[:i], DIFF_TAGS['inside'])
+            self.search_results.append(new_path)
+            self.search_list.insert(tk.END, f"{DIFF_SIGNS[kind]} {' > '.join(map(str, shown)) or '/'}")
+        # Отметка уже вставленных строк
+        stack = ['']
+        while stack:
+            item = stack.pop()
+            for child in self.tree.get_children(item):
+                if child in self.nodes:
+                    path = self.item_path(child)
+                    if path in self.diff_marks:
+                        self._add_diff_tag(child, self.diff_marks[path])
+                        stack.append(child)
+        shown = f", показаны первые {len(differences)}" if total > len(differences) else ""
+        self.search_label.config(text=f"Различия ({total}{shown}):")
+
+    def clear_differences(self):
+        self.diff_marks.clear()
+        for tag in DIFF_TAGS.values():
+            for item in self.tree.tag_has(tag):
+                tags = self.tree.item(item, 'tags')
+                self.tree.item(item, tags=tuple(t for t in tags if t not in DIFF_TAGS.values()))
+
+    def _add_diff_tag(self, item, tag):
+        tags = tuple(t for t in self.tree.item(item, 'tags') if t not in DIFF_TAGS.values())
+        self.tree.item(item, tags=tags + (tag,))
+
+    def clear_search_results(self):
+        self.search_results = []
+        self.search_list.delete(0, tk.END)
+        self.search_label.config(text="Результаты поиска:")
+
+    def clear_validation_errors(self):
+        self.validation_errors.clear()
+        self.error_marks.clear()
+        self.errors_list.delete(0, tk.END)
+        for tag in ERROR_TAGS:
+            for item in self.tree.tag_has(tag):
+                tags = self.tree.item(item, 'tags')
+                self.tree.item(item, tags=tuple(t for t in tags if t not in ERROR_TAGS))
+
+    def _add_tag(self, item, tag):
+        tags = tuple(t for t in self.tree.item(item, 'tags') if t not in ERROR_TAGS)
+        if 'validation_error' in self.tree.item(item, 'tags'):
+            tag = 'validation_error'
+        self.tree.item(item, tags=tags + (tag,))
 
     def save_expansion_state(self):
-        """Сохраняет состояние открытости всех узлов дерева по пути от корня."""
+        """Раскрытые узлы дерева: вложенный словарь {ключ узла в модели: раскрытые дети}."""
         state = {}
-        for item in self.tree.get_children(''):
-            self._save_expansion_state_recursive(item, state, [])
+        stack = [('', state)]
+        while stack:
+            item, level = stack.pop()
+            for child in self.tree.get_children(item):
+                if child in self.nodes and self.tree.item(child, 'open'):
+                    level[self.nodes[child][2]] = sub = {}
+                    stack.append((child, sub))
         return state
 
-    def _save_expansion_state_recursive(self, item, state, path):
-        # Добавляем текущий узел в путь
-        current_path = path + [self.tree.item(item, 'tags')[1]]
-        # Сохраняем состояние открытости узла
-        state[tuple(current_path)] = self.tree.item(item, 'open')
-        # Рекурсивно проходим по дочерним элементам
-        for child in self.tree.get_children(item):
-            self._save_expansion_state_recursive(child, state, current_path)
-
     def restore_expansion_state(self, state):
-        """Восстанавливает состояние открытости всех узлов дерева по пути."""
-
-        def find_node_by_path(current_item, current_path):
-            for child in self.tree.get_children(current_item):
-                if self.tree.item(child, 'tags')[1] == current_path[0]:
-                    if len(current_path) == 1:
-                        return child
-                    return find_node_by_path(child, current_path[1:])
-            return None
-
-        for path, is_open in state.items():
-            node = find_node_by_path('', list(path))
-            if node:
-                self.tree.item(node, open=is_open)
+        """Раскрывает узлы по сохранённому состоянию: один проход по детям раскрываемых узлов."""
+        stack = [('', state)]
+        while stack:
+            item, level = stack.pop()
+            if not level:
+                continue
+            for child in self.tree.get_children(item):
+                sub = level.get(self.nodes[child][2]) if child in self.nodes else None
+                if sub is not None:
+                    self.expand_item(child)
+                    self.tree.item(child, open=True)
+                    stack.append((child, sub))
+
+    # Значение для колонки "Значение": для объектов и списков - сокращённое,
+    # вложенные объекты не раскрываются
+    def format_preview(self, value):
+        if not isinstance(value, (dict, list)):
+            return str(value)
+        is_dict = isinstance(value, dict)
+        parts = []
+        length = 0
+        for key, item in (value.items() if is_dict else enumerate(value)):
+            if isinstance(item, dict):
+                text = '{...}' if item else '{}'
+            elif isinstance(item, list):
+                text = '[...]' if item else '[]'
+            else:
+                text = repr(item)
+            if is_dict:
+                text = f"{key!r}: {text}"
+            parts.append(text)
+            length += len(text) + 2
+            if length > PREVIEW_LENGTH:
+                parts.append('...')
+                break
+        preview = ', '.join(parts)
+        if len(preview) > PREVIEW_LENGTH:
+            preview = preview[:PREVIEW_LENGTH] + '...'
+        return f"{{{preview}}}" if is_dict else f"[{preview}]"
 
     def format_json_value(self, value):
         if isinstance(value, str):
@@ -467,6 +882,8 @@ class View(tk.Tk):
             return 'dict'
         elif isinstance(value, list):
             return 'list'
+        elif isinstance(value, lazyjson.LazyValue):
+            return value.kind
         else:
             return 'unknown'
 
@@ -498,6 +915,12 @@ class View(tk.Tk):
         self.tree.tag_configure('dict', foreground='teal')
         self.tree.tag_configure('list_el', foreground='orange')
         self.tree.tag_configure('unknown', foreground='black')
+        self.tree.tag_configure('validation_error', background='#f6c6c6')
+        self.tree.tag_configure('validation_error_inside', background='#fbe6e6')
+        self.tree.tag_configure('diff_added', background='#d6f5d6')
+        self.tree.tag_configure('diff_changed', background='#fff1b8')
+        self.tree.tag_configure('diff_moved', background='#dce8fc')
+        self.tree.tag_configure('diff_inside', background='#fffae6')
 
     def display_details(self, item):
         details = self.controller.get_node_details(item)
@@ -521,6 +944,29 @@ class View(tk.Tk):
         else:
             self.buttons["edit_val_btn"].config(state="disabled")
 
+    # Индикатор хода фоновой операции в строке состояния
+    def start_progress(self, text):
+        self.status_label.config(text=text)
+        self.progressbar.config(mode='indeterminate', value=0)
+        self.cancel_btn.config(state="normal")
+
+    # fraction - доля выполненного от 0 до 1 или None, если объём работы заранее неизвестен
+    def update_progress(self, text, fraction=None):
+        self.status_label.config(text=text)
+        if fraction is None:
+            self.progressbar.config(mode='indeterminate')
+            self.progressbar.step(2)
+        else:
+            self.progressbar.config(mode='determinate', value=fraction * 100)
+
+    def show_status(self, text):
+        self.status_label.config(text=text)
+
+    def stop_progress(self, text=""):
+        self.status_label.config(text=text)
+        self.progressbar.config(mode='determinate', value=0)
+        self.cancel_btn.config(state="disabled")
+
     def show_message(self, title, message):
         messagebox.showinfo(title, message)
 
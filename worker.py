@@ -0,0 +1,82 @@
+# worker.py
+import inspect
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Один рабочий поток: длительные операции над моделью выполняются строго по очереди
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="worker")
+
+
+class TaskCancelled(Exception):
+    """Задача остановлена пользователем."""
+
+
+class BackgroundTask:
+    """Выполнение длительной операции в рабочем потоке.
+
+    Функция вызывается с дополнительным аргументом progress(done, total=None):
+    через него она сообщает о ходе работы, а при остановке задачи он бросает
+    TaskCancelled. Если функция - генератор, его значения складываются в очередь
+    и забираются из потока интерфейса через poll(), иначе сохраняется результат.
+    Сам Tk из рабочего потока не вызывается.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.progress = None
+        self._cancel = threading.Event()
+        self._queue = queue.Queue()
+        _executor.submit(self._run, func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        try:
+            result = func(*args, progress=self.report, **kwargs)
+            if inspect.isgenerator(result):
+                try:
+                    for item in result:
+                        self._queue.put(item)
+                        if self._cancel.is_set():
+                            break
+                finally:
+                    result.close()
+            else:
+                self.result = result
+        except TaskCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._queue.put(_DONE)
+
+    # Вызывается из рабочего потока
+    def report(self, done, total=None):
+        self.progress = (done, total)
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    # Забрать накопленные результаты, не больше limit за раз, чтобы не задерживать интерфейс
+    def poll(self, limit=1000):
+        items = []
+        while len(items) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self.done = True
+                break
+            items.append(item)
+        return items
+
+
+_DONE = object()